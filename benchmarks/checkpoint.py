@@ -0,0 +1,48 @@
+"""
+Checkpoint benchmark: save/load time of the binary format vs pickle.
+
+Usage::
+
+    $ python benchmarks/checkpoint.py
+
+Registers from 1e3 to 1e6 intervals are serialized in memory (the
+ACIDFile copies cost the same for both formats).
+
+"""
+from time import perf_counter
+import pickle
+
+from binlog import checkpoint
+from binlog.register import Register
+
+
+def make_register(intervals, per_log=100000):
+    r = Register()
+    for n in range(intervals):
+        liidx, clidx = divmod(n, per_log)
+        r.reg.setdefault(liidx + 1, []).append((clidx * 2, clidx * 2))
+    return r
+
+
+def timeit(func, *args):
+    start = perf_counter()
+    result = func(*args)
+    return perf_counter() - start, result
+
+
+def run():
+    for exp in range(3, 7):
+        r = make_register(10 ** exp)
+
+        pdump, pdata = timeit(pickle.dumps, r)
+        pload, _ = timeit(pickle.loads, pdata)
+        bdump, bdata = timeit(checkpoint.dumps, r)
+        bload, _ = timeit(checkpoint.loads, bdata)
+
+        print("1e%d intervals: pickle save %.4fs load %.4fs (%d bytes) | "
+              "binary save %.4fs load %.4fs (%d bytes)" % (
+                  exp, pdump, pload, len(pdata), bdump, bload, len(bdata)))
+
+
+if __name__ == '__main__':
+    run()
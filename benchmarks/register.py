@@ -0,0 +1,65 @@
+"""
+Register benchmark: acknowledge records in random order.
+
+Usage::
+
+    $ python benchmarks/register.py [records] [workers] [subcount]
+
+The records are split in `workers` interleaved streams and each stream
+is acknowledged in a random order, like parallel workers would do.
+
+With a `subcount` greater than 1 every record is a block of a packed
+log with `subcount` messages, acknowledged one by one (also in random
+order), so many blocks are partially acknowledged at the same time.
+
+"""
+from random import shuffle
+from time import perf_counter
+import sys
+
+from binlog.binlog import Record, SubRecord
+from binlog.register import Register
+
+
+def run(records, workers, subcount=1):
+    streams = [[(clidx, subidx)
+                for clidx in range(w + 1, records + 1, workers)
+                for subidx in range(1, subcount + 1)]
+               for w in range(workers)]
+    for stream in streams:
+        shuffle(stream)
+
+    order = [ack for acks in zip(*streams) for ack in acks]
+    if subcount == 1:
+        acks = [Record(liidx=1, clidx=clidx, value=None)
+                for clidx, _ in order]
+    else:
+        acks = [SubRecord(liidx=1, clidx=clidx, value=None,
+                          subidx=subidx, subcount=subcount)
+                for clidx, subidx in order]
+
+    r = Register()
+    start = perf_counter()
+    peak = 0
+    for ack in acks:
+        r.add(ack)
+        peak = max(peak, len(r.partial))
+    add_time = perf_counter() - start
+
+    r.reset()
+    start = perf_counter()
+    for clidx in range(1, records + 1):
+        Record(liidx=1, clidx=clidx, value=None) in r
+    contains_time = perf_counter() - start
+
+    print("%d acks, %d workers, %d messages per block: add %.3fs "
+          "(%.1f us/ack, up to %d partial blocks), contains %.3fs" % (
+              len(acks), workers, subcount, add_time,
+              add_time / len(acks) * 1e6, peak, contains_time))
+
+
+if __name__ == '__main__':
+    records = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+    subcount = int(sys.argv[3]) if len(sys.argv) > 3 else 1
+    run(records, workers, subcount)
@@ -1,7 +1,10 @@
 from argparse import ArgumentParser
-import asyncio
+import socket
 
-from .server import Server
+from .constants import DURABILITY_SYNC, DURABILITY_WRITE_NOSYNC
+from .constants import DURABILITY_NOSYNC, DURABILITY_GROUP
+from .protocol import ACK_MESSAGE, ACK_BATCH
+from .server import Server, MAX_MESSAGE_SIZE, MAX_BUFFERED
 
 
 try:
@@ -15,11 +18,54 @@ def main():
     print("binlog v%s\n" % VERSION)
     parser = ArgumentParser()
     parser.add_argument("environment", nargs=1)
-    parser.add_argument("socket", nargs=1)
+    parser.add_argument("socket", nargs='?',
+                        help="stream socket (optional with --datagram)")
+    parser.add_argument("--datagram", metavar="SOCKET",
+                        help="also receive the messages as datagrams")
+    parser.add_argument("--framed", action="store_true",
+                        help="persistent connections with framed messages")
+    parser.add_argument("--ack", choices=[ACK_MESSAGE, ACK_BATCH],
+                        help="reply with the positions (implies --framed)")
+    parser.add_argument("--durability", default=DURABILITY_SYNC,
+                        choices=[DURABILITY_SYNC, DURABILITY_WRITE_NOSYNC,
+                                 DURABILITY_NOSYNC, DURABILITY_GROUP])
+    parser.add_argument("--packed", action="store_true",
+                        help="store the messages in blocks")
+    parser.add_argument("--compression", choices=["zlib", "lzma"],
+                        help="compress the blocks (or messages)")
+    parser.add_argument("--zdict", metavar="FILE",
+                        help="zlib preset dictionary")
+    parser.add_argument("--max-log-bytes", type=int,
+                        help="rotate the logs at this size (bytes)")
+    parser.add_argument("--max-log-age", type=float,
+                        help="rotate the logs at this age (seconds)")
+    parser.add_argument("--max-message-size", type=int,
+                        default=MAX_MESSAGE_SIZE,
+                        help="reject the larger messages (bytes)")
+    parser.add_argument("--max-buffered", type=int, default=MAX_BUFFERED,
+                        help="stop reading above this memory use (bytes)")
+    parser.add_argument("--backlog", type=int, default=socket.SOMAXCONN,
+                        help="maximum pending connections")
     args = parser.parse_args()
+    if args.socket is None and args.datagram is None:
+        parser.error("a socket or --datagram socket is required")
 
-    loop = asyncio.get_event_loop()
-    s = Server(args.environment[0], args.socket[0])
+    zdict = b''
+    if args.zdict is not None:
+        if args.compression != "zlib":
+            parser.error("--zdict requires --compression zlib")
+        with open(args.zdict, 'rb') as f:
+            zdict = f.read()
+
+    s = Server(args.environment[0], args.socket,
+               framed=args.framed or args.ack is not None, ack=args.ack,
+               backlog=args.backlog, durability=args.durability,
+               packed=args.packed, compression=args.compression,
+               zdict=zdict, max_log_bytes=args.max_log_bytes,
+               max_log_age=args.max_log_age,
+               max_message_size=args.max_message_size,
+               max_buffered=args.max_buffered,
+               datagram_path=args.datagram)
 
     s.run()
 
@@ -0,0 +1,401 @@
+"""
+asyncio interface.
+
+The BDB handles of an `AsyncReader` or an `AsyncWriter` are only used
+from executor threads (one operation at a time), so the event loop never
+blocks on BDB.
+
+"""
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+import asyncio
+import collections
+import logging
+import time
+
+from .constants import DURABILITY_GROUP
+from .notify import Listener
+from .reader import TDSReader, CDSReader
+from .writer import TDSWriter, CDSWriter
+
+logger = logging.getLogger(__name__)
+
+# Records read ahead by default.
+READ_AHEAD = 1000
+
+# Seconds between polls when no wakeup is received.
+POLL_INTERVAL = 1
+
+# Messages waiting to be written by an `AsyncWriter`.
+QUEUE_SIZE = 10000
+
+# Maximum messages written in one transaction.
+BATCH_SIZE = 1000
+
+# Threads of the executor shared by the `AsyncReader`s by default.
+READER_THREADS = 4
+
+_executor = None
+
+
+def default_executor():
+    """Return the executor shared by the `AsyncReader`s by default."""
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=READER_THREADS)
+    return _executor
+
+
+class AsyncReader:
+    """
+    Read the records of a binlog environment from asyncio.
+
+    ::
+
+        async with TDSAsyncReader(path, checkpoint='reader') as reader:
+            async for record in reader:
+                ...
+                await reader.ack(record)
+                await reader.save()
+
+    The reader (`reader_class`) is opened in the `executor` by `open()`,
+    which `async with` and the first operation call. Without an
+    `executor` the readers share the one of `default_executor()`.
+
+    Up to `read_ahead` records (or `max_bytes` of values) are read in a
+    single call to the executor. The waits for new data use the writer
+    wakeups (polling every `poll_interval` seconds just in case).
+
+    """
+    reader_class = None
+
+    def __init__(self, path, checkpoint=None, read_ahead=READ_AHEAD,
+                 max_bytes=None, poll_interval=POLL_INTERVAL,
+                 executor=None, **kwargs):
+        self.path = path
+        self.read_ahead = read_ahead
+        self.max_bytes = max_bytes
+        self.poll_interval = poll_interval
+
+        if executor is None:
+            self.executor = default_executor()
+        else:
+            self.executor = executor
+
+        self.reader = None
+        self._reader_args = dict(kwargs, checkpoint=checkpoint)
+
+        self.buffer = collections.deque()
+        self.listener = None
+        self._loop = None
+        self._wakeup = None
+        self._lock = asyncio.Lock()
+
+    async def open(self):
+        """Open the reader in the executor (if it is not open yet)."""
+        loop = asyncio.get_event_loop()
+        async with self._lock:
+            if self.reader is None:
+                self.reader = await loop.run_in_executor(
+                    self.executor,
+                    partial(self.reader_class, self.path,
+                            **self._reader_args))
+        return self
+
+    async def _run(self, method, *args):
+        """Call the reader `method` (by name) with `args` in the executor."""
+        await self.open()
+        loop = asyncio.get_event_loop()
+        async with self._lock:
+            fn = getattr(self.reader, method)
+            return await loop.run_in_executor(self.executor,
+                                              partial(fn, *args))
+
+    def _listen(self):
+        self._loop = asyncio.get_event_loop()
+        self._wakeup = asyncio.Event()
+        self.listener = Listener(self.path)
+        self._loop.add_reader(self.listener.fileno(), self._woken)
+
+    def _woken(self):
+        self.listener.drain()
+        self._wakeup.set()
+
+    async def _fill(self, timeout=None):
+        """Read ahead; with a `timeout` wait up to it for new data."""
+        records = await self._run('next_records',
+                                  self.read_ahead, self.max_bytes)
+        if not records and timeout is not None:
+            deadline = time.monotonic() + timeout
+            if self.listener is None:
+                self._listen()
+
+            while True:
+                # Data written before clearing the event is read below.
+                self._wakeup.clear()
+                records = await self._run('next_records',
+                                          self.read_ahead, self.max_bytes)
+                remaining = deadline - time.monotonic()
+                if records or remaining <= 0:
+                    break
+
+                try:
+                    await asyncio.wait_for(
+                        self._wakeup.wait(),
+                        min(remaining, self.poll_interval))
+                except asyncio.TimeoutError:
+                    pass
+
+        self.buffer.extend(records)
+
+    async def next_record(self, timeout=None):
+        """
+        Return the next `Record` not yet acknowledged or `None`.
+
+        With a `timeout` wait up to `timeout` seconds for new data.
+
+        """
+        if not self.buffer:
+            await self._fill(timeout)
+
+        if self.buffer:
+            return self.buffer.popleft()
+        else:
+            return None
+
+    async def seek(self, liidx, clidx=1):
+        """Continue reading from the record `(liidx, clidx)`."""
+        self.buffer.clear()
+        await self._run('seek', liidx, clidx)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        """Wait for the next record (forever)."""
+        while True:
+            record = await self.next_record(timeout=self.poll_interval)
+            if record is not None:
+                return record
+
+    async def ack(self, record):
+        """Acknowledge some data given by `next_record`."""
+        await self._run('ack', record)
+
+    async def ack_range(self, liidx, first, last):
+        """Acknowledge the records of the log `liidx` in the range."""
+        await self._run('ack_range', liidx, first, last)
+
+    async def ack_many(self, records):
+        """Acknowledge a batch of records."""
+        await self._run('ack_many', list(records))
+
+    async def save(self):
+        """Save the checkpoint (see `Reader.save`)."""
+        return await self._run('save')
+
+    async def snapshot(self):
+        """Write the whole checkpoint (see `Reader.snapshot`)."""
+        return await self._run('snapshot')
+
+    async def close(self):
+        """Stop listening, close the reader and its thread."""
+        if self.listener is not None:
+            self._loop.remove_reader(self.listener.fileno())
+            self.listener.close()
+            self.listener = None
+
+        if self.reader is not None:
+            await self._run('close')
+        self.buffer.clear()
+
+    async def __aenter__(self):
+        return await self.open()
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+
+class TDSAsyncReader(AsyncReader):
+    reader_class = TDSReader
+
+
+class CDSAsyncReader(AsyncReader):
+    reader_class = CDSReader
+
+
+class AsyncWriter:
+    """
+    Append messages to a binlog environment from asyncio.
+
+    `await append(data)` puts the message in a queue of `max_queue`
+    messages (waiting while it is full) and returns its `(liidx, clidx)`
+    position once it is committed, according to the `durability` of the
+    writer (in `group` mode, once the group is flushed). The writer
+    thread drains the queue in batches of up to `max_batch` messages,
+    written in one transaction per log DB.
+
+    If a write fails, the messages not committed get the exception; the
+    ones committed before (in a previous log DB of the batch) still get
+    their positions, and the writer goes on with the queue.
+
+    With `rotate_ahead` the writer thread creates the next log whenever
+    the queue is empty (see `Writer.prepare_next_log`).
+
+    """
+    writer_class = None
+
+    def __init__(self, path, max_queue=QUEUE_SIZE, max_batch=BATCH_SIZE,
+                 rotate_ahead=True, **kwargs):
+        self.path = path
+        self.max_batch = max_batch
+        self.rotate_ahead = rotate_ahead
+        self.writer = self.writer_class(path, **kwargs)
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.queue = asyncio.Queue(max_queue)
+        self._task = None
+        self._closing = False
+
+        # Written messages waiting for the group flush.
+        self._unflushed = collections.deque()
+
+    @property
+    def durable(self):
+        """Highest position known to be on disk."""
+        return self.writer.durable
+
+    def _start(self):
+        if self._closing:
+            raise RuntimeError('The writer is closed.')
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._pump())
+
+    def append_nowait(self, data, future=None):
+        """
+        Queue `data` and return a future with its position.
+
+        The position is set in `future` if given. Raises
+        `asyncio.QueueFull` if the queue is full.
+
+        """
+        self._start()
+        if future is None:
+            future = asyncio.get_event_loop().create_future()
+        self.queue.put_nowait((data, future))
+        return future
+
+    async def append(self, data):
+        """Append `data` and return the assigned `(liidx, clidx)`."""
+        self._start()
+        future = asyncio.get_event_loop().create_future()
+        await self.queue.put((data, future))
+        return await future
+
+    def _next_batch(self, first):
+        batch = [first]
+        while len(batch) < self.max_batch and not self.queue.empty():
+            item = self.queue.get_nowait()
+            if item is None:
+                # Closing, leave the sentinel for the next iteration.
+                self.queue.put_nowait(item)
+                break
+            batch.append(item)
+        return batch
+
+    async def _pump(self):
+        """Write the queued messages until `close()`."""
+        loop = asyncio.get_event_loop()
+        group = self.writer.group
+        while True:
+            if (self.rotate_ahead and self.queue.empty() and
+                    not self.writer.next_log_ready):
+                try:
+                    await loop.run_in_executor(self.executor,
+                                               self.writer.prepare_next_log)
+                except Exception:
+                    # The rotations create the logs as usual.
+                    logger.exception("Cannot prepare the next log, "
+                                     "rotate ahead disabled")
+                    self.rotate_ahead = False
+
+            if group.pending:
+                # Flush the group commit even if nothing else arrives.
+                try:
+                    item = await asyncio.wait_for(self.queue.get(),
+                                                  group.interval)
+                except asyncio.TimeoutError:
+                    try:
+                        await loop.run_in_executor(self.executor,
+                                                   self.writer.flush_if_due)
+                    except Exception:
+                        # Retried on the next interval.
+                        logger.exception("Cannot flush the writer")
+                    self._resolve()
+                    continue
+            else:
+                item = await self.queue.get()
+
+            if item is None:
+                break
+
+            batch = self._next_batch(item)
+            positions = []
+            try:
+                await loop.run_in_executor(
+                    self.executor, self.writer._append_many,
+                    [data for data, _ in batch], positions)
+            except Exception as exc:
+                for _, future in batch[len(positions):]:
+                    if not future.done():
+                        future.set_exception(exc)
+
+            self._unflushed.extend(
+                (position, future)
+                for (_, future), position in zip(batch, positions))
+            self._resolve()
+
+    def _resolve(self):
+        """Return the positions of the durable messages."""
+        durable = self.writer.durable
+        wait = self.writer.durability == DURABILITY_GROUP
+        while self._unflushed:
+            position, future = self._unflushed[0]
+            if wait and (durable is None or position > durable):
+                break
+            self._unflushed.popleft()
+            if not future.done():
+                future.set_result(position)
+
+    async def close(self):
+        """Write the queued messages, flush and close the writer."""
+        self._closing = True
+        loop = asyncio.get_event_loop()
+        if self._task is not None:
+            await self.queue.put(None)
+            await self._task
+            self._task = None
+
+        # Messages queued by appends waiting while the queue was full.
+        while not self.queue.empty():
+            item = self.queue.get_nowait()
+            if item is not None:
+                _, future = item
+                future.set_exception(RuntimeError('The writer is closed.'))
+
+        await loop.run_in_executor(self.executor, self.writer.close)
+        self.executor.shutdown(wait=False)
+        self._resolve()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+
+class TDSAsyncWriter(AsyncWriter):
+    writer_class = TDSWriter
+
+
+class CDSAsyncWriter(AsyncWriter):
+    writer_class = CDSWriter
@@ -3,7 +3,24 @@ import os
 
 from bsddb3 import db
 
-Record = namedtuple('Record', ['liidx', 'clidx', 'value'])
+
+class Record(namedtuple('Record', ['liidx', 'clidx', 'value'])):
+    __slots__ = ()
+
+    # Only the messages of the packed logs (`SubRecord`) have them.
+    subidx = None
+    subcount = None
+
+
+class SubRecord(namedtuple('SubRecord', Record._fields + ('subidx',
+                                                          'subcount')),
+                Record):
+    """
+    A message of a packed block: `subidx` (from 1) and `subcount`
+    locate it inside the block (the row `clidx`).
+
+    """
+    __slots__ = ()
 
 
 class Binlog:
@@ -46,6 +63,13 @@ class Binlog:
 
         return logindex
 
+    @staticmethod
+    def open_logmeta(env, filename):
+        """Open or create the log metadata DB inside the environment."""
+        logmeta = db.DB(env)
+        logmeta.open(filename, None, db.DB_BTREE, db.DB_CREATE)
+        return logmeta
+
 
 class TDSBinlog(Binlog):
     """
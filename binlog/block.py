@@ -0,0 +1,186 @@
+"""
+Packed and compressed logs.
+
+A packed log stores many messages in every row (a block)::
+
+    block: messages (<I) | end offsets (<I each) | payloads
+
+The offsets are relative to the first payload. The rows (blocks or
+single messages) can be compressed with a `Codec`. The format of a log
+is stored in the `LOGMETA_NAME` DB with its name as key::
+
+    meta: format (B) | codec (B) | zlib preset dictionary
+
+The creation time of every log is stored there too, with the key
+`<name>/created`::
+
+    created: seconds since the epoch (<d)
+
+and, for the writers with a `max_log_bytes`, the bytes of its rows with
+the key `<name>/bytes`::
+
+    bytes: bytes of the rows committed (<Q)
+
+The logs without metadata are unpacked and uncompressed (one message
+per row).
+
+"""
+import lzma
+import struct
+import zlib
+
+FORMAT_RAW = 0
+FORMAT_PACKED = 1
+
+CODEC_NONE = 0
+CODEC_ZLIB = 1
+CODEC_LZMA = 2
+
+CODECS = {'zlib': CODEC_ZLIB, 'lzma': CODEC_LZMA}
+
+META = struct.Struct('<BB')
+CREATED = struct.Struct('<d')
+BYTES = struct.Struct('<Q')
+COUNT = struct.Struct('<I')
+OFFSET = struct.Struct('<I')
+
+
+def pack(values):
+    """Return the block with the messages `values`."""
+    ends = []
+    end = 0
+    for value in values:
+        end += len(value)
+        ends.append(end)
+    header = struct.pack('<I%dI' % len(ends), len(ends), *ends)
+    return header + b''.join(values)
+
+
+def unpack(data):
+    """Return the list of messages of a block."""
+    count, = COUNT.unpack_from(data)
+    start = COUNT.size + count * OFFSET.size
+    ends = struct.unpack_from('<%dI' % count, data, COUNT.size)
+
+    values = []
+    offset = start
+    for end in ends:
+        values.append(data[offset:start + end])
+        offset = start + end
+    return values
+
+
+def split(iterable, size):
+    """
+    Group the messages of `iterable` in lists of up to `size` bytes
+    (a larger message gets a block of its own).
+
+    """
+    values = []
+    total = 0
+    for value in iterable:
+        if values and total + len(value) > size:
+            yield values
+            values = []
+            total = 0
+        values.append(value)
+        total += len(value)
+    if values:
+        yield values
+
+
+class Codec:
+    """
+    Compress the rows of a log with `codec`. A zlib codec can use a
+    preset dictionary `zdict`, shared by all the rows.
+
+    """
+    # Raw LZMA2 stream, without the .xz container overhead.
+    lzma_filters = [{'id': lzma.FILTER_LZMA2, 'preset': 6}]
+
+    def __init__(self, codec, zdict=b''):
+        if codec not in (CODEC_ZLIB, CODEC_LZMA):
+            raise ValueError('Unknown codec %r' % codec)
+        if zdict and codec != CODEC_ZLIB:
+            raise ValueError('Only zlib supports a preset dictionary')
+
+        self.codec = codec
+        self.zdict = zdict
+
+    def compress(self, data):
+        if self.codec == CODEC_LZMA:
+            return lzma.compress(data, format=lzma.FORMAT_RAW,
+                                 filters=self.lzma_filters)
+        elif self.zdict:
+            compressor = zlib.compressobj(zdict=self.zdict)
+            return compressor.compress(data) + compressor.flush()
+        else:
+            return zlib.compress(data)
+
+    def decompress(self, data):
+        if self.codec == CODEC_LZMA:
+            return lzma.decompress(data, format=lzma.FORMAT_RAW,
+                                   filters=self.lzma_filters)
+        elif self.zdict:
+            decompressor = zlib.decompressobj(zdict=self.zdict)
+            return decompressor.decompress(data) + decompressor.flush()
+        else:
+            return zlib.decompress(data)
+
+
+def dump_meta(fmt, codec=None):
+    """
+    Return the metadata of a log in the format `fmt`, compressed with
+    the `Codec` given (if any).
+
+    """
+    if codec is None:
+        if fmt == FORMAT_RAW:
+            return None
+        return META.pack(fmt, CODEC_NONE)
+    else:
+        return META.pack(fmt, codec.codec) + codec.zdict
+
+
+def load_meta(data):
+    """
+    Return the `(format, codec)` of a log from its metadata (or
+    `None`); `codec` is a `Codec` or `None`.
+
+    """
+    if data is None:
+        return FORMAT_RAW, None
+
+    fmt, codec = META.unpack_from(data)
+    if codec == CODEC_NONE:
+        return fmt, None
+    else:
+        return fmt, Codec(codec, data[META.size:])
+
+
+def created_key(name):
+    """Return the key of the creation time of the log `name` (bytes)."""
+    return name + b'/created'
+
+
+def dump_created(timestamp):
+    return CREATED.pack(timestamp)
+
+
+def load_created(data):
+    timestamp, = CREATED.unpack(data)
+    return timestamp
+
+
+def bytes_key(name):
+    """Return the key of the size of the rows of the log `name` (bytes)."""
+    return name + b'/bytes'
+
+
+def dump_bytes(size):
+    return BYTES.pack(size)
+
+
+def load_bytes(data):
+    size, = BYTES.unpack(data)
+    return size
@@ -0,0 +1,288 @@
+"""
+Serialization of the reader checkpoints.
+
+The checkpoint is a versioned binary format (little endian)::
+
+    header:  magic (4s) | version (B) | low (q) | number of logs (I)
+    log:     liidx (q) | number of intervals (I) | intervals (2q each)
+
+The version 2 adds the partially acknowledged blocks of the packed logs
+after the logs (only written when there are some)::
+
+    partial: number of blocks (I)
+    block:   liidx (q) | clidx (q) | subcount (I) | mask (subcount bits)
+
+Checkpoints written by older versions (a pickled `Register`) are still
+loaded.
+
+The acknowledgements done after a snapshot can be stored in a `Journal`
+of fixed size entries::
+
+    entry:  kind (B) | liidx (q) | first (q) | last (q)
+    sub:    kind (B) | liidx (q) | clidx (q) | subcount << 32 | subidx (q)
+
+A `Checkpoint` keeps the acknowledgements to save and chooses between
+the journal and a snapshot.
+
+"""
+from array import array
+from copy import deepcopy
+from functools import partial
+from itertools import chain
+import os
+import pickle
+import struct
+import sys
+
+from acidfile import ACIDFile
+
+from .constants import JOURNAL_LIMIT, JOURNAL_SUFFIX
+from .register import Register
+
+MAGIC = b'BLCP'
+VERSION = 1
+VERSION_PARTIAL = 2
+
+HEADER = struct.Struct('<4sBqI')
+LOG = struct.Struct('<qI')
+INTERVAL = struct.Struct('<qq')
+COUNT = struct.Struct('<I')
+BLOCK = struct.Struct('<qqI')
+
+ENTRY = struct.Struct('<Bqqq')
+ENTRY_RANGE = 0
+ENTRY_SUB = 1
+
+
+def _intervals_to_bytes(intervals):
+    values = array('q', chain.from_iterable(intervals))
+    if sys.byteorder == 'big':  # pragma: no cover
+        values.byteswap()
+    return values.tobytes()
+
+
+def dumps(register):
+    """Return the binary checkpoint of `register`."""
+    version = VERSION_PARTIAL if register.partial else VERSION
+    chunks = [HEADER.pack(MAGIC, version, register.low, len(register.reg))]
+    for liidx, intervals in sorted(register.reg.items()):
+        chunks.append(LOG.pack(liidx, len(intervals)))
+        chunks.append(_intervals_to_bytes(intervals))
+
+    if register.partial:
+        chunks.append(COUNT.pack(len(register.partial)))
+        for (liidx, clidx), (subcount, mask) in sorted(
+                register.partial.items()):
+            chunks.append(BLOCK.pack(liidx, clidx, subcount))
+            chunks.append(mask.to_bytes((subcount + 7) // 8, 'little'))
+    return b''.join(chunks)
+
+
+def loads(data):
+    """Return the `Register` stored in the checkpoint `data`."""
+    if data[:len(MAGIC)] != MAGIC:
+        return pickle.loads(data)
+
+    magic, version, low, count = HEADER.unpack_from(data)
+    if version not in (VERSION, VERSION_PARTIAL):
+        raise ValueError('Unknown checkpoint version %d' % version)
+
+    reg = {}
+    offset = HEADER.size
+    for _ in range(count):
+        liidx, length = LOG.unpack_from(data, offset)
+        offset += LOG.size
+        end = offset + length * INTERVAL.size
+        reg[liidx] = list(INTERVAL.iter_unpack(data[offset:end]))
+        offset = end
+
+    partial = {}
+    if version == VERSION_PARTIAL:
+        count, = COUNT.unpack_from(data, offset)
+        offset += COUNT.size
+        for _ in range(count):
+            liidx, clidx, subcount = BLOCK.unpack_from(data, offset)
+            offset += BLOCK.size
+            end = offset + (subcount + 7) // 8
+            mask = int.from_bytes(data[offset:end], 'little')
+            partial[(liidx, clidx)] = (subcount, mask)
+            offset = end
+
+    register = Register()
+    register.reg = reg
+    register.partial = partial
+    register.low = low
+    return register
+
+
+def dump(register, fileobj):
+    """Write the binary checkpoint of `register` into `fileobj`."""
+    fileobj.write(dumps(register))
+
+
+def load(fileobj):
+    """Read a checkpoint from `fileobj` with a single read."""
+    return loads(fileobj.read())
+
+
+def _entry(*entry):
+    if len(entry) == 3:
+        return ENTRY.pack(ENTRY_RANGE, *entry)
+    else:
+        liidx, clidx, subidx, subcount = entry
+        return ENTRY.pack(ENTRY_SUB, liidx, clidx, subcount << 32 | subidx)
+
+
+class Journal:
+    """Append-only file with the acknowledgements done after a snapshot."""
+    def __init__(self, path):
+        self.path = path
+
+    def append(self, ranges):
+        """
+        Append the `(liidx, first, last)` acknowledged `ranges` (and the
+        `(liidx, clidx, subidx, subcount)` messages of packed blocks).
+
+        """
+        if not ranges:
+            return 0
+
+        data = b''.join(_entry(*entry) for entry in ranges)
+        with open(self.path, 'ab') as journal:
+            journal.write(data)
+            journal.flush()
+            os.fsync(journal.fileno())
+        return len(ranges)
+
+    def replay(self, register):
+        """
+        Apply the journal to `register`.
+
+        Returns the number of entries applied. An incomplete trailing
+        entry (interrupted write) is ignored.
+
+        """
+        try:
+            with open(self.path, 'rb') as journal:
+                data = journal.read()
+        except FileNotFoundError:
+            return 0
+
+        data = data[:len(data) - len(data) % ENTRY.size]
+        count = 0
+        for kind, liidx, first, last in ENTRY.iter_unpack(data):
+            if kind == ENTRY_RANGE:
+                register.add_range(liidx, first, last)
+            elif kind == ENTRY_SUB:
+                register.add_sub(liidx, first, last & 0xffffffff, last >> 32)
+            count += 1
+        return count
+
+    def clear(self):
+        """Remove all the entries (they are in a snapshot now)."""
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+
+class Checkpoint:
+    """
+    The snapshot `path` of a register and its journal.
+
+    The acknowledgements are remembered (`ack_range`, `ack_sub`,
+    `ack_block`) until the next save, which appends them to the journal
+    while it has up to `journal_limit` entries and writes a snapshot of
+    the register otherwise.
+
+    """
+    def __init__(self, path, journal_limit=JOURNAL_LIMIT):
+        self.path = path
+        self.journal = Journal(path + JOURNAL_SUFFIX)
+        self.journal_limit = journal_limit
+
+        # Acknowledgements not saved yet.
+        self.pending = []
+        self._journal_entries = 0
+        self._snapshot = False
+
+    def load(self):
+        """
+        Return the saved `Register` (with the journal applied) or `None`
+        if there is no snapshot.
+
+        """
+        try:
+            with ACIDFile(self.path, mode='rb') as cp:
+                register = load(cp)
+        except:
+            return None
+        else:
+            self._snapshot = True
+            self._journal_entries = self.journal.replay(register)
+            self.pending = []
+            return register
+
+    def ack_range(self, liidx, first, last):
+        """Remember an acknowledged range, merged with the previous one."""
+        if self.pending and len(self.pending[-1]) == 3:
+            pliidx, pfirst, plast = self.pending[-1]
+            if pliidx == liidx and plast + 1 == first:
+                self.pending[-1] = (liidx, pfirst, last)
+                return
+        self.pending.append((liidx, first, last))
+
+    def ack_sub(self, liidx, clidx, subidx, subcount):
+        """Remember an acknowledged message of a packed block."""
+        self.pending.append((liidx, clidx, subidx, subcount))
+
+    def ack_block(self, liidx, clidx):
+        """Remember a completed block: a range replaces its messages."""
+        while (self.pending and len(self.pending[-1]) == 4 and
+               self.pending[-1][:2] == (liidx, clidx)):
+            self.pending.pop()
+        self.ack_range(liidx, clidx, clidx)
+
+    def save_job(self, register, compact, snapshot=False, copy=False):
+        """
+        Return a function saving the pending acknowledgements.
+
+        The snapshot (always written with `snapshot=True`) is a copy of
+        `register` when `copy` is true, to run the job in another
+        thread, compacted with `compact`. If the job fails call
+        `failed()`.
+
+        """
+        pending, self.pending = self.pending, []
+        entries = self._journal_entries + len(pending)
+        if self._snapshot and not snapshot and entries <= self.journal_limit:
+            self._journal_entries = entries
+            return partial(self.journal.append, pending)
+        else:
+            if copy:
+                register = deepcopy(register)
+            self._snapshot = True
+            self._journal_entries = 0
+            return partial(self._write_snapshot, register, compact)
+
+    def failed(self):
+        """A save job failed: the next save writes a snapshot."""
+        self._snapshot = False
+
+    def save(self, register, compact, snapshot=False):
+        """Save the pending acknowledgements. Return `False` on error."""
+        job = self.save_job(register, compact, snapshot=snapshot)
+        try:
+            job()
+        except:  # pragma: no cover
+            self.failed()
+            return False
+        else:
+            return True
+
+    def _write_snapshot(self, register, compact):
+        compact(register)
+        os.makedirs(self.path, exist_ok=True)
+        with ACIDFile(self.path, mode='wb') as cp:
+            dump(register, cp)
+        self.journal.clear()
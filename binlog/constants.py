@@ -1,4 +1,34 @@
 CHECKPOINT_DIR = 'checkpoints'
 LOGINDEX_NAME = 'logindex'
+LOGMETA_NAME = 'logmeta'
 LOG_PREFIX = 'events'
 MAX_LOG_EVENTS = 100000
+
+# Maximum size (bytes) of the blocks of a packed writer.
+BLOCK_SIZE = 16384
+
+# Decoded (decompressed or unpacked) rows cached by a reader.
+BLOCK_CACHE = 16
+
+# Writer durability modes.
+DURABILITY_SYNC = 'sync'
+DURABILITY_WRITE_NOSYNC = 'write-nosync'
+DURABILITY_NOSYNC = 'nosync'
+DURABILITY_GROUP = 'group'
+
+# Group commit defaults (seconds and records).
+GROUP_COMMIT_INTERVAL = 0.01
+GROUP_COMMIT_SIZE = 1000
+
+# Checkpoint journal.
+JOURNAL_SUFFIX = '.journal'
+JOURNAL_LIMIT = 10000
+
+# Directory (inside the environment) of the reader wakeup sockets.
+NOTIFY_DIR = 'notify'
+
+# Memory-mapped file with the writer head position.
+HEAD_NAME = 'head'
+
+# Logs deleted by the retention in each transaction.
+RETENTION_BATCH = 16
@@ -25,5 +25,94 @@ class Cursor:
         self.db = db
         self.idx = idx
 
+    def release(self):
+        """Nothing to release, the BDB cursors are opened per call."""
+
     def __getattr__(self, name):
         return CursorMethod(self.db, name, self)
+
+
+
+class PersistentCursorMethod:
+    def __init__(self, name, cursor):
+        self.name = name
+        self.cursor = cursor
+
+    def __call__(self, *args, **kwargs):
+        cursor = self.cursor
+        try:
+            live = cursor.live()
+            if cursor.idx is not None and cursor.idx != cursor.pos:
+                live = cursor.seek()
+            data = getattr(live, self.name)(*args, **kwargs)
+        except:
+            cursor.pos = None
+            raise
+        else:
+            # On failure BDB leaves the cursor where it was.
+            if data is not None:
+                cursor.idx, _ = data
+                cursor.pos = cursor.idx
+            return data
+
+
+class PersistentCursor:
+    """
+    A `Cursor` keeping one live BDB cursor open between calls.
+
+    The live cursor is only moved when `idx` was changed from the
+    outside since the last operation, stepping forward when `idx` is
+    the next key.
+
+    The live cursor holds a lock on the page it is positioned on, so
+    `release()` must be called before idling, otherwise the writers
+    appending to that page will block.
+
+    """
+    def __init__(self, db, idx=None):
+        self.db = db
+        self.idx = idx
+        self.pos = None
+        self._cursor = None
+        self._methods = {}
+
+    def live(self):
+        """Return the live BDB cursor, opening it if needed."""
+        if self._cursor is None:
+            self._cursor = self.db.cursor()
+            self.pos = None
+        return self._cursor
+
+    def seek(self):
+        """Move the live cursor to `idx`."""
+        live = self.live()
+        if self.pos is not None and self.idx == self.pos + 1:
+            data = live.next()
+            if data is not None:
+                self.pos, _ = data
+                if self.pos == self.idx:
+                    return live
+
+        if live.set(self.idx) is None:
+            # Behave like a fresh cursor: unpositioned.
+            self.release()
+            live = self.live()
+        else:
+            self.pos = self.idx
+        return live
+
+    def release(self):
+        """Close the live BDB cursor (`idx` is kept)."""
+        if self._cursor is not None:
+            self._cursor.close()
+            self._cursor = None
+        self.pos = None
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        try:
+            return self._methods[name]
+        except KeyError:
+            method = self._methods[name] = PersistentCursorMethod(name, self)
+            return method
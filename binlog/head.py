@@ -0,0 +1,82 @@
+"""
+Writer head position shared through a memory-mapped file.
+
+The file starts with three native unsigned 64 bit integers::
+
+    sequence | liidx | clidx
+
+The writer makes the sequence odd while it updates the position and
+even again when it is done (seqlock), so the readers can detect and
+retry torn reads without any locking.
+
+"""
+import mmap
+import os
+import struct
+
+from .constants import HEAD_NAME
+
+SEQUENCE = struct.Struct('=Q')
+STATE = struct.Struct('=QQQ')
+
+
+class Head:
+    """
+    The head position of an environment.
+
+    Writers open it with `create=True`, readers get a read-only mapping.
+
+    """
+    def __init__(self, path, create=False):
+        filename = os.path.join(path, HEAD_NAME)
+        if create:
+            fd = os.open(filename, os.O_RDWR | os.O_CREAT, 0o644)
+            access = mmap.ACCESS_WRITE
+        else:
+            fd = os.open(filename, os.O_RDONLY)
+            access = mmap.ACCESS_READ
+
+        try:
+            if os.fstat(fd).st_size < mmap.PAGESIZE:
+                if create:
+                    os.ftruncate(fd, mmap.PAGESIZE)
+                else:
+                    raise ValueError('%s is not initialized' % filename)
+            self.map = mmap.mmap(fd, mmap.PAGESIZE, access=access)
+        finally:
+            os.close(fd)
+
+    @classmethod
+    def open(cls, path):
+        """Return the `Head` of the environment or `None` if missing."""
+        try:
+            return cls(path)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def publish(self, liidx, clidx):
+        """Publish the new writer position."""
+        sequence, = SEQUENCE.unpack_from(self.map)
+        # An odd sequence here is a writer killed during an update.
+        sequence += 1 if sequence % 2 == 0 else 2
+
+        SEQUENCE.pack_into(self.map, 0, sequence)
+        STATE.pack_into(self.map, 0, sequence, liidx, clidx)
+        SEQUENCE.pack_into(self.map, 0, sequence + 1)
+
+    def read(self, retries=100):
+        """
+        Return the `(sequence, liidx, clidx)` state or `None` if a
+        consistent state could not be read.
+
+        """
+        for _ in range(retries):
+            state = STATE.unpack_from(self.map)
+            if state[0] % 2 == 0:
+                sequence, = SEQUENCE.unpack_from(self.map)
+                if sequence == state[0]:
+                    return state
+        return None
+
+    def close(self):
+        self.map.close()
@@ -0,0 +1,219 @@
+"""
+Server side subscriptions.
+
+The `Hub` reads the logs once, with a single `AsyncReader`, and sends
+each record to every `Subscription` waiting for it. When a subscription
+needs older records (it is new or it was paused) the hub moves back to
+them; the subscriptions which already got them just skip them.
+
+"""
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+import asyncio
+import logging
+import os
+
+from .aio import TDSAsyncReader, READ_AHEAD
+from .checkpoint import Checkpoint
+from .constants import CHECKPOINT_DIR, JOURNAL_LIMIT
+from .register import Register
+
+logger = logging.getLogger(__name__)
+
+# Seconds the hub waits for new records before checking the
+# subscriptions again.
+HUB_WAIT = 0.1
+
+
+def _after(record):
+    """
+    Return the position following `record`: `(liidx, clidx, subidx)`,
+    with `subidx` 0 at the beginning of a row.
+
+    """
+    if record.subidx is None or record.subidx >= record.subcount:
+        return (record.liidx, record.clidx + 1, 0)
+    else:
+        return (record.liidx, record.clidx, record.subidx + 1)
+
+
+class Subscription:
+    """
+    The acknowledgements of a subscriber, stored in the checkpoint
+    `name` like `Reader` does.
+
+    The records are given to `send`.
+
+    """
+    def __init__(self, path, name, send, journal_limit=JOURNAL_LIMIT):
+        if not name or os.sep in name or name.startswith('.'):
+            raise ValueError('Invalid checkpoint name %r' % name)
+
+        self.name = name
+        self.send = send
+        self.checkpoint = os.path.join(path, CHECKPOINT_DIR, name)
+        self.acks = Checkpoint(self.checkpoint, journal_limit)
+        self.register = Register()
+
+        # Position of the next record to send (once loaded).
+        self.position = None
+        self.paused = False
+
+        self.saving = False
+        self.dirty = False
+
+    def load(self):
+        """Load the checkpoint and find the first record to send."""
+        register = self.acks.load()
+        if register is not None:
+            self.register = register
+
+        self.register.seek(max(self.register.low, 1))
+        first = self.register.next()
+        self.position = (first.liidx, first.clidx, 0)
+
+    def offer(self, record):
+        """Send `record` unless it was sent or acknowledged already."""
+        if (record.liidx, record.clidx, record.subidx or 0) < self.position:
+            return
+
+        self.position = _after(record)
+        if record not in self.register:
+            self.send(record)
+
+    def ack_range(self, liidx, first, last):
+        """Acknowledge the records of the log `liidx` in the range."""
+        self.register.add_range(liidx, first, last)
+        self.acks.ack_range(liidx, first, last)
+
+    def ack_sub(self, liidx, clidx, subidx, subcount):
+        """Acknowledge the message `subidx` of a packed block."""
+        self.register.add_sub(liidx, clidx, subidx, subcount)
+        if (liidx, clidx) in self.register.partial:
+            self.acks.ack_sub(liidx, clidx, subidx, subcount)
+        else:
+            self.acks.ack_block(liidx, clidx)
+
+    def save_job(self, compact):
+        """
+        Return a function saving the pending acknowledgements, to run in
+        the hub thread (see `Checkpoint.save_job`).
+
+        """
+        return self.acks.save_job(self.register, compact, copy=True)
+
+
+class Hub:
+    """Read the logs of `path` once for all the subscriptions."""
+    def __init__(self, path, read_ahead=READ_AHEAD, reader_class=None):
+        if reader_class is None:
+            reader_class = TDSAsyncReader
+
+        self.path = path
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.reader = reader_class(path, read_ahead=read_ahead,
+                                   executor=self.executor)
+        self.subscriptions = {}
+
+        # Position of the next record of the reader.
+        self.position = None
+
+        self._changed = asyncio.Event()
+        self._task = None
+
+    async def _run_job(self, fn, *args):
+        """Run `fn(*args)` in the hub thread."""
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self.executor, partial(fn, *args))
+
+    async def subscribe(self, name, send, **kwargs):
+        """Start sending the records of the checkpoint `name` to `send`."""
+        if name in self.subscriptions:
+            raise ValueError('%r is already subscribed' % name)
+
+        subscription = Subscription(self.path, name, send, **kwargs)
+        self.subscriptions[name] = subscription
+        try:
+            await self.reader.open()
+            await self._run_job(subscription.load)
+        except:
+            del self.subscriptions[name]
+            raise
+
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+        self.wake()
+        return subscription
+
+    async def unsubscribe(self, subscription):
+        """Stop sending records and save the acknowledgements."""
+        if self.subscriptions.get(subscription.name) is subscription:
+            del self.subscriptions[subscription.name]
+        await self.save(subscription)
+
+    def wake(self):
+        """Look at the subscriptions again (new or resumed)."""
+        self._changed.set()
+
+    async def save(self, subscription):
+        """Save the acknowledgements of `subscription`."""
+        if subscription.saving:
+            # Saved again by the running call.
+            subscription.dirty = True
+            return
+
+        subscription.saving = True
+        try:
+            while True:
+                subscription.dirty = False
+                job = subscription.save_job(self.reader.reader.compact)
+                try:
+                    await self._run_job(job)
+                except Exception:
+                    logger.exception("Cannot save %r", subscription.name)
+                    # The next save writes the whole register.
+                    subscription.acks.failed()
+                if not subscription.dirty:
+                    break
+        finally:
+            subscription.saving = False
+
+    async def _run(self):
+        """Send the records to the subscriptions."""
+        while True:
+            active = [s for s in self.subscriptions.values()
+                      if s.position is not None and not s.paused]
+            if not active:
+                self._changed.clear()
+                await self._changed.wait()
+                continue
+
+            # The messages of a block are read forward, without seeking
+            # into it.
+            start = min(s.position for s in active)
+            if (self.position is None or start < self.position or
+                    start[:2] != self.position[:2]):
+                await self.reader.seek(*start[:2])
+                self.position = start[:2] + (0, )
+
+            record = await self.reader.next_record(timeout=HUB_WAIT)
+            if record is not None:
+                self.position = _after(record)
+                for subscription in active:
+                    subscription.offer(record)
+
+    async def close(self):
+        """Save all the subscriptions and close the reader."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        for subscription in list(self.subscriptions.values()):
+            await self.unsubscribe(subscription)
+
+        await self.reader.close()
+        self.executor.shutdown(wait=False)
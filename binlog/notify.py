@@ -0,0 +1,154 @@
+"""
+Writer to reader wakeups.
+
+Every waiting reader binds a UNIX datagram socket in the `NOTIFY_DIR`
+directory of the environment, and the writers send a one byte datagram
+to each of them after every append.
+
+"""
+import errno
+import itertools
+import os
+import select
+import socket
+import time
+
+from .constants import NOTIFY_DIR
+
+# Directory listings younger than this (ns) can miss a socket created in
+# the same timestamp tick, so they are not trusted.
+LISTING_GRACE = 100000000
+
+
+class Notifier:
+    """Writer side: wake up the readers waiting on an environment."""
+    def __init__(self, path):
+        self.path = os.path.join(path, NOTIFY_DIR)
+        self._sock = None
+        self._mtime = None
+        self._listed = 0
+        self._targets = []
+
+    def targets(self):
+        """Return the sockets of the waiting readers."""
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return []
+
+        if mtime != self._mtime or self._listed - mtime < LISTING_GRACE:
+            self._listed = int(time.time() * 1e9)
+            self._mtime = mtime
+            self._targets = [os.path.join(self.path, name)
+                             for name in os.listdir(self.path)]
+        return self._targets
+
+    def notify(self):
+        """Wake up all the waiting readers."""
+        targets = self.targets()
+        if not targets:
+            return
+
+        if self._sock is None:
+            self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            self._sock.setblocking(False)
+
+        for target in targets:
+            try:
+                self._sock.sendto(b'\0', target)
+            except BlockingIOError:
+                # The reader has pending wakeups already.
+                pass
+            except (ConnectionRefusedError, FileNotFoundError):
+                # Nobody is bound to this socket, the reader is gone.
+                try:
+                    os.unlink(target)
+                except OSError:
+                    pass
+            except OSError:  # pragma: no cover
+                pass
+
+    def close(self):
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+
+class Listener:
+    """
+    Reader side: wait for the wakeups of the writers.
+
+    The socket is named after the pid. A socket left by a reader which
+    did not `close()` (the pids repeat, e.g. across container restarts)
+    is replaced; a name in use by a live reader is skipped.
+
+    """
+
+    _ids = itertools.count()
+
+    def __init__(self, path):
+        self.path = os.path.join(path, NOTIFY_DIR)
+        os.makedirs(self.path, exist_ok=True)
+
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        while True:
+            self.name = os.path.join(
+                self.path, '%d.%d' % (os.getpid(), next(self._ids)))
+            try:
+                self.sock.bind(self.name)
+            except OSError as exc:
+                if exc.errno != errno.EADDRINUSE:
+                    raise
+                elif self._is_stale(self.name):
+                    os.unlink(self.name)
+                    self.sock.bind(self.name)
+                    break
+            else:
+                break
+        self.sock.setblocking(False)
+
+    @staticmethod
+    def _is_stale(name):
+        """Return `True` if nobody is bound to the socket `name`."""
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        try:
+            probe.connect(name)
+        except ConnectionRefusedError:
+            return True
+        except OSError:
+            pass
+        finally:
+            probe.close()
+        return False
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def drain(self):
+        """Discard the pending wakeups."""
+        try:
+            while True:
+                self.sock.recv(64)
+        except BlockingIOError:
+            pass
+
+    def wait(self, timeout=None):
+        """
+        Block until a wakeup is received or `timeout` seconds pass.
+
+        Returns `True` if a wakeup was received.
+
+        """
+        ready, _, _ = select.select([self.sock], [], [], timeout)
+        if ready:
+            self.drain()
+            return True
+        else:
+            return False
+
+    def close(self):
+        self.sock.close()
+        try:
+            os.unlink(self.name)
+        except FileNotFoundError:
+            pass
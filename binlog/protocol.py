@@ -0,0 +1,194 @@
+"""
+Framed protocol of the server.
+
+A framed connection carries any number of frames in both directions::
+
+    frame: length of the payload (>I) | type (>B) | payload
+
+In the ack modes the server replies to the `APPEND` frames, in order,
+once they are written::
+
+    RESULT: messages (>I) | liidx (>q) | clidx (>q) of the last one
+            [| subidx (>I) with a packed writer]
+    ERROR:  messages (>I) | error message (UTF-8)
+
+With `ACK_MESSAGE` every message gets a reply, with `ACK_BATCH` the
+messages received together share one.
+
+A client sending `SUBSCRIBE` (with the name of its checkpoint) receives
+the records not acknowledged yet, and acknowledges them with `ACK`::
+
+    SUBSCRIBE: checkpoint name (UTF-8)
+    RECORD:    liidx (>q) | clidx (>q) | value
+    ACK:       liidx (>q) | first clidx (>q) | last clidx (>q)
+
+The messages of the packed logs are sent and acknowledged one by one::
+
+    SUBRECORD: liidx (>q) | clidx (>q) | subidx (>I) | subcount (>I) | value
+    SUBACK:    liidx (>q) | clidx (>q) | subidx (>I) | subcount (>I)
+
+"""
+import struct
+
+HEADER = struct.Struct('>IB')
+RESULT_PAYLOAD = struct.Struct('>Iqq')
+ERROR_PAYLOAD = struct.Struct('>I')
+SUBIDX = struct.Struct('>I')
+POSITION = struct.Struct('>qq')
+SUBPOSITION = struct.Struct('>qqII')
+RANGE = struct.Struct('>qqq')
+
+# Client to server.
+APPEND = 1
+SUBSCRIBE = 4
+ACK = 6
+SUBACK = 8
+
+# Server to client.
+RESULT = 2
+ERROR = 3
+RECORD = 5
+SUBRECORD = 7
+
+# Ack modes.
+ACK_MESSAGE = 'message'
+ACK_BATCH = 'batch'
+
+
+def pack(kind, payload=b''):
+    """Return the frame of type `kind` with `payload`."""
+    return HEADER.pack(len(payload), kind) + payload
+
+
+def result(count, position):
+    """Return the `RESULT` frame of `count` messages."""
+    payload = RESULT_PAYLOAD.pack(count, *position[:2])
+    if len(position) > 2:
+        payload += SUBIDX.pack(position[2])
+    return pack(RESULT, payload)
+
+
+def error(count, message):
+    """Return the `ERROR` frame of `count` messages."""
+    return pack(ERROR, ERROR_PAYLOAD.pack(count) + message.encode('utf-8'))
+
+
+def parse_result(payload):
+    """
+    Return `(count, (liidx, clidx))` (or `(count, (liidx, clidx,
+    subidx))`) from a `RESULT` payload.
+
+    """
+    count, liidx, clidx = RESULT_PAYLOAD.unpack_from(payload)
+    if len(payload) > RESULT_PAYLOAD.size:
+        subidx, = SUBIDX.unpack_from(payload, RESULT_PAYLOAD.size)
+        return count, (liidx, clidx, subidx)
+    return count, (liidx, clidx)
+
+
+def parse_error(payload):
+    """Return `(count, message)` from an `ERROR` payload."""
+    count, = ERROR_PAYLOAD.unpack_from(payload)
+    return count, payload[ERROR_PAYLOAD.size:].decode('utf-8')
+
+
+def subscribe(name):
+    """Return the `SUBSCRIBE` frame of the checkpoint `name`."""
+    return pack(SUBSCRIBE, name.encode('utf-8'))
+
+
+def record(liidx, clidx, value):
+    """Return the `RECORD` frame of a record."""
+    return pack(RECORD, POSITION.pack(liidx, clidx) + value)
+
+
+def parse_record(payload):
+    """Return `(liidx, clidx, value)` from a `RECORD` payload."""
+    liidx, clidx = POSITION.unpack_from(payload)
+    return liidx, clidx, payload[POSITION.size:]
+
+
+def subrecord(liidx, clidx, subidx, subcount, value):
+    """Return the `SUBRECORD` frame of a message of a packed block."""
+    return pack(SUBRECORD,
+                SUBPOSITION.pack(liidx, clidx, subidx, subcount) + value)
+
+
+def parse_subrecord(payload):
+    """
+    Return `(liidx, clidx, subidx, subcount, value)` from a `SUBRECORD`
+    payload.
+
+    """
+    liidx, clidx, subidx, subcount = SUBPOSITION.unpack_from(payload)
+    return liidx, clidx, subidx, subcount, payload[SUBPOSITION.size:]
+
+
+def ack(liidx, first, last):
+    """Return the `ACK` frame of the records `first` to `last`."""
+    return pack(ACK, RANGE.pack(liidx, first, last))
+
+
+def parse_ack(payload):
+    """Return `(liidx, first, last)` from an `ACK` payload."""
+    return RANGE.unpack(payload)
+
+
+def suback(liidx, clidx, subidx, subcount):
+    """Return the `SUBACK` frame of a message of a packed block."""
+    return pack(SUBACK, SUBPOSITION.pack(liidx, clidx, subidx, subcount))
+
+
+def parse_suback(payload):
+    """Return `(liidx, clidx, subidx, subcount)` from a `SUBACK` payload."""
+    return SUBPOSITION.unpack(payload)
+
+
+class FrameReader:
+    """
+    Split a byte stream into `(type, payload)` frames.
+
+    The payload of the frames larger than `max_size` bytes is discarded
+    without buffering it and the frame is returned as `(type, None)`.
+
+    """
+    def __init__(self, max_size=None):
+        self.buffer = bytearray()
+        self.max_size = max_size
+        self.skip = 0
+
+    def __len__(self):
+        """Bytes buffered (of incomplete frames)."""
+        return len(self.buffer)
+
+    def feed(self, data):
+        """Add `data` to the stream and return the completed frames."""
+        if self.skip:
+            skipped = min(self.skip, len(data))
+            self.skip -= skipped
+            data = data[skipped:]
+
+        buf = self.buffer
+        buf += data
+
+        frames = []
+        offset = 0
+        while len(buf) - offset >= HEADER.size:
+            length, kind = HEADER.unpack_from(buf, offset)
+            start = offset + HEADER.size
+            end = start + length
+            if self.max_size is not None and length > self.max_size:
+                frames.append((kind, None))
+                offset = min(end, len(buf))
+                self.skip = end - offset
+                if self.skip:
+                    break
+                else:
+                    continue
+            if len(buf) < end:
+                break
+            frames.append((kind, bytes(buf[start:end])))
+            offset = end
+
+        del buf[:offset]
+        return frames
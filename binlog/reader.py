@@ -1,35 +1,90 @@
+from collections import OrderedDict
 import os
-import pickle
+import time
 
-from acidfile import ACIDFile
 from bsddb3 import db
 
-from .binlog import TDSBinlog, CDSBinlog, Record
-from .constants import LOGINDEX_NAME, CHECKPOINT_DIR
-from .cursor import Cursor
+from .binlog import TDSBinlog, CDSBinlog, Record, SubRecord
+from .block import FORMAT_PACKED, FORMAT_RAW, load_meta, unpack
+from .checkpoint import Checkpoint
+from .constants import LOGINDEX_NAME, LOGMETA_NAME, CHECKPOINT_DIR
+from .constants import JOURNAL_LIMIT, BLOCK_CACHE
+from .cursor import Cursor, PersistentCursor
+from .head import Head
+from .notify import Listener
 from .register import Register
 
 
 class Reader:
-    def __init__(self, path, checkpoint=None):
+    """
+    Read the records of a binlog environment.
+
+    With `persistent=True` the reader keeps its BDB cursors open between
+    calls instead of opening one per operation. The data log cursor is
+    only released when there is nothing more to read (or calling
+    `release()`); until then a writer appending to the same page will
+    wait for it.
+
+    `save()` appends the acknowledgements done since the last call to a
+    journal and only rewrites the whole checkpoint (snapshot) when the
+    journal has more than `journal_limit` entries.
+
+    The blocks of the packed logs are returned message by message, as
+    `SubRecord` objects. The compressed rows are decompressed; the last
+    `block_cache` decoded rows are kept, so reading them again (after a
+    `seek`) does not decode them twice.
+
+    """
+    def __init__(self, path, checkpoint=None, persistent=False,
+                 journal_limit=JOURNAL_LIMIT, block_cache=BLOCK_CACHE):
+        self.path = path
         self.env = self.open_environ(path, create=False)
+        self.listener = None
+
+        # Writer head state seen when the reader ran out of data.
+        self.head = None
+        self._idle = None
+        self._exhausted = False
+
+        if persistent:
+            self.cursor_class = PersistentCursor
+        else:
+            self.cursor_class = Cursor
 
         self.logindex = self.open_logindex(self.env, LOGINDEX_NAME)
-        self.li_cursor = Cursor(self.logindex)
+        self.logmeta = self.open_logmeta(self.env, LOGMETA_NAME)
+        self.li_cursor = self.cursor_class(self.logindex)
         fst_cl = self.li_cursor.first()
-        self.last_liidx = None 
+        self.li_cursor.release()
+        self.last_liidx = None
 
         self.register = None 
 
         self.retry = False
 
         self.current_log = None
+        self.current_logname = None
         self.cl_cursor = None
 
+        # Format and codec of the current log (read with its first row)
+        # and the messages of the current block.
+        self._format = None
+        self._codec = None
+        self._block = None
+        self._block_pos = None
+        self._subidx = 0
+
+        self.block_cache = block_cache
+        self._cache = OrderedDict()
+
         if checkpoint is None:
             self.checkpoint = None
+            self.acks = None
+            self.journal = None
         else:
             self.checkpoint = os.path.join(path, CHECKPOINT_DIR, checkpoint)
+            self.acks = Checkpoint(self.checkpoint, journal_limit)
+            self.journal = self.acks.journal
             self.load()
 
         if self.register is None:
@@ -46,6 +101,32 @@ class Reader:
 
         return data is not None
     
+    def first_available(self, liidx):
+        """
+        Return the first log index in the logindex from `liidx` on.
+
+        The logindex is a RECNO DB, where `set_range` is an exact lookup
+        too, so when `liidx` was deleted the cursor walks forward from
+        the first log. The deleted logs are usually the oldest ones
+        (retention), which makes the first log the answer.
+
+        """
+        cursor = self.logindex.cursor()
+        try:
+            data = cursor.set(liidx)
+            if data is None:
+                data = cursor.first()
+                while data is not None and data[0] < liidx:
+                    data = cursor.next()
+        finally:
+            cursor.close()
+
+        if data is None:
+            return None
+        else:
+            idx, _ = data
+            return idx
+
     def last_available(self):
         li_idx = self.li_cursor.idx
         data = self.li_cursor.last()
@@ -57,101 +138,369 @@ class Reader:
         self.li_cursor.idx = li_idx
         return idx
 
+    def head_state(self):
+        """Return the state published by the writer (or `None`)."""
+        if self.head is None:
+            self.head = Head.open(self.path)
+            if self.head is None:
+                return None
+        return self.head.read()
+
     def next(self, next_log=False):
-        if not self.retry:
-            last = self.last_available()
-            if last is not None:
-                pos = self.register.next(log=next_log)
-                while pos.liidx < last and not self.is_log_available(pos):
-                    pos = self.register.next(log=True)
-            else:
-                pos = self.register.next(log=next_log)
-            try:
-                self.set_cursors(pos)
-            except db.DBInvalidArgError as exc:
-                errcode, _ = exc.args
-                if errcode == 22:
+        data = self._next_in_block()
+        if data is not None:
+            return data
+
+        # Nothing was written since we ran out of data: skip the BDB
+        # lookups.
+        head = self.head_state()
+        if head is not None and head == self._idle:
+            return None
+        self._idle = None
+
+        self._exhausted = False
+        try:
+            data = self._next(next_log)
+        finally:
+            # The logindex is written on every rotation, never keep it
+            # locked between calls.
+            self.li_cursor.release()
+
+        if data is None:
+            self.release()
+            if self._exhausted:
+                self._idle = head
+        return data
+
+    def _next(self, next_log=False):
+        while True:
+            if not self.retry:
+                last = self.last_available()
+                if last is not None:
+                    pos = self.register.next(log=next_log)
+                    if pos.liidx < last and not self.is_log_available(pos):
+                        # Jump over the deleted logs.
+                        first = self.first_available(pos.liidx)
+                        if first is not None:  # pragma: no branch
+                            self.register.seek(first)
+                            pos = self.register.next()
+                else:
+                    pos = self.register.next(log=next_log)
+                try:
+                    self.set_cursors(pos)
+                except db.DBInvalidArgError as exc:
+                    errcode, _ = exc.args
+                    if errcode == 22:
+                        self.retry = True
+                        return None
+                    else:  # pragma: no cover
+                        raise
+                except db.DBNoSuchFileError:
                     self.retry = True
                     return None
-                else:  # pragma: no cover
-                    raise
-            except db.DBNoSuchFileError as exc:
-                self.retry = True
-                return None
-        else:
-            self.retry = False
+            else:
+                self.retry = False
+
+            if self.cl_cursor is None:
+                try:
+                    self.set_cursors(self.register.current)
+                except db.DBInvalidArgError as exc:
+                    errcode, _ = exc.args
+                    self.retry = True
+                    if errcode == 22:
+                        return None
+                    else:  # pragma: no cover
+                        raise
 
-        if self.cl_cursor is None:
             try:
-                self.set_cursors(self.register.current)
+                data = self.cl_cursor.current()
             except db.DBInvalidArgError as exc:
                 errcode, _ = exc.args
-                self.retry = True
                 if errcode == 22:
-                    return None
+                    data = None
                 else:  # pragma: no cover
                     raise
 
+            if data is None:
+                if self.has_next_log():
+                    next_log = True
+                else:
+                    self.retry = True
+                    self._exhausted = True
+                    return None
+            else:
+                _, value = data
+                if self._format is None:
+                    self._load_format()
+                if self._format == FORMAT_RAW and self._codec is None:
+                    return value
+
+                pos = (self.li_cursor.idx, self.cl_cursor.idx)
+                value = self._decode(pos, value)
+                if self._format != FORMAT_PACKED:
+                    return value
+
+                self._block = value
+                self._block_pos = pos
+                self._subidx = 0
+                value = self._next_in_block()
+                if value is not None:
+                    return value
+                next_log = False
+
+    def _load_format(self):
+        """Read the format of the current log."""
+        # Stored by the writer before the first row.
+        meta = self.logmeta.get(self.current_logname)
+        self._format, self._codec = load_meta(meta)
+
+    def _decode(self, pos, value):
+        """
+        Return the row `value` at `pos` decompressed (and as a list of
+        messages if it is a block).
+
+        """
         try:
-            data = self.cl_cursor.current()
-        except db.DBInvalidArgError as exc:
-            errcode, _ = exc.args
-            if errcode == 22:
-                data = None
-            else:  # pragma: no cover
-                raise
+            self._cache.move_to_end(pos)
+            return self._cache[pos]
+        except KeyError:
+            pass
+
+        if self._codec is not None:
+            value = self._codec.decompress(value)
+        if self._format == FORMAT_PACKED:
+            value = unpack(value)
+
+        if self.block_cache:
+            self._cache[pos] = value
+            if len(self._cache) > self.block_cache:
+                self._cache.popitem(last=False)
+        return value
+
+    def _next_in_block(self):
+        """
+        Return the next message of the current block not yet
+        acknowledged, or `None` at the end of the block.
+
+        """
+        if self._block is None:
+            return None
 
-        if data is None:
-            if self.has_next_log():
-                return self.next(next_log=True)
-            else:
-                self.retry = True
-                return None
-        else:
-            _, value = data
-            return value
+        liidx, clidx = self._block_pos
+        subcount = len(self._block)
+        while self._subidx < subcount:
+            self._subidx += 1
+            record = SubRecord(liidx, clidx, None, self._subidx, subcount)
+            if record not in self.register:
+                return self._block[self._subidx - 1]
+
+        self._block = None
+        return None
+
+    def wait(self, timeout=None):
+        """
+        Block until a writer appends new data or `timeout` seconds pass.
+
+        Returns `True` if the writer woke us up.
+
+        """
+        if self.listener is None:
+            self.listener = Listener(self.path)
+        return self.listener.wait(timeout)
+
+    def next_record(self, timeout=None):
+        """
+        Return the next `Record` not yet acknowledged or `None`.
 
+        With a `timeout` wait up to `timeout` seconds for new data.
 
-    def next_record(self):
+        """
         data = self.next()
+        if data is None and timeout is not None:
+            deadline = time.monotonic() + timeout
+            if self.listener is None:
+                # Data written before listening would be lost, retry.
+                self.listener = Listener(self.path)
+                data = self.next()
+
+            while data is None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.listener.wait(remaining)
+                data = self.next()
+
         if data is None:
             return None
+        elif self._block is not None:
+            liidx, clidx = self._block_pos
+            return SubRecord(liidx=liidx, clidx=clidx, value=data,
+                             subidx=self._subidx, subcount=len(self._block))
         else:
             return Record(liidx=self.li_cursor.idx,
                           clidx=self.cl_cursor.idx,
                           value=data)
 
+    def close(self):
+        """Close the DB handles and stop listening for wakeups."""
+        self.release()
+        if self.head is not None:
+            self.head.close()
+            self.head = None
+        if self.listener is not None:
+            self.listener.close()
+            self.listener = None
+        if self.current_log is not None:
+            self.current_log.close()
+            self.current_log = None
+        self.logmeta.close()
+        self.logindex.close()
+        self.env.close()
+
+    def next_records(self, max_count, max_bytes=None, timeout=None):
+        """
+        Return a list with up to `max_count` records not yet acknowledged.
+
+        The records are read from the current log DB only (but for the
+        packed logs), so the list can be shorter than `max_count` even
+        if there are more logs.
+        When `max_bytes` is given the batch is closed as soon as the
+        values reach that size (at least one record is returned).
+
+        With a `timeout` wait up to `timeout` seconds for the first one.
+
+        """
+        first = self.next_record(timeout=timeout)
+        if first is None:
+            return []
+
+        records = [first]
+        size = len(first.value)
+        if first.subidx is not None:
+            while (len(records) < max_count and
+                   (max_bytes is None or size < max_bytes)):
+                record = self.next_record()
+                if record is None:
+                    break
+                records.append(record)
+                size += len(record.value)
+            return records
+
+        while (len(records) < max_count and
+               (max_bytes is None or size < max_bytes)):
+            pos = self.register.next()
+            self.cl_cursor.idx = pos.clidx
+            try:
+                data = self.cl_cursor.current()
+            except db.DBInvalidArgError as exc:
+                errcode, _ = exc.args
+                if errcode == 22:
+                    data = None
+                else:  # pragma: no cover
+                    raise
+
+            if data is None:
+                # Retry this position in the next call.
+                self.retry = True
+                self.release()
+                break
+            else:
+                clidx, value = data
+                if self._codec is not None:
+                    value = self._decode((first.liidx, clidx), value)
+                records.append(Record(liidx=first.liidx,
+                                      clidx=clidx,
+                                      value=value))
+                size += len(value)
+
+        return records
+
     def load(self):
         if self.checkpoint is None:
             raise ValueError('checkpoint was not set')
 
-        try:
-            with ACIDFile(self.checkpoint, mode='rb') as cp:
-                self.register = pickle.load(cp)
-        except:
+        register = self.acks.load()
+        if register is None:
             return False
         else:
+            self.register = register
             self.register.reset()
+            self._block = None
+
+            # Start directly from the first log which can have
+            # unacknowledged records.
+            first = self.first_available(max(self.register.low, 1))
+            if first is not None:
+                self.register.seek(first)
             return True
 
     def save(self):
         if self.checkpoint is None:
             raise ValueError('checkpoint was not set')
 
-        if not os.path.isdir(self.checkpoint):
-            os.makedirs(self.checkpoint)
+        return self.acks.save(self.register, self.compact)
 
-        try:
-            with ACIDFile(self.checkpoint, mode='wb') as cp:
-                pickle.dump(self.register, cp)
-        except:  # pragma: no cover
-            return False
-        else:
-            return True
+    def snapshot(self):
+        """Write the whole (compacted) register and clear the journal."""
+        if self.checkpoint is None:
+            raise ValueError('checkpoint was not set')
+
+        return self.acks.save(self.register, self.compact, snapshot=True)
 
     def ack(self, record):
         """Acknowledge some data given by `next_record`."""
         self.register.add(record)
+        if self.acks is None:
+            return
+        elif record.subidx is None:
+            self.acks.ack_range(record.liidx, record.clidx, record.clidx)
+        elif (record.liidx, record.clidx) in self.register.partial:
+            self.acks.ack_sub(record.liidx, record.clidx,
+                              record.subidx, record.subcount)
+        else:
+            self.acks.ack_block(record.liidx, record.clidx)
+
+    def ack_range(self, liidx, first, last):
+        """
+        Acknowledge the records of the log `liidx` from `first` to `last`
+        (both included).
+
+        """
+        self.register.add_range(liidx, first, last)
+        if self.acks is not None:
+            self.acks.ack_range(liidx, first, last)
+
+    def ack_many(self, records):
+        """Acknowledge a batch of records given by `next_record(s)`."""
+        logs = {}
+        for record in records:
+            if record.subidx is not None:
+                self.ack(record)
+                continue
+            logs.setdefault(record.liidx, []).append(record.clidx)
+
+        for liidx, clidxs in logs.items():
+            clidxs.sort()
+            first = last = clidxs[0]
+            for clidx in clidxs[1:]:
+                if clidx > last + 1:
+                    self.ack_range(liidx, first, last)
+                    first = clidx
+                last = clidx
+            self.ack_range(liidx, first, last)
+
+    def seek(self, liidx, clidx=1):
+        """
+        Continue reading from the record `(liidx, clidx)`.
+
+        The acknowledged records are skipped as usual.
+
+        """
+        self.register.seek(liidx, clidx)
+        self._block = None
+        self.retry = False
+        self._idle = None
+        self.release()
 
     def has_next_log(self):
         """Returns `True` if there is a next event log."""
@@ -165,19 +514,78 @@ class Reader:
         finally:
             self.li_cursor.idx = last_idx
 
+    def release(self):
+        """Close the live BDB cursors (if any)."""
+        self.li_cursor.release()
+        if self.cl_cursor is not None:
+            self.cl_cursor.release()
+
     def set_cursors(self, rec):
         if self.cl_cursor is None or rec.liidx != self.last_liidx:
             self.last_liidx = rec.liidx
             self.li_cursor.idx = rec.liidx
             _, logname = self.li_cursor.current()
+            self.current_logname = logname
+            self._format = None
+            if self.cl_cursor is not None:
+                self.cl_cursor.release()
             self.current_log = db.DB(self.env)
             self.current_log.open(logname.decode('utf-8'),
                                   None, db.DB_RECNO, db.DB_RDONLY)
 
-            self.cl_cursor = Cursor(self.current_log, rec.clidx)
+            self.cl_cursor = self.cursor_class(self.current_log, rec.clidx)
         else:
             self.cl_cursor.idx = rec.clidx
 
+    def log_last(self, liidx):
+        """Return the last clidx of the log `liidx` (0 if empty)."""
+        cursor = self.logindex.cursor()
+        try:
+            data = cursor.set(liidx)
+        finally:
+            cursor.close()
+        if data is None:
+            return 0
+
+        _, name = data
+        try:
+            cdb = db.DB(self.env)
+            cdb.open(name.decode('utf-8'), None, db.DB_RECNO, db.DB_RDONLY)
+        except db.DBNoSuchFileError:
+            return 0
+        else:
+            cur = cdb.cursor()
+            cdata = cur.last()
+            cur.close()
+            cdb.close()
+            if cdata is None:
+                return 0
+            else:
+                cidx, _ = cdata
+                return cidx
+
+    def compact(self, register=None):
+        """
+        Collapse the fully acknowledged logs of the register (or of the
+        given `register`) and drop the deleted ones.
+
+        """
+        if register is None:
+            register = self.register
+
+        available = []
+        cursor = self.logindex.cursor()
+        try:
+            data = cursor.first()
+            while data is not None:
+                idx, _ = data
+                available.append(idx)
+                data = cursor.next()
+        finally:
+            cursor.close()
+
+        register.compact(available, self.log_last)
+
     def status(self):
         res = {}
 
@@ -200,13 +608,15 @@ class Reader:
                 if cdata is not None:
                     cidx, _ = cdata
                     reg = self.register.reg.get(idx)
-                    res[idx] = [(1, cidx)] == reg
-                    if not reg and idx > 1:
+                    low = self.register.low
+                    res[idx] = idx < low or [(1, cidx)] == reg
+                    if not reg and idx > 1 and idx >= low:
                         res[idx - 1] = False
 
             data = self.li_cursor.next()
 
         self.li_cursor.idx = li_idx
+        self.li_cursor.release()
         return res
 
 
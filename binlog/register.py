@@ -1,72 +1,214 @@
-from bisect import insort
+from bisect import bisect_left, bisect_right, insort
 from copy import deepcopy
 
 from .binlog import Record
 
 
+def find(intervals, idx):
+    """
+    Return the interval of the sorted list `intervals` containing `idx`
+    or `None`.
+
+    """
+    pos = bisect_right(intervals, (idx, float('inf'))) - 1
+    if pos >= 0 and intervals[pos][1] >= idx:
+        return intervals[pos]
+    else:
+        return None
+
+
 class Register:
     """
     The register logs the reader acknowledgements.
 
-    
+    Each log index maps to a sorted list of disjoint and non adjacent
+    intervals, searched with bisect.
+
     reg = {
       1: [(1, 20), (30, 30)],
       2: [(2, 2)],
     }
+
+    All the logs below `low` are fully acknowledged (or deleted) and
+    are not kept in `reg`. See `compact`.
+
+    The blocks of the packed logs with some of their messages
+    acknowledged are kept in `partial`, as a `(subcount, mask)` tuple
+    (bit `subidx - 1` of the mask is set for each acknowledged
+    message), until all of them are and the block joins `reg`::
+
+    partial = {
+      (3, 7): (100, 0b1011),
+    }
+
+    The clidx of the blocks in `partial` are also indexed by log (sorted
+    lists, searched with bisect), so the acknowledgements only look at
+    the blocks they cover.
+
     """
+
+    #: Lowest log index which can have unacknowledged records.
+    low = 0
+
     def __init__(self, reg=None, liidx=0):
         if reg is not None:
             self.reg = deepcopy(reg)
         else:
             self.reg = {}
 
+        self.partial = {}
         self.liidx = liidx
         self.clidx = 0
 
-    def add(self, record, last=None):
+    def __setstate__(self, state):
+        # Registers pickled by older versions have no `partial` (or no
+        # index of it).
+        state = dict(state)
+        partial = state.pop('partial', None)
+        self.__dict__.update(state)
+        if partial is not None or '_partial' not in state:
+            self.partial = partial or {}
+
+    @property
+    def partial(self):
+        return self._partial
+
+    @partial.setter
+    def partial(self, partial):
+        self._partial = partial
+        self._partial_clidx = {}
+        for liidx, clidx in sorted(partial):
+            self._partial_clidx.setdefault(liidx, []).append(clidx)
+
+    def add(self, record):
         """
         This add a new ack to the list.
 
         :param record: The record to ack to.
-        :para last: .....
 
         """
-        if type(record) != Record:
+        if not isinstance(record, Record):
             raise ValueError('`record` must be a Record instance.')
 
-        if self.reg == {}: 
-            self.reg[record.liidx] = [(record.clidx, record.clidx)]
-        elif not record.liidx in self.reg:
-            self.reg[record.liidx] = [(record.clidx, record.clidx)]
+        if record.subidx is None:
+            self.add_range(record.liidx, record.clidx, record.clidx)
         else:
-            for idx, v in enumerate(self.reg[record.liidx]):
-                l, r = v
-                if r == (record.clidx - 1):
-                    r = record.clidx
-                    break
-                elif l == (record.clidx + 1):
-                    l = record.clidx
-                    break
-                elif last is None and l <= record.clidx <= r:
-                    return None
-            else:
-                if last is None:
-                    insort(self.reg[record.liidx],
-                           (record.clidx, record.clidx))
-                return None
-
-            if last is not None and idx != last:
-                current = self.reg[record.liidx].pop(idx)
-                other = self.reg[record.liidx].pop(last)
-                insort(self.reg[record.liidx],
-                       (other[0], current[1]))
+            self.add_sub(record.liidx, record.clidx,
+                         record.subidx, record.subcount)
+
+    def add_sub(self, liidx, clidx, subidx, subcount):
+        """
+        Acknowledge the message `subidx` (from 1) of the block `clidx`
+        of the log `liidx`, with `subcount` messages.
+
+        The block is acknowledged once all its messages are.
+
+        """
+        if not 1 <= subidx <= subcount:
+            raise ValueError('`subidx` must be between 1 and `subcount`.')
+
+        if liidx < self.low or find(self.reg.get(liidx, []), clidx):
+            return
+
+        key = (liidx, clidx)
+        if key in self._partial:
+            subcount, mask = self._partial[key]
+        else:
+            mask = 0
+            insort(self._partial_clidx.setdefault(liidx, []), clidx)
+
+        mask |= 1 << (subidx - 1)
+        if mask == (1 << subcount) - 1:
+            # Drops the block from `partial` too.
+            self.add_range(liidx, clidx, clidx)
+        else:
+            self._partial[key] = (subcount, mask)
+
+    def add_range(self, liidx, first, last):
+        """
+        Acknowledge all the records of the log `liidx` from `first` to
+        `last` (both included).
+
+        The range is merged with the overlapping and adjacent intervals
+        in one step.
+
+        """
+        if first > last:
+            raise ValueError('`first` must be lower or equal than `last`.')
+
+        intervals = self.reg.setdefault(liidx, [])
+
+        # First interval ending at first - 1 or later.
+        start = bisect_left(intervals, (first, ))
+        if start > 0 and intervals[start - 1][1] >= first - 1:
+            start -= 1
+
+        # First interval starting after last + 1.
+        end = bisect_right(intervals, (last + 1, float('inf')))
+
+        if start < end:
+            first = min(first, intervals[start][0])
+            last = max(last, intervals[end - 1][1])
+        intervals[start:end] = [(first, last)]
+
+        clidxs = self._partial_clidx.get(liidx)
+        if clidxs:
+            start = bisect_left(clidxs, first)
+            end = bisect_right(clidxs, last)
+            for clidx in clidxs[start:end]:
+                del self._partial[(liidx, clidx)]
+            del clidxs[start:end]
+            if not clidxs:
+                del self._partial_clidx[liidx]
+
+    def compact(self, available, last):
+        """
+        Collapse the fully acknowledged logs into `low`.
+
+        :param available: Sorted list of the existing log indexes. The
+                          logs not in this list were deleted and are
+                          dropped.
+        :param last: Function returning the last clidx of a finished
+                     log (0 if it is empty). The newest log is never
+                     considered finished.
+
+        """
+        if not available:
+            return
+
+        low = self.low
+        for liidx in available[:-1]:
+            if liidx < low:
+                continue
+
+            intervals = self.reg.get(liidx, [])
+            if len(intervals) > 1 or intervals and intervals[0][0] != 1:
+                low = liidx
+                break
+
+            end = last(liidx)
+            if end == 0 or intervals == [(1, end)]:
+                low = liidx + 1
             else:
-                self.reg[record.liidx][idx] = (l, r)
-                self.add(record, last=idx)
+                low = liidx
+                break
+        else:
+            low = max(low, available[-1])
+
+        self.low = low
+
+        keep = set(available)
+        for liidx in list(self.reg):
+            if liidx < low or liidx not in keep:
+                del self.reg[liidx]
+        for liidx in list(self._partial_clidx):
+            if liidx < low or liidx not in keep:
+                for clidx in self._partial_clidx.pop(liidx):
+                    del self._partial[(liidx, clidx)]
 
     def next_cl(self):
         if self.liidx == 0:
-            self.liidx = 1
+            self.liidx = max(1, self.low)
         self.clidx += 1
         r = Record(self.liidx, self.clidx, None)
         return r
@@ -76,6 +218,7 @@ class Register:
             self.liidx = 1
         else:
             self.liidx += 1
+        self.liidx = max(self.liidx, self.low)
         self.clidx = 0
         return self.next_cl()
 
@@ -84,32 +227,41 @@ class Register:
         self.liidx = 0
         self.clidx = 0
 
+    def seek(self, liidx, clidx=1):
+        """
+        Move before the record `clidx` of the log `liidx` (the beginning
+        of the log by default).
+
+        """
+        self.liidx = max(liidx, self.low)
+        if self.liidx == liidx:
+            self.clidx = clidx - 1
+        else:
+            self.clidx = 0
+
     def next(self, log=False):
         """This method return the next record not in self.reg."""
-        def get_next(i, l):
-            for l, r in l:
-                if l <= i <= r:
-                    return r+1
-                elif l > i:
-                    break
-            return i
-
         if log:
             r = self.next_li()
         else:
             r = self.next_cl()
 
-        n = get_next(r.clidx, self.reg.get(self.liidx, []))
-        self.clidx = n
+        interval = find(self.reg.get(self.liidx, []), r.clidx)
+        if interval is None:
+            self.clidx = r.clidx
+        else:
+            self.clidx = interval[1] + 1
         self.current = Record(self.liidx, self.clidx, None)
         return self.current
 
     def __contains__(self, item):
         """Check if a record is in this register."""
-        if not item.liidx in self.reg:
+        if item.liidx < self.low:
+            return True
+        elif find(self.reg.get(item.liidx, []), item.clidx) is not None:
+            return True
+        elif item.subidx is None:
             return False
-        for l, r in self.reg[item.liidx]:  # pragma: no branch
-            if l <= item.clidx <= r:
-                return True
-            elif l > item.clidx:  # pragma: no cover
-                return False
+
+        subcount, mask = self.partial.get((item.liidx, item.clidx), (0, 0))
+        return bool(mask >> (item.subidx - 1) & 1)
@@ -0,0 +1,306 @@
+"""
+Automatic deletion of the logs of a binlog environment.
+
+A log is consumed when all the checkpoints in `CHECKPOINT_DIR` have
+acknowledged every record of it. The retention deletes the consumed
+logs and, optionally, the oldest logs (consumed or not) to keep the
+environment under a size or age cap.
+
+It can be used as a library (`Retention`) or from the command line::
+
+    binlog-retention ENVIRONMENT [--max-bytes N] [--max-age SECONDS]
+                                 [--interval SECONDS]
+
+"""
+from argparse import ArgumentParser
+import logging
+import os
+import time
+
+from acidfile import ACIDFile
+from bsddb3 import db
+
+from .binlog import TDSBinlog
+from .block import bytes_key, created_key, load_created
+from .checkpoint import Journal, load as load_checkpoint
+from .constants import LOGINDEX_NAME, LOGMETA_NAME, CHECKPOINT_DIR
+from .constants import JOURNAL_SUFFIX, RETENTION_BATCH
+
+logger = logging.getLogger(__name__)
+
+# Suffixes of the files of an `ACIDFile` (with one copy).
+ACIDFILE_SUFFIXES = ('.0', '.1')
+
+
+class Retention(TDSBinlog):
+    """
+    Delete the logs no longer needed by the readers of a Transactional
+    Data Store environment.
+
+    Besides the consumed logs, the oldest logs are deleted while the
+    environment is larger than `max_bytes` and the logs finished more
+    than `max_age` seconds ago are deleted, even if some reader did not
+    acknowledge them yet. The readers without a checkpoint are not
+    taken into account.
+
+    The current log (the last one of the logindex) is never deleted, and
+    neither is a log prepared ahead by the writer (it is not in the
+    logindex yet). The logs are deleted `batch` at a time, each batch in
+    a `DB_TXN_NOWAIT` transaction: when a writer or a reader is using one
+    of them the batch is given up, without waiting, and retried on the
+    next `run()`.
+
+    """
+    def __init__(self, path, max_bytes=None, max_age=None,
+                 batch=RETENTION_BATCH):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.batch = batch
+
+        self.env = self.open_environ(path, create=False)
+        self.logindex = self.open_logindex(self.env, LOGINDEX_NAME)
+        self.logmeta = self.open_logmeta(self.env, LOGMETA_NAME)
+
+    def close(self):
+        self.logmeta.close()
+        self.logindex.close()
+        self.env.close()
+
+    def logs(self):
+        """Return the `(idx, name)` of the logs in the logindex."""
+        logs = []
+        cursor = self.logindex.cursor()
+        try:
+            data = cursor.first()
+            while data is not None:
+                idx, name = data
+                logs.append((idx, name.decode('utf-8')))
+                data = cursor.next()
+        finally:
+            cursor.close()
+        return logs
+
+    def checkpoints(self):
+        """Return the names of the checkpoints of the environment."""
+        directory = os.path.join(self.path, CHECKPOINT_DIR)
+        try:
+            entries = os.listdir(directory)
+        except FileNotFoundError:
+            return []
+
+        names = set()
+        for entry in entries:
+            name, suffix = os.path.splitext(entry)
+            if os.path.isdir(os.path.join(directory, entry)):
+                names.add(entry)
+            elif suffix in ACIDFILE_SUFFIXES:
+                names.add(name)
+        return sorted(names)
+
+    def load_register(self, name):
+        """
+        Return the `Register` of the checkpoint `name` (with its journal
+        applied) or `None` if it cannot be read.
+
+        The `ACIDFile` is not closed: closing it would write the
+        checkpoint back, maybe over a newer one saved by its reader.
+
+        """
+        checkpoint = os.path.join(self.path, CHECKPOINT_DIR, name)
+        try:
+            register = load_checkpoint(ACIDFile(checkpoint, mode='rb'))
+        except Exception:
+            return None
+
+        Journal(checkpoint + JOURNAL_SUFFIX).replay(register)
+        return register
+
+    def _last_clidx(self, name):
+        """Return the index of the last record of the log `name`."""
+        log = db.DB(self.env)
+        try:
+            log.open(name, None, db.DB_RECNO, db.DB_RDONLY)
+        except db.DBNoSuchFileError:
+            return 0
+
+        try:
+            cursor = log.cursor()
+            data = cursor.last()
+            cursor.close()
+        finally:
+            log.close()
+
+        if data is None:
+            return 0
+        else:
+            clidx, _ = data
+            return clidx
+
+    def consumed(self, logs):
+        """
+        Return the index of the first of the `logs` (`(idx, name, last
+        clidx)` tuples) with records not acknowledged by some checkpoint;
+        the logs below it are consumed.
+
+        Nothing is consumed without checkpoints or when one of them
+        cannot be read.
+
+        """
+        # The current log is never consumed.
+        first = logs[-1][0]
+
+        names = self.checkpoints()
+        if not names:
+            return logs[0][0]
+
+        for name in names:
+            register = self.load_register(name)
+            if register is None:
+                logger.warning("Cannot read the checkpoint %r", name)
+                return logs[0][0]
+
+            for idx, _, last in logs:
+                if idx >= first:
+                    break
+                elif idx < register.low or not last:
+                    continue
+                elif register.reg.get(idx) == [(1, last)]:
+                    continue
+                else:
+                    first = idx
+                    break
+
+        return first
+
+    def _size(self, name):
+        try:
+            return os.path.getsize(os.path.join(self.path, name))
+        except OSError:
+            return 0
+
+    def _finished(self, name, following):
+        """
+        Return when the log `name` was last written: the creation time
+        of the `following` log (or the modification time of the file).
+
+        """
+        data = self.logmeta.get(created_key(following.encode('utf-8')))
+        if data is not None:
+            return load_created(data)
+
+        try:
+            return os.path.getmtime(os.path.join(self.path, name))
+        except OSError:
+            return 0
+
+    def eligible(self):
+        """Return the `(idx, name)` of the logs to delete, oldest first."""
+        logs = [(idx, name, self._last_clidx(name))
+                for idx, name in self.logs()]
+        if len(logs) < 2:
+            return []
+
+        old = logs[:-1]
+        first = self.consumed(logs)
+        delete = {idx for idx, _, _ in old if idx < first}
+
+        if self.max_age is not None:
+            limit = time.time() - self.max_age
+            for (idx, name, _), (_, following, _) in zip(old, logs[1:]):
+                if self._finished(name, following) < limit:
+                    delete.add(idx)
+
+        if self.max_bytes is not None:
+            sizes = [(idx, self._size(name)) for idx, name, _ in old]
+            total = self._size(logs[-1][1])
+            total += sum(size for idx, size in sizes if idx not in delete)
+            for idx, size in sizes:
+                if total <= self.max_bytes:
+                    break
+                elif idx not in delete:
+                    delete.add(idx)
+                    total -= size
+
+        return [(idx, name) for idx, name, _ in old if idx in delete]
+
+    def _delete(self, logs):
+        """
+        Delete the `logs` in a transaction. Return `False` (deleting
+        none) if one of them is locked.
+
+        The logindex and the log metadata are not transactional, so
+        their entries are only removed once the files are gone: a log
+        never leaves the logindex while its file can come back. A
+        failure in between leaves entries without a file, which the
+        readers skip and the next `run()` removes.
+
+        """
+        txn = self.env.txn_begin(flags=db.DB_TXN_NOWAIT)
+        try:
+            for idx, name in logs:
+                filename = os.path.join(self.path, name)
+                if os.path.exists(filename):
+                    self.env.dbremove(filename, txn=txn)
+        except db.DBError:
+            txn.abort()
+            return False
+        else:
+            txn.commit()
+
+        for idx, name in logs:
+            self.logindex.delete(idx)
+            key = name.encode('utf-8')
+            for meta in (key, created_key(key), bytes_key(key)):
+                if self.logmeta.get(meta) is not None:
+                    self.logmeta.delete(meta)
+        self.logindex.sync()
+        self.logmeta.sync()
+        return True
+
+    def run(self):
+        """Delete the eligible logs and return their indexes."""
+        deleted = []
+        logs = self.eligible()
+        for start in range(0, len(logs), self.batch):
+            batch = logs[start:start + self.batch]
+            if not self._delete(batch):
+                logger.info("Logs %d to %d in use, not deleted",
+                            batch[0][0], batch[-1][0])
+                break
+            deleted.extend(idx for idx, _ in batch)
+        return deleted
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    parser = ArgumentParser()
+    parser.add_argument("environment")
+    parser.add_argument("--max-bytes", type=int,
+                        help="delete the oldest logs above this size (bytes)")
+    parser.add_argument("--max-age", type=float,
+                        help="delete the logs older than this (seconds)")
+    parser.add_argument("--batch", type=int, default=RETENTION_BATCH,
+                        help="logs deleted in each transaction")
+    parser.add_argument("--interval", type=float,
+                        help="run every INTERVAL seconds (default: once)")
+    args = parser.parse_args()
+
+    retention = Retention(args.environment, max_bytes=args.max_bytes,
+                          max_age=args.max_age, batch=args.batch)
+    try:
+        while True:
+            deleted = retention.run()
+            if deleted:
+                logger.info("Deleted logs %s", ', '.join(map(str, deleted)))
+            if args.interval is None:
+                break
+            time.sleep(args.interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        retention.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,65 +1,525 @@
+from collections import deque
+from functools import partial
 from io import BytesIO
 import os
 import asyncio
 import signal
+import socket
+import struct
 
-from .writer import TDSWriter
+from .aio import TDSAsyncWriter, QUEUE_SIZE
+from .hub import Hub
+from .protocol import FrameReader, APPEND, SUBSCRIBE, ACK, SUBACK
+from .protocol import ACK_MESSAGE, ACK_BATCH
+from .protocol import result, error, record, subrecord
+from .protocol import parse_ack, parse_suback
 
 import logging
 
 logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+# Largest message accepted (bytes).
+MAX_MESSAGE_SIZE = 16 * 1024 * 1024
+
+# Bytes held by the server (received and not yet written) before it stops
+# reading from the connections.
+MAX_BUFFERED = 256 * 1024 * 1024
+
+# Datagrams are read with a buffer of this size (`asyncio` default), the
+# larger ones arrive truncated.
+MAX_DATAGRAM_SIZE = 256 * 1024
+
+# Receive buffer of the datagram socket.
+DATAGRAM_RCVBUF = 4 * 1024 * 1024
+
 
 class Server:
-    def __init__(self, base, uds_path):
-        self.binlog = TDSWriter(base)
+    """
+    Store the data of every connection to the UNIX socket as a message.
+
+    With `framed=True` the connections are persistent instead and carry
+    any number of length prefixed messages (see `binlog.protocol`).
+    The `ack` modes of the framed protocol reply to the client with the
+    position of the messages once they are written (and flushed, with
+    the `group` durability). Framed connections can also subscribe to
+    the records, read for all of them by a single `Hub`.
+
+    The messages are written by an `AsyncWriter` thread, so the appends
+    (and log rotations) never block the event loop. When `max_queue`
+    messages are waiting to be written, or the server holds more than
+    `max_buffered` bytes, it stops reading from the connections until
+    both are half empty. Messages larger than `max_message_size` are
+    rejected. See `stats()`.
+
+    With a `datagram_path` every datagram received in that UNIX socket
+    is a message too (`uds_path` can be `None` to use only datagrams).
+    Datagrams are dropped instead of waiting while the server is over
+    its limits.
+
+    """
+    def __init__(self, base, uds_path, max_queue=QUEUE_SIZE, framed=False,
+                 ack=None, backlog=socket.SOMAXCONN,
+                 max_message_size=MAX_MESSAGE_SIZE, max_buffered=MAX_BUFFERED,
+                 datagram_path=None, **kwargs):
+        if ack not in (None, ACK_MESSAGE, ACK_BATCH):
+            raise ValueError('Unsupported ack mode %r' % ack)
+        if ack is not None and not framed:
+            raise ValueError('The ack modes require the framed protocol')
+
+        self.writer = TDSAsyncWriter(base, max_queue=max_queue, **kwargs)
+        self.binlog = self.writer.writer
         self.uds_path = uds_path
+        self.datagram_path = datagram_path
+        self.framed = framed
+        self.ack = ack
+        self.backlog = backlog
         self._proto = None
+        self._dgram_proto = None
+
+        # Open connections: transport -> protocol.
+        self.transports = {}
+        self.paused = False
+        self.resume_size = max_queue // 2
+
+        self.max_message_size = max_message_size
+        self.max_buffered = max_buffered
+
+        # Bytes of the incomplete messages and of the queued ones.
+        self.receiving = 0
+        self.queued = 0
+        self.peak_buffered = 0
+        self.rejected = 0
+        self.dropped = 0
+        self.oversize = 0
+
+        # Connection reading while the others are paused (see `_flow`).
+        self._escaped = None
+
+        # Messages waiting for room in the write queue (in order).
+        self.overflow = deque()
+
+        self.hub = None
+
+    def stats(self):
+        """Return the live counters of the server."""
+        return {'connections': len(self.transports),
+                'receiving': self.receiving,
+                'queued': self.queued,
+                'buffered': self.receiving + self.queued,
+                'peak_buffered': self.peak_buffered,
+                'rejected': self.rejected,
+                'dropped_datagrams': self.dropped,
+                'oversize_datagrams': self.oversize,
+                'paused': self.paused,
+                'rotations': self.binlog.metrics['rotations'],
+                'rotation_max': self.binlog.metrics['rotation_max']}
+
+    def pause(self):
+        """Stop reading from the connections."""
+        if not self.paused:
+            self.paused = True
+            for transport in self.transports:
+                transport.pause_reading()
+        elif self._escaped is not None:
+            self._escaped.pause_reading()
+        self._escaped = None
+
+    def resume(self):
+        """Read from the connections again."""
+        if self.paused:
+            self.paused = False
+            self._escaped = None
+            for transport in self.transports:
+                transport.resume_reading()
+
+    def _flow(self):
+        """Pause or resume reading according to the limits."""
+        buffered = self.receiving + self.queued
+        if buffered > self.peak_buffered:
+            self.peak_buffered = buffered
+
+        if (self.overflow or self.writer.queue.full() or
+                buffered > self.max_buffered):
+            if self.queued or not self.receiving:
+                self.pause()
+            elif self._escaped is None:
+                # Nothing is being written, so nothing will be freed
+                # until a message is complete: let the biggest go on.
+                self.pause()
+                self._escaped = max(
+                    self.transports,
+                    key=lambda t: self.transports[t].receiving)
+                self._escaped.resume_reading()
+        elif (self.writer.queue.qsize() <= self.resume_size and
+                buffered <= self.max_buffered // 2):
+            self.resume()
+
+    def _connected(self, transport, protocol):
+        self.transports[transport] = protocol
+        if self.paused:
+            transport.pause_reading()
+
+    def _disconnected(self, transport):
+        del self.transports[transport]
+        if self._escaped is transport:
+            self._escaped = None
+        self._flow()
+
+    def _receive(self, size):
+        """Account `size` bytes more (or less) of incomplete messages."""
+        if size:
+            self.receiving += size
+            self._flow()
+
+    def _reject(self):
+        self.rejected += 1
+        logger.error("Message larger than %d bytes rejected",
+                     self.max_message_size)
+
+    def append(self, data):
+        """Queue `data` to be written and return a future with its position."""
+        self.queued += len(data)
+        future = asyncio.get_event_loop().create_future()
+        future.add_done_callback(partial(self._appended, len(data)))
+        if self.overflow:
+            self.overflow.append((data, future))
+        else:
+            try:
+                self.writer.append_nowait(data, future)
+            except asyncio.QueueFull:
+                self.overflow.append((data, future))
+
+        self._flow()
+        return future
+
+    def _refill(self):
+        """Move the messages waiting for room to the write queue."""
+        while self.overflow and not self.writer.queue.full():
+            self.writer.append_nowait(*self.overflow.popleft())
+
+    def _appended(self, size, future):
+        if not future.cancelled() and future.exception() is not None:
+            logger.error("Cannot write message: %r", future.exception())
+        self.queued -= size
+        self._refill()
+        self._flow()
+
+    async def subscribe(self, name, send):
+        """Send the records of the checkpoint `name` to `send`."""
+        if self.hub is None:
+            self.hub = Hub(self.binlog.path)
+        return await self.hub.subscribe(name, send)
 
     def get_protocol(self):
-        if self._proto is None:
+        if self._proto is None and self.framed:
+            class FramedBinlogProtocol(asyncio.Protocol):
+                def __init__(_self, *args, **kwargs):
+                    _self._frames = None
+                    _self._transport = None
+                    _self._subscribing = None
+                    _self._subscription = None
+                    _self._writing_paused = False
+                    # (future, reply function) in the order of the frames.
+                    _self._replies = deque()
+                    super().__init__(*args, **kwargs)
+
+                @property
+                def receiving(_self):
+                    return len(_self._frames)
+
+                def connection_made(_self, transport):
+                    _self._frames = FrameReader(self.max_message_size)
+                    _self._transport = transport
+                    self._connected(transport, _self)
+
+                def data_received(_self, data):
+                    receiving = _self.receiving
+                    frames = _self._frames.feed(data)
+                    self._receive(_self.receiving - receiving)
+
+                    futures = []
+                    for kind, payload in frames:
+                        if payload is None and kind == APPEND:
+                            future = _self._too_large()
+                            if future is not None:
+                                futures.append(future)
+                        elif payload is None:
+                            _self._fail("Frame too large")
+                            break
+                        elif kind == APPEND:
+                            futures.append(self.append(payload))
+                        elif kind == SUBSCRIBE:
+                            _self._subscribe(payload)
+                        elif kind == ACK:
+                            _self._ack(payload)
+                        elif kind == SUBACK:
+                            _self._ack(payload, sub=True)
+                        else:
+                            _self._fail("Unknown frame type %d" % kind)
+                            break
+
+                    if self.ack == ACK_MESSAGE:
+                        for future in futures:
+                            _self._reply_when_done(future, _self._reply)
+                    elif self.ack == ACK_BATCH and futures:
+                        batch = asyncio.gather(*futures,
+                                               return_exceptions=True)
+                        _self._reply_when_done(batch, _self._reply_batch)
+
+                def _reply_when_done(_self, future, reply):
+                    _self._replies.append((future, reply))
+                    future.add_done_callback(_self._send_replies)
+
+                def _send_replies(_self, _):
+                    replies = _self._replies
+                    while replies and replies[0][0].done():
+                        future, reply = replies.popleft()
+                        reply(future)
+
+                def _write(_self, frame):
+                    if not _self._transport.is_closing():
+                        _self._transport.write(frame)
+
+                def _too_large(_self):
+                    """Reject a message, returning a failed future to reply."""
+                    self._reject()
+                    if self.ack is None:
+                        return None
+
+                    future = asyncio.get_event_loop().create_future()
+                    future.set_exception(ValueError("Message too large"))
+                    return future
+
+                def _fail(_self, message):
+                    logger.error(message)
+                    _self._write(error(0, message))
+                    _self._transport.close()
+
+                def _subscribe(_self, payload):
+                    if _self._subscribing is not None:
+                        _self._fail("Already subscribed")
+                        return
+
+                    _self._subscribing = asyncio.ensure_future(
+                        self.subscribe(payload.decode('utf-8', 'replace'),
+                                       _self._send_record))
+                    _self._subscribing.add_done_callback(_self._subscribed)
+
+                def _subscribed(_self, task):
+                    if task.cancelled():
+                        return
+                    elif task.exception() is not None:
+                        _self._subscribing = None
+                        _self._write(error(0, str(task.exception())))
+                    else:
+                        subscription = task.result()
+                        subscription.paused = _self._writing_paused
+                        _self._subscription = subscription
+                        if _self._frames is None:
+                            # The connection was lost meanwhile.
+                            _self._unsubscribe()
+
+                def _unsubscribe(_self):
+                    subscription = _self._subscription
+                    _self._subscription = None
+                    if self.hub is not None:
+                        asyncio.ensure_future(
+                            self.hub.unsubscribe(subscription))
+
+                def _send_record(_self, rec):
+                    if rec.subidx is None:
+                        _self._write(record(rec.liidx, rec.clidx, rec.value))
+                    else:
+                        _self._write(subrecord(rec.liidx, rec.clidx,
+                                               rec.subidx, rec.subcount,
+                                               rec.value))
+
+                def _ack(_self, payload, sub=False):
+                    subscription = _self._subscription
+                    if subscription is None:
+                        _self._fail("Not subscribed")
+                        return
+
+                    try:
+                        if sub:
+                            subscription.ack_sub(*parse_suback(payload))
+                        else:
+                            subscription.ack_range(*parse_ack(payload))
+                    except (struct.error, ValueError) as exc:
+                        _self._fail("Invalid ack: %s" % exc)
+                    else:
+                        asyncio.ensure_future(self.hub.save(subscription))
+
+                def pause_writing(_self):
+                    _self._writing_paused = True
+                    if _self._subscription is not None:
+                        _self._subscription.paused = True
+
+                def resume_writing(_self):
+                    _self._writing_paused = False
+                    if _self._subscription is not None:
+                        _self._subscription.paused = False
+                        self.hub.wake()
+
+                def _reply(_self, future):
+                    if future.cancelled():
+                        _self._write(error(1, "Cancelled"))
+                    elif future.exception() is not None:
+                        _self._write(error(1, str(future.exception())))
+                    else:
+                        _self._write(result(1, future.result()))
+
+                def _reply_batch(_self, batch):
+                    positions = batch.result()
+                    for position in positions:
+                        if isinstance(position, BaseException):
+                            _self._write(error(len(positions), str(position)))
+                            break
+                    else:
+                        _self._write(result(len(positions), positions[-1]))
+
+                def connection_lost(_self, exc):
+                    if len(_self._frames):
+                        logger.warning("Connection lost in the middle "
+                                       "of a frame")
+                        self._receive(-len(_self._frames))
+                    self._disconnected(_self._transport)
+                    _self._frames = None
+                    if _self._subscription is not None:
+                        _self._unsubscribe()
+
+            self._proto = FramedBinlogProtocol
+
+        elif self._proto is None:
             class BinlogProtocol(asyncio.Protocol):
                 def __init__(_self, *args, **kwargs):
                     _self._buf = None
+                    _self._transport = None
+                    _self._rejected = False
                     super().__init__(*args, **kwargs)
 
+                @property
+                def receiving(_self):
+                    return _self._buf.tell()
+
                 def connection_made(_self, transport):
                     _self._buf = BytesIO()
+                    _self._transport = transport
+                    self._connected(transport, _self)
 
                 def data_received(_self, data):
-                    if _self._buf is not None:
-                        _self._buf.write(data)
-                    else:
+                    if _self._buf is None:
                         raise RuntimeError(
                             "Data received after connection opening "
                             "(reused protocol)")
+                    elif _self._rejected:
+                        return
+
+                    size = _self._buf.tell() + len(data)
+                    if size > self.max_message_size:
+                        # Discard the message and close the connection.
+                        self._reject()
+                        self._receive(-_self._buf.tell())
+                        _self._buf = BytesIO()
+                        _self._rejected = True
+                        _self._transport.close()
+                    else:
+                        _self._buf.write(data)
+                        self._receive(len(data))
 
                 def connection_lost(_self, exc):
-                    if _self._buf.tell():
-                        self.binlog.append(_self._buf.getvalue())
+                    size = _self._buf.tell()
+                    if size:
+                        self._receive(-size)
+                        self.append(_self._buf.getvalue())
+                    self._disconnected(_self._transport)
                     _self._buf = None
 
             self._proto = BinlogProtocol
 
         return self._proto
 
+    def get_datagram_protocol(self):
+        if self._dgram_proto is None:
+            class BinlogDatagramProtocol(asyncio.DatagramProtocol):
+                def datagram_received(_self, data, addr):
+                    if (len(data) > self.max_message_size or
+                            len(data) >= MAX_DATAGRAM_SIZE):
+                        self.oversize += 1
+                    elif (self.overflow or self.writer.queue.full() or
+                            self.receiving + self.queued + len(data) >
+                            self.max_buffered):
+                        self.dropped += 1
+                    elif data:
+                        self.append(data)
+
+                def error_received(_self, exc):
+                    logger.error("Datagram socket error: %r", exc)
+
+            self._dgram_proto = BinlogDatagramProtocol
+
+        return self._dgram_proto
+
+    def _datagram_socket(self):
+        """Return the bound datagram socket."""
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF,
+                            DATAGRAM_RCVBUF)
+        except OSError:  # pragma: no cover
+            pass
+
+        try:
+            os.unlink(self.datagram_path)
+        except FileNotFoundError:
+            pass
+        sock.bind(self.datagram_path)
+        return sock
+
+    async def close(self):
+        """Write the queued messages and close the writer and the hub."""
+        if self.hub is not None:
+            await self.hub.close()
+            self.hub = None
+        if self.overflow:
+            await asyncio.wait([future for _, future in self.overflow])
+        await self.writer.close()
+
     def run(self, loop=None):
         if loop is None:
             loop = asyncio.get_event_loop()
 
-        server = loop.run_until_complete(
-            loop.create_unix_server(self.get_protocol(),
-                                    self.uds_path,
-                                    backlog=0))
+        server = datagrams = None
+        if self.uds_path is not None:
+            server = loop.run_until_complete(
+                loop.create_unix_server(self.get_protocol(),
+                                        self.uds_path,
+                                        backlog=self.backlog))
+        if self.datagram_path is not None:
+            datagrams, _ = loop.run_until_complete(
+                loop.create_datagram_endpoint(self.get_datagram_protocol(),
+                                              sock=self._datagram_socket()))
 
-
-        loop.add_signal_handler(signal.SIGINT, lambda *_: server.close())
-        loop.add_signal_handler(signal.SIGTERM, lambda *_: server.close())
+        stop = asyncio.Event()
+        loop.add_signal_handler(signal.SIGINT, stop.set)
+        loop.add_signal_handler(signal.SIGTERM, stop.set)
+        loop.add_signal_handler(
+            signal.SIGUSR1, lambda *_: logger.info("Stats: %r", self.stats()))
 
         try:
-            loop.run_until_complete(server.wait_closed())
+            loop.run_until_complete(stop.wait())
+            if server is not None:
+                server.close()
+                loop.run_until_complete(server.wait_closed())
+            if datagrams is not None:
+                datagrams.close()
+            loop.run_until_complete(self.close())
         finally:
             loop.close()
-            try:
-                os.unlink(self.uds_path)
-            except IOError:
-                pass
+            for path in (self.uds_path, self.datagram_path):
+                if path is not None:
+                    try:
+                        os.unlink(path)
+                    except IOError:
+                        pass
@@ -1,87 +1,632 @@
 import os
+import time
 
 from bsddb3 import db
 
 from .binlog import TDSBinlog, CDSBinlog
+from .block import FORMAT_PACKED, FORMAT_RAW, CODECS, Codec
+from .block import dump_meta, pack, split
+from .block import created_key, dump_created, load_created
+from .block import bytes_key, dump_bytes, load_bytes
 from .constants import *
+from .head import Head
+from .notify import Notifier
+
+
+class GroupCommit:
+    """
+    Decide when the writes of a `group` durability writer must be
+    flushed.
+
+    A flush is due when `size` records were written since the last
+    flush or when the oldest unflushed record is older than `interval`
+    seconds.
+
+    """
+    def __init__(self, interval=GROUP_COMMIT_INTERVAL,
+                 size=GROUP_COMMIT_SIZE, clock=time.monotonic):
+        self.interval = interval
+        self.size = size
+        self.clock = clock
+        self.pending = 0
+        self.since = None
+
+    def add(self, count):
+        """Account `count` new unflushed records."""
+        if not self.pending:
+            self.since = self.clock()
+        self.pending += count
+
+    def due(self):
+        """Return `True` if the pending records must be flushed."""
+        if not self.pending:
+            return False
+        else:
+            return (self.pending >= self.size or
+                    self.clock() - self.since >= self.interval)
+
+    def reset(self):
+        """Forget the pending records (they were flushed)."""
+        self.pending = 0
+        self.since = None
 
 
 class Writer:
-    def __init__(self, path, max_log_events=MAX_LOG_EVENTS):
+    """
+    Append messages to a binlog environment.
+
+    With `packed=True` the messages written together (`append_many`)
+    are stored in blocks of up to `block_size` bytes, one row each, and
+    their positions are `(liidx, clidx, subidx)`. `append()` is not
+    buffered (its position is the committed one), so it writes a block
+    of a single message: pack the messages with `append_many` or an
+    `AsyncWriter`.
+
+    With a `compression` codec (`zlib` or `lzma`) every row (block or
+    message) is compressed. A zlib codec can use a preset dictionary
+    `zdict` of data similar to the messages, which helps a lot with the
+    small rows.
+
+    A log holds only one format: the writer starts a new log when the
+    current one was written in another.
+
+    The logs are rotated after `max_log_events` rows (blocks for a
+    packed writer) and, if given, once `max_log_bytes` bytes of rows
+    were written to them or when they are older than `max_log_age`
+    seconds. `prepare_next_log()` creates the next log ahead of time
+    (`AsyncWriter` calls it when idle), so the rotation itself only
+    appends it to the logindex and swaps the handles; the logindex and
+    the log metadata are synced on the next `prepare_next_log()`,
+    `flush()` or `close()`. `metrics` holds the number of rotations and
+    their latency (seconds).
+
+    """
+
+    #: Extra flags used when opening the log DBs.
+    open_flags = 0
+
+    #: Durability modes supported by this writer.
+    durabilities = ()
+    default_durability = None
+
+    def __init__(self, path, max_log_events=MAX_LOG_EVENTS,
+                 max_log_bytes=None, max_log_age=None, durability=None,
+                 group_interval=GROUP_COMMIT_INTERVAL,
+                 group_size=GROUP_COMMIT_SIZE, notify=True, packed=False,
+                 block_size=BLOCK_SIZE, compression=None, zdict=b''):
+        if durability is None:
+            durability = self.default_durability
+        if durability not in self.durabilities:
+            raise ValueError('Unsupported durability mode %r' % durability)
+
+        if compression is None:
+            self.codec = None
+        elif compression in CODECS:
+            self.codec = Codec(CODECS[compression], zdict)
+        else:
+            raise ValueError('Unsupported compression %r' % compression)
+
         self.path = path
         self.env = self.open_environ(path)
         self.logindex = self.open_logindex(self.env, LOGINDEX_NAME)
+        self.logmeta = self.open_logmeta(self.env, LOGMETA_NAME)
         self.max_log_events = max_log_events
+        self.max_log_bytes = max_log_bytes
+        self.max_log_age = max_log_age
         self._current_log = None
         self.next_will_create_log = False
         self._current_idx = None
 
+        # Size (bytes of the rows), creation time and last row of the
+        # current log, and the log to rotate on the next write.
+        self._log_bytes = 0
+        self._log_created = None
+        self._log_last = 0
+        self._full_idx = None
+
+        # Log created ahead of time (`(idx, name, DB)`), the handles of
+        # the previous logs and whether the logindex and the creation
+        # time of the current log must be synced, all done out of the
+        # rotation.
+        self._next_log = None
+        self._retired = []
+        self._unsynced = False
+
+        self.metrics = {'rotations': 0,
+                        'rotations_ahead': 0,
+                        'rotation_last': None,
+                        'rotation_max': 0.0,
+                        'rotation_total': 0.0}
+
+        self.log_format = FORMAT_PACKED if packed else FORMAT_RAW
+        self.block_size = block_size
+
+        self.durability = durability
+        self.group = GroupCommit(group_interval, group_size)
+
+        # Last position written and last position known to be on disk.
+        self.written = None
+        self.durable = None
+
+        # Publish the head position and wake up the readers waiting for
+        # new data.
+        self.head = Head(path, create=True)
+        self.notifier = Notifier(path) if notify else None
+
     def set_current_log(self):
         """Return the log DB for the current write."""
         cursor = self.logindex.cursor()
         last = cursor.last()
         cursor.close()
 
+        created = False
         if not last:
             name = LOG_PREFIX + '.1'
             self.logindex.append(name)
             self.logindex.sync()
             self._current_idx = 1
-            log = db.DB(self.env)
-            log.open(name, None, db.DB_RECNO, db.DB_CREATE)
+            log = self._open_log(name, create=True)
+            created = True
         else:
             idx, value = last
             self._current_idx = idx
             name = value.decode('utf-8')
 
-            log = db.DB(self.env)
             try:
-                log.open(name, None, db.DB_RECNO)
+                log = self._open_log(name)
             except Exception as exc:
                 # The last db was deleted
                 name = LOG_PREFIX + '.' + str(idx + 1)
                 self._current_idx = idx + 1
 
-                log = db.DB(self.env)
-                log.open(name, None, db.DB_RECNO, db.DB_CREATE)
-
+                log = self._open_log(name, create=True)
+                created = True
 
         cursor = log.cursor()
         last = cursor.last()
         cursor.close()
 
+        if created or self._current_idx == self._full_idx:
+            # New, or just filled: the rows are not counted again.
+            self._load_log_state(name)
+        else:
+            self._load_log_state(name, log)
         if last:
             eidx, _ = last
-            if eidx >= self.max_log_events:
+            self._log_last = eidx
+            if self._current_idx == self._full_idx or self._is_full(eidx):
                 log.close()
+                name, log = self._new_log()
+        self._full_idx = None
 
-                name = LOG_PREFIX + '.' + str(idx+1)
-                self.logindex.append(name)
-                self.logindex.sync()
-                self._current_idx = idx + 1
-
-                log = db.DB(self.env)
-                log.open(name, None, db.DB_RECNO, db.DB_CREATE)
+        if not self._check_format(name, log):
+            # Written in another format, start a new log.
+            log.close()
+            name, log = self._new_log()
+            self._check_format(name, log)
 
         self._current_log = log
         return self._current_log
 
-    def append(self, data):
-        """Append data to the current log DB."""
+    def _new_log(self):
+        """Add the log following the current one and open it."""
+        self._current_idx += 1
+        name = LOG_PREFIX + '.' + str(self._current_idx)
+        self.logindex.append(name)
+        self.logindex.sync()
+
+        log = self._open_log(name, create=True)
+        self._load_log_state(name)
+        return name, log
+
+    def _load_log_state(self, name, log=None):
+        """
+        Initialize the size and age counters of the log `name`: the bytes
+        of the rows of the existing `log` and its creation time, both
+        stored in the log metadata.
+
+        The rows are only added up when the log has no size stored
+        (written without `max_log_bytes`).
+
+        """
+        self._log_last = 0
+        self._log_bytes = 0
+        if log is not None and self.max_log_bytes is not None:
+            data = self.logmeta.get(bytes_key(name.encode('utf-8')))
+            if data is not None:
+                self._log_bytes = load_bytes(data)
+            else:
+                cursor = log.cursor()
+                try:
+                    data = cursor.first()
+                    while data is not None:
+                        self._log_bytes += len(data[1])
+                        data = cursor.next()
+                finally:
+                    cursor.close()
+
+        key = created_key(name.encode('utf-8'))
+        data = self.logmeta.get(key)
+        if data is None:
+            self._log_created = time.time()
+            self.logmeta.put(key, dump_created(self._log_created))
+            self.logmeta.sync()
+        else:
+            self._log_created = load_created(data)
+
+    def _store_log_bytes(self):
+        """Keep the size of the rows committed to the current log."""
+        if self.max_log_bytes is not None:
+            name = LOG_PREFIX + '.' + str(self._current_idx)
+            self.logmeta.put(bytes_key(name.encode('utf-8')),
+                             dump_bytes(self._log_bytes))
+
+    def _is_old(self):
+        """Return `True` if the current log is older than `max_log_age`."""
+        return (self.max_log_age is not None and
+                time.time() - self._log_created >= self.max_log_age)
+
+    def _is_full(self, idx, size=None):
+        """
+        Return `True` if the current log must be rotated after writing
+        the row `idx` (with `size` bytes of rows in the log, by default
+        the committed ones).
+
+        """
+        if size is None:
+            size = self._log_bytes
+        return (idx >= self.max_log_events or
+                self.max_log_bytes is not None and
+                size >= self.max_log_bytes or
+                self._is_old())
+
+    def _check_format(self, name, log):
+        """
+        Return `True` if the log `name` can be written in the format of
+        the writer (storing it when the log is empty).
+
+        """
+        key = name.encode('utf-8')
+        meta = dump_meta(self.log_format, self.codec)
+        if self.logmeta.get(key) == meta:
+            return True
+
+        cursor = log.cursor()
+        last = cursor.last()
+        cursor.close()
+        if last:
+            return False
+
+        if meta is None:
+            self.logmeta.delete(key)
+        else:
+            self.logmeta.put(key, meta)
+        self.logmeta.sync()
+        return True
+
+    def _open_log(self, name, create=False):
+        """Open (or create) the log DB `name`."""
+        flags = self.open_flags
+        if create:
+            flags |= db.DB_CREATE
+
+        log = db.DB(self.env)
+        log.open(name, None, db.DB_RECNO, flags)
+        return log
+
+    def _prepare_log(self):
+        """Make sure `_current_log` can receive the next append."""
+        if (self._current_log is not None and self._log_last and
+                self._is_old()):
+            self.next_will_create_log = True
+
         if self.next_will_create_log:
             self.next_will_create_log = False
             if self._current_log is not None:  # pragma: no branch
-                self._current_log.close()
-                self._current_log = None
+                start = time.perf_counter()
+                # Its size is not always visible from the file yet.
+                self._full_idx = self._current_idx
+                if self._next_log is not None and self._swap_log():
+                    self.metrics['rotations_ahead'] += 1
+                else:
+                    self._sync_rotation()
+                    self._current_log.close()
+                    self._current_log = None
+                    self.set_current_log()
+                self._rotated(time.perf_counter() - start)
             else:  # pragma: no cover
                 pass
 
         if self._current_log is None:
             self.set_current_log()
 
-        idx = self._current_log.append(data)
+    def _rotated(self, elapsed):
+        metrics = self.metrics
+        metrics['rotations'] += 1
+        metrics['rotation_last'] = elapsed
+        metrics['rotation_max'] = max(metrics['rotation_max'], elapsed)
+        metrics['rotation_total'] += elapsed
+
+    @property
+    def next_log_ready(self):
+        """`False` if `prepare_next_log` has something to do."""
+        return (self._current_log is None or
+                self._next_log is not None and not self._retired and
+                not self._unsynced)
+
+    def prepare_next_log(self):
+        """
+        Create the log following the current one (without registering
+        it in the logindex, so the readers ignore it) and close the
+        handles left by the last rotation.
+
+        Meant to be called while the writer is idle. Returns `True` if
+        a log was created.
+
+        """
+        for log in self._retired:
+            log.close()
+        self._retired = []
+        self._sync_rotation()
+
+        if self._next_log is not None or self._current_log is None:
+            return False
+
+        idx = self._current_idx + 1
+        name = LOG_PREFIX + '.' + str(idx)
+        log = self._open_log(name, create=True)
+        if not self._check_format(name, log):  # pragma: no cover
+            log.close()
+            return False
+
+        # Replaced by the time of the swap once it is the current log.
+        self.logmeta.put(created_key(name.encode('utf-8')),
+                         dump_created(time.time()))
+        self.logmeta.sync()
+
+        self._next_log = (idx, name, log)
+        return True
+
+    def _sync_rotation(self):
+        """Store the creation time of the last swapped log and sync."""
+        if not self._unsynced:
+            return
+
+        name = LOG_PREFIX + '.' + str(self._current_idx)
+        self.logmeta.put(created_key(name.encode('utf-8')),
+                         dump_created(self._log_created))
+        self.logmeta.sync()
+        self.logindex.sync()
+        self._unsynced = False
 
-        self.next_will_create_log = (idx >= self.max_log_events)
+    def _swap_log(self):
+        """
+        Make the prepared log the current one. Returns `False` (and
+        drops it) if the logindex moved meanwhile.
+
+        """
+        idx, name, log = self._next_log
+        self._next_log = None
+
+        cursor = self.logindex.cursor()
+        last = cursor.last()
+        cursor.close()
+        if last is None or last[0] != self._current_idx or idx != last[0] + 1:
+            log.close()
+            return False
+
+        self.logindex.append(name)
+
+        self._retired.append(self._current_log)
+        self._current_log = log
+        self._current_idx = idx
+        self._full_idx = None
+        self._log_bytes = 0
+        self._log_last = 0
+        self._log_created = time.time()
+        self._unsynced = True
+        return True
+
+    def _begin(self):
+        """Return the transaction for the next write (if any)."""
+        return None
+
+    def _commit(self, txn):
+        if txn is not None:
+            txn.commit()
+
+    def _abort(self, txn):
+        if txn is not None:
+            txn.abort()
+
+    def append(self, data):
+        """
+        Append data to the current log DB.
+
+        Returns the `(liidx, clidx)` position assigned to `data`
+        (`(liidx, clidx, 1)` for a packed writer: `data` is written
+        alone, in a block of its own).
+
+        """
+        if self.log_format == FORMAT_PACKED or self.codec is not None:
+            return self._append_many([data])[0]
+
+        self._prepare_log()
+
+        txn = self._begin()
+        try:
+            idx = self._current_log.append(data, txn)
+        except:
+            self._abort(txn)
+            raise
+        else:
+            self._commit(txn)
+
+        position = (self._current_idx, idx)
+        self._committed([position], len(data))
+        return position
+
+    def _committed(self, positions, size):
+        """
+        Update the state of the current log after committing the rows
+        of `positions` (`size` bytes) and publish them.
+
+        """
+        self._log_bytes += size
+        self._log_last = positions[-1][1]
+        self._store_log_bytes()
+        self.next_will_create_log = self._is_full(self._log_last)
+        self._written(positions[-1], len(positions))
+
+    def _append_many(self, iterable, positions=None):
+        """
+        Write every item of `iterable` and return the list of assigned
+        positions.
+
+        The positions are appended to the list `positions` (if given)
+        as their log DB is committed, so on error it holds the ones
+        which were written.
+
+        """
+        if positions is None:
+            positions = []
+        pending = []
+        size = 0
+        txn = None
+        try:
+            for data, count in self._rows(iterable):
+                if pending and self._is_full(pending[-1][1],
+                                             self._log_bytes + size):
+                    # One transaction per log DB. The log cannot be
+                    # rotated while the transaction is open.
+                    prev, txn = txn, None
+                    self._commit(prev)
+                    positions.extend(pending)
+                    self._committed(pending, size)
+                    pending, size = [], 0
+
+                if not pending:
+                    self._prepare_log()
+                    txn = self._begin()
+
+                idx = self._current_log.append(data, txn)
+                size += len(data)
+                if count is None:
+                    pending.append((self._current_idx, idx))
+                else:
+                    pending.extend((self._current_idx, idx, subidx)
+                                   for subidx in range(1, count + 1))
+
+            if pending:
+                prev, txn = txn, None
+                self._commit(prev)
+                positions.extend(pending)
+                self._committed(pending, size)
+        except:
+            self._abort(txn)
+            raise
+
+        return positions
+
+    def _rows(self, iterable):
+        """
+        Return an iterator of the `(row, messages)` to write for the
+        items of `iterable` (`messages` is `None` for the unpacked rows).
+
+        """
+        if self.log_format == FORMAT_PACKED:
+            rows = ((pack(values), len(values))
+                    for values in split(iterable, self.block_size))
+        else:
+            rows = ((data, None) for data in iterable)
+
+        if self.codec is None:
+            return rows
+        else:
+            compress = self.codec.compress
+            return ((compress(row), count) for row, count in rows)
+
+    def append_many(self, iterable):
+        """
+        Append all the items of `iterable` to the log DBs.
+
+        The items are written in one transaction per log DB, so a batch
+        crossing a rotation boundary is committed in two (or more)
+        steps. If an error is raised only the items of the log DB being
+        written are rolled back.
+
+        Returns a tuple with the first and the last `(liidx, clidx)`
+        positions assigned, or `None` if `iterable` was empty.
+
+        """
+        positions = self._append_many(iterable)
+        if not positions:
+            return None
+        else:
+            return (positions[0], positions[-1])
+
+    def _written(self, position, count):
+        """Update the durability state after `count` records were written."""
+        self.head.publish(*position[:2])
+        if self.notifier is not None:
+            self.notifier.notify()
+
+        self.written = position
+        if self.durability == DURABILITY_SYNC:
+            self.durable = position
+        elif self.durability == DURABILITY_GROUP:
+            self.group.add(count)
+            if self.group.due():
+                self.flush()
+
+    def _flush(self):
+        raise NotImplementedError("Must be implemented in subclass.")
+
+    def flush(self):
+        """
+        Force the written data to disk.
+
+        Returns the highest durable position.
+
+        """
+        self._sync_rotation()
+        if self.written is not None and self.durable != self.written:
+            self._flush()
+            self.durable = self.written
+        self.group.reset()
+        return self.durable
+
+    def flush_if_due(self):
+        """
+        Flush the data if the group commit interval has expired.
+
+        Writers in `group` mode should call this periodically when they
+        are idle to bound the loss window.
+
+        """
+        if self.group.due():
+            self.flush()
+        return self.durable
+
+    def close(self):
+        """Flush the pending data and close the DB handles."""
+        self.flush()
+        self.head.close()
+        if self.notifier is not None:
+            self.notifier.close()
+        if self._current_log is not None:
+            self._current_log.close()
+            self._current_log = None
+        if self._next_log is not None:
+            _, _, log = self._next_log
+            log.close()
+            self._next_log = None
+        for log in self._retired:
+            log.close()
+        self._retired = []
+        self.logmeta.close()
+        self.logindex.close()
+        self.env.close()
 
     def _delete(self, idx):
         raise NotImplementedError("Must be implemented in subclass.")
@@ -106,6 +651,30 @@ class Writer:
 
 
 class TDSWriter(TDSBinlog, Writer):
+    open_flags = db.DB_AUTO_COMMIT
+
+    durabilities = (DURABILITY_SYNC, DURABILITY_WRITE_NOSYNC,
+                    DURABILITY_NOSYNC, DURABILITY_GROUP)
+    default_durability = DURABILITY_SYNC
+
+    commit_flags = {
+        DURABILITY_SYNC: 0,
+        DURABILITY_WRITE_NOSYNC: db.DB_TXN_WRITE_NOSYNC,
+        DURABILITY_NOSYNC: db.DB_TXN_NOSYNC,
+        DURABILITY_GROUP: db.DB_TXN_NOSYNC}
+
+    def _begin(self):
+        """Begin a new transaction."""
+        return self.env.txn_begin()
+
+    def _commit(self, txn):
+        if txn is not None:
+            txn.commit(self.commit_flags[self.durability])
+
+    def _flush(self):
+        """Flush the transaction log to disk."""
+        self.env.log_flush()
+
     def _delete(self, idx):
         """Delete the log DB using a transaction."""
         txn = self.env.txn_begin(flags=db.DB_TXN_NOWAIT)
@@ -121,5 +690,15 @@ class TDSWriter(TDSBinlog, Writer):
 
 
 class CDSWriter(CDSBinlog, Writer):
+    durabilities = (DURABILITY_NOSYNC, DURABILITY_GROUP)
+    default_durability = DURABILITY_NOSYNC
+
+    def _flush(self):
+        """Flush the current (and the just rotated) log DBs to disk."""
+        for log in self._retired:
+            log.sync()
+        if self._current_log is not None:
+            self._current_log.sync()
+
     def _delete(self, idx):
         raise RuntimeError("CDSWriter can't delete databases safely.")
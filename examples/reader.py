@@ -2,7 +2,6 @@ from itertools import cycle
 import atexit
 import os
 import signal
-import time
 
 from binlog.reader import TDSReader
 
@@ -18,16 +17,16 @@ def save_status():
     r.save()
 
     
-atexit.register(save_status)
+atexit.register(r.close)
+atexit.register(save_status)  # Runs before closing the reader.
 
 for i in cycle(range(1, 20001)):
     if i == 20000:  # Make a checkpoint each 20k reads.
         save_status()
 
-    n = r.next_record()  # Read the next log entry.
+    # Read the next log entry, waiting up to one second for the writer.
+    n = r.next_record(timeout=1)
 
-    if n is None:
-        time.sleep(1)
-    else:
+    if n is not None:
         print('.', end='', flush=True)
         r.ack(n)  # Acknowledge the reception of the entry.
@@ -12,7 +12,8 @@ setup(name='binlog',
       description="Store/Recover python objects sequencially.",
       long_description=README + '\n\n' + CHANGELOG,
       classifiers=[
-          'Programming Language :: Python :: 3.4',
+          'Programming Language :: Python :: 3.5',
+          'Programming Language :: Python :: 3 :: Only',
           'Development Status :: 4 - Beta',
           'Topic :: Database',
           'License :: OSI Approved :: GNU Lesser General Public License v3 (LGPLv3)'
@@ -25,10 +26,13 @@ setup(name='binlog',
       packages=find_packages(exclude=["tests", "docs"]),
       include_package_data=True,
       zip_safe=False,
+      python_requires='>=3.5.2',
       install_requires=[
           'bsddb3==6.1.0',
           'acidfile==1.2.1'
       ],
       entry_points={
-          'console_scripts': ['binlog=binlog.__main__:main']
+          'console_scripts': [
+              'binlog=binlog.__main__:main',
+              'binlog-retention=binlog.retention:main']
       })
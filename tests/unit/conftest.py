@@ -1,3 +1,4 @@
+import asyncio
 import contextlib
 import os
 import shutil
@@ -20,6 +21,15 @@ RW_IMPL = [
     (reader.CDSReader, writer.CDSWriter)]
 
 
+def run(coro):
+    """Run `coro` until complete in a new event loop."""
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+
 @pytest.yield_fixture(autouse=True)
 def server_factory():
 
@@ -0,0 +1,240 @@
+from tempfile import mktemp
+import asyncio
+import shutil
+import threading
+
+import pytest
+
+from binlog import aio
+from binlog.reader import TDSReader, CDSReader
+from binlog.writer import TDSWriter, CDSWriter
+
+from conftest import run
+
+AIO_IMPL = [
+    (aio.TDSAsyncReader, TDSWriter),
+    (aio.CDSAsyncReader, CDSWriter)]
+
+AIO_WRITER_IMPL = [
+    (TDSReader, aio.TDSAsyncWriter),
+    (CDSReader, aio.CDSAsyncWriter)]
+
+
+@pytest.mark.parametrize("rcls,wcls", AIO_IMPL)
+def test_AsyncReader_next_record(rcls, wcls):
+    try:
+        tmpdir = mktemp()
+        w = wcls(tmpdir)
+        w.append_many([b'1', b'2', b'3'])
+
+        async def consume():
+            async with rcls(tmpdir, read_ahead=2) as r:
+                values = []
+                record = await r.next_record()
+                while record is not None:
+                    values.append(record.value)
+                    record = await r.next_record()
+                return values
+
+        assert run(consume()) == [b'1', b'2', b'3']
+    except:
+        raise
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+@pytest.mark.parametrize("rcls,wcls", AIO_IMPL)
+def test_AsyncReader_next_record_timeout(rcls, wcls):
+    try:
+        tmpdir = mktemp()
+        w = wcls(tmpdir)
+        w.append(b'1')
+
+        async def consume():
+            async with rcls(tmpdir) as r:
+                assert (await r.next_record(timeout=0.1)).value == b'1'
+                return await r.next_record(timeout=0.1)
+
+        assert run(consume()) is None
+    except:
+        raise
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+@pytest.mark.parametrize("rcls,wcls", AIO_IMPL)
+def test_AsyncReader_async_for_wakes_up_on_append(rcls, wcls):
+    try:
+        tmpdir = mktemp()
+        w = wcls(tmpdir)
+        w.append(b'1')
+
+        async def consume():
+            loop = asyncio.get_event_loop()
+            values = []
+            async with rcls(tmpdir, poll_interval=10) as r:
+                async for record in r:
+                    values.append(record.value)
+                    if len(values) == 1:
+                        loop.call_later(0.1, w.append, b'2')
+                    else:
+                        break
+            return values
+
+        assert run(asyncio.wait_for(consume(), 5)) == [b'1', b'2']
+    except:
+        raise
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+@pytest.mark.parametrize("rcls,wcls", AIO_IMPL)
+def test_AsyncReader_ack_and_save(rcls, wcls):
+    try:
+        tmpdir = mktemp()
+        w = wcls(tmpdir)
+        w.append_many([b'1', b'2', b'3'])
+
+        async def consume():
+            async with rcls(tmpdir, checkpoint='async') as r:
+                records = [await r.next_record(), await r.next_record()]
+                await r.ack_many(records)
+                assert await r.save()
+
+            async with rcls(tmpdir, checkpoint='async') as r:
+                return await r.next_record()
+
+        assert run(consume()).value == b'3'
+    except:
+        raise
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+@pytest.mark.parametrize("rcls,wcls", AIO_IMPL)
+def test_AsyncReader_opens_the_reader_in_the_executor(rcls, wcls):
+    """The reader is not opened by the event loop thread."""
+    try:
+        tmpdir = mktemp()
+        wcls(tmpdir).append(b'1')
+        threads = []
+
+        class Reader(rcls.reader_class):
+            def __init__(self, *args, **kwargs):
+                threads.append(threading.get_ident())
+                super().__init__(*args, **kwargs)
+
+        class AsyncReader(rcls):
+            reader_class = Reader
+
+        async def consume():
+            r = AsyncReader(tmpdir)
+            assert r.reader is None
+            record = await r.next_record()
+            await r.close()
+            return record
+
+        assert run(consume()).value == b'1'
+        assert len(threads) == 1
+        assert threads[0] != threading.get_ident()
+    except:
+        raise
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+@pytest.mark.parametrize("rcls,wcls", AIO_IMPL)
+def test_AsyncReader_default_executor(rcls, wcls):
+    """The readers share an executor unless one is given."""
+    executor = aio.default_executor()
+    assert rcls('a').executor is executor
+    assert rcls('b').executor is executor
+    assert rcls('c', executor=None).executor is executor
+
+
+@pytest.mark.parametrize("rcls,wcls", AIO_WRITER_IMPL)
+def test_AsyncWriter_append(rcls, wcls):
+    try:
+        tmpdir = mktemp()
+
+        async def produce():
+            async with wcls(tmpdir, max_queue=10, max_batch=4) as w:
+                return await asyncio.gather(
+                    *[w.append(str(i).encode()) for i in range(25)])
+
+        positions = run(produce())
+        assert positions == [(1, i) for i in range(1, 26)]
+
+        r = rcls(tmpdir)
+        values = [rec.value for rec in iter(r.next_record, None)]
+        assert values == [str(i).encode() for i in range(25)]
+    except:
+        raise
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+@pytest.mark.parametrize("rcls,wcls", AIO_WRITER_IMPL)
+def test_AsyncWriter_append_rotates_logs(rcls, wcls):
+    try:
+        tmpdir = mktemp()
+
+        async def produce():
+            async with wcls(tmpdir, max_log_events=3) as w:
+                return await asyncio.gather(
+                    *[w.append(b'x') for i in range(7)])
+
+        assert run(produce()) == [(1, 1), (1, 2), (1, 3),
+                                  (2, 1), (2, 2), (2, 3),
+                                  (3, 1)]
+    except:
+        raise
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+@pytest.mark.parametrize("rcls,wcls", AIO_WRITER_IMPL)
+def test_AsyncWriter_append_nowait_queue_full(rcls, wcls):
+    try:
+        tmpdir = mktemp()
+
+        async def produce():
+            async with wcls(tmpdir, max_queue=1) as w:
+                first = w.append_nowait(b'1')
+                with pytest.raises(asyncio.QueueFull):
+                    w.append_nowait(b'2')
+                return await first
+
+        assert run(produce()) == (1, 1)
+    except:
+        raise
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+@pytest.mark.parametrize("rcls,wcls", AIO_WRITER_IMPL)
+def test_AsyncWriter_failed_batch(rcls, wcls):
+    """
+    The messages committed before an error get their positions, the
+    others the exception, and the writer goes on.
+    """
+    try:
+        tmpdir = mktemp()
+
+        async def produce():
+            async with wcls(tmpdir, max_log_events=2) as w:
+                futures = [w.append_nowait(data)
+                           for data in (b'1', b'2', object())]
+                results = await asyncio.gather(*futures,
+                                               return_exceptions=True)
+                results.append(await w.append(b'3'))
+                return results
+
+        first, second, error, last = run(produce())
+        assert (first, second) == ((1, 1), (1, 2))
+        assert isinstance(error, Exception)
+        assert last == (2, 1)
+    except:
+        raise
+    finally:
+        shutil.rmtree(tmpdir)
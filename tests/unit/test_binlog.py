@@ -162,3 +162,20 @@ def test_Binlog_open_logindex_but_is_dir(cls):
         raise
     finally:
         shutil.rmtree(tmpdir)
+
+
+#
+# Record
+#
+def test_Record_has_three_fields():
+    """The records of the unpacked logs unpack as before."""
+    liidx, clidx, value = binlog.Record(1, 2, b'data')
+    assert binlog.Record(1, 2, b'data') == (1, 2, b'data')
+    assert binlog.Record(1, 2, b'data').subidx is None
+
+
+def test_SubRecord_is_a_Record():
+    """The messages of the packed blocks are records with a position."""
+    record = binlog.SubRecord(1, 2, b'data', 3, 4)
+    assert isinstance(record, binlog.Record)
+    assert (record.subidx, record.subcount) == (3, 4)
@@ -0,0 +1,82 @@
+from hypothesis import given
+from hypothesis import strategies as st
+import pytest
+
+from binlog import block
+
+
+@given(values=st.lists(st.binary(), min_size=1))
+def test_block_roundtrip(values):
+    """A block returns its messages in order."""
+    data = block.pack(values)
+    assert block.unpack(data) == values
+
+
+def test_block_layout():
+    assert block.pack([b'ab', b'', b'c']) == (
+        b'\x03\x00\x00\x00'
+        b'\x02\x00\x00\x00\x02\x00\x00\x00\x03\x00\x00\x00'
+        b'abc')
+
+
+@given(values=st.lists(st.binary(max_size=20)),
+       size=st.integers(min_value=1, max_value=50))
+def test_block_split(values, size):
+    """The blocks keep the order and do not exceed the size."""
+    blocks = list(block.split(iter(values), size))
+    assert [value for values in blocks for value in values] == values
+    for values in blocks:
+        assert values
+        assert len(values) == 1 or sum(map(len, values)) <= size
+
+
+def test_block_meta():
+    assert block.dump_meta(block.FORMAT_RAW) is None
+    assert block.load_meta(None) == (block.FORMAT_RAW, None)
+    meta = block.dump_meta(block.FORMAT_PACKED)
+    assert block.load_meta(meta) == (block.FORMAT_PACKED, None)
+
+
+@pytest.mark.parametrize("codec", [block.CODEC_ZLIB, block.CODEC_LZMA])
+def test_Codec_roundtrip(codec):
+    data = b'{"event": "click", "user": 1234}' * 10
+    c = block.Codec(codec)
+    compressed = c.compress(data)
+    assert len(compressed) < len(data)
+    assert c.decompress(compressed) == data
+
+
+def test_Codec_zdict():
+    """A preset dictionary shrinks the small rows."""
+    zdict = b'{"event": "click", "user": }'
+    data = b'{"event": "click", "user": 1234}'
+    c = block.Codec(block.CODEC_ZLIB, zdict)
+    compressed = c.compress(data)
+    assert len(compressed) < len(block.Codec(block.CODEC_ZLIB).compress(data))
+    assert c.decompress(compressed) == data
+
+    with pytest.raises(ValueError):
+        block.Codec(block.CODEC_LZMA, zdict)
+    with pytest.raises(ValueError):
+        block.Codec(block.CODEC_NONE)
+
+
+def test_meta_codec():
+    fmt, codec = block.load_meta(block.dump_meta(block.FORMAT_RAW))
+    assert (fmt, codec) == (block.FORMAT_RAW, None)
+
+    meta = block.dump_meta(block.FORMAT_PACKED,
+                           block.Codec(block.CODEC_ZLIB, b'dict'))
+    fmt, codec = block.load_meta(meta)
+    assert fmt == block.FORMAT_PACKED
+    assert (codec.codec, codec.zdict) == (block.CODEC_ZLIB, b'dict')
+
+
+def test_created():
+    assert block.created_key(b'events.1') == b'events.1/created'
+    assert block.load_created(block.dump_created(1234.5)) == 1234.5
+
+
+def test_bytes():
+    assert block.bytes_key(b'events.1') == b'events.1/bytes'
+    assert block.load_bytes(block.dump_bytes(2 ** 40)) == 2 ** 40
@@ -0,0 +1,164 @@
+import pickle
+
+from hypothesis import given
+from hypothesis import strategies as st
+import pytest
+
+from binlog import checkpoint
+from binlog.binlog import Record
+from binlog.register import Register
+
+
+def test_checkpoint_exists():
+    """The checkpoint module has the dump and load functions."""
+    assert hasattr(checkpoint, 'dump')
+    assert hasattr(checkpoint, 'load')
+
+
+@given(acks=st.lists(st.tuples(st.integers(min_value=1, max_value=10),
+                               st.integers(min_value=-2**40,
+                                           max_value=2**40))),
+       low=st.integers(min_value=0, max_value=10))
+def test_checkpoint_roundtrip(acks, low):
+    """A register is restored with the same acknowledgements."""
+    r = Register()
+    for liidx, clidx in acks:
+        r.add(Record(liidx=liidx, clidx=clidx, value=None))
+    r.low = low
+
+    data = checkpoint.dumps(r)
+    assert data.startswith(checkpoint.MAGIC)
+
+    restored = checkpoint.loads(data)
+    assert restored.reg == r.reg
+    assert restored.low == r.low
+
+
+def test_checkpoint_loads_pickled_registers():
+    """The checkpoints written by older versions (pickle) are loaded."""
+    r = Register({1: [(1, 20), (30, 30)], 2: [(2, 2)]})
+
+    restored = checkpoint.loads(pickle.dumps(r))
+    assert restored.reg == r.reg
+    assert restored.low == 0
+
+
+def test_checkpoint_partial_blocks():
+    """The partially acknowledged blocks are kept (version 2)."""
+    r = Register()
+    r.add_range(1, 1, 5)
+    assert checkpoint.loads(checkpoint.dumps(r)).partial == {}
+    assert checkpoint.dumps(r)[4] == checkpoint.VERSION
+
+    for subidx in (1, 3, 10):
+        r.add_sub(2, 7, subidx, 10)
+    r.add_sub(2, 9, 2, 3)
+
+    data = checkpoint.dumps(r)
+    assert data[4] == checkpoint.VERSION_PARTIAL
+
+    restored = checkpoint.loads(data)
+    assert restored.reg == r.reg
+    assert restored.partial == {(2, 7): (10, 0b1000000101),
+                                (2, 9): (3, 0b10)}
+
+
+def test_checkpoint_partial_blocks_are_indexed():
+    """The acks drop the partial blocks of a restored register."""
+    r = Register()
+    r.add_sub(1, 5, 1, 3)
+    r.add_sub(1, 9, 1, 3)
+
+    for restored in (checkpoint.loads(checkpoint.dumps(r)),
+                     pickle.loads(pickle.dumps(r))):
+        restored.add_range(1, 1, 6)
+        assert restored.partial == {(1, 9): (3, 1)}
+        restored.add_sub(1, 9, 2, 3)
+        restored.add_sub(1, 9, 3, 3)
+        assert restored.partial == {}
+        assert restored.reg == {1: [(1, 6), (9, 9)]}
+
+
+def test_checkpoint_unknown_version():
+    data = checkpoint.HEADER.pack(checkpoint.MAGIC, 255, 0, 0)
+    with pytest.raises(ValueError):
+        checkpoint.loads(data)
+
+
+#
+# Journal
+#
+def test_Journal_replay(tmpdir):
+    """The journal entries are applied in order to a register."""
+    journal = checkpoint.Journal(str(tmpdir.join('reader1.journal')))
+    assert journal.replay(Register()) == 0
+
+    assert journal.append([(1, 1, 5), (1, 7, 7)]) == 2
+    assert journal.append([(1, 6, 6), (2, 1, 1)]) == 2
+
+    r = Register()
+    assert journal.replay(r) == 4
+    assert r.reg == {1: [(1, 7)], 2: [(1, 1)]}
+
+    journal.clear()
+    assert journal.replay(Register()) == 0
+
+
+def test_Journal_ignores_incomplete_entries(tmpdir):
+    """An interrupted write does not break the replay."""
+    path = str(tmpdir.join('reader1.journal'))
+    journal = checkpoint.Journal(path)
+    journal.append([(1, 1, 5)])
+    with open(path, 'ab') as f:
+        f.write(checkpoint.ENTRY.pack(checkpoint.ENTRY_RANGE, 1, 6, 9)[:10])
+
+    r = Register()
+    assert journal.replay(r) == 1
+    assert r.reg == {1: [(1, 5)]}
+
+
+def test_Journal_replay_messages(tmpdir):
+    """The acknowledged messages of the packed blocks are replayed."""
+    journal = checkpoint.Journal(str(tmpdir.join('reader1.journal')))
+    assert journal.append([(1, 1, 5), (1, 6, 1, 2), (1, 7, 2, 1000)]) == 3
+    assert journal.append([(1, 6, 2, 2)]) == 1
+
+    r = Register()
+    assert journal.replay(r) == 4
+    assert r.reg == {1: [(1, 6)]}
+    assert r.partial == {(1, 7): (1000, 2)}
+
+
+#
+# Checkpoint
+#
+def test_Checkpoint_save_uses_the_journal(tmpdir):
+    """A snapshot is written first and every `journal_limit` entries."""
+    path = str(tmpdir.join('reader1'))
+    cp = checkpoint.Checkpoint(path, journal_limit=2)
+    assert cp.load() is None
+
+    r = Register()
+    for clidx in (1, 3, 5, 7):
+        r.add_range(1, clidx, clidx)
+        cp.ack_range(1, clidx, clidx)
+        assert cp.save(r, lambda register: None)
+        assert cp.pending == []
+
+    # Snapshot, two journal entries and a new snapshot.
+    assert checkpoint.Checkpoint(path).journal.replay(Register()) == 0
+    loaded = checkpoint.Checkpoint(path).load()
+    assert loaded.reg == {1: [(1, 1), (3, 3), (5, 5), (7, 7)]}
+
+
+def test_Checkpoint_pending_acknowledgements(tmpdir):
+    """The adjacent ranges are merged and a completed block replaces
+    the entries of its messages."""
+    cp = checkpoint.Checkpoint(str(tmpdir.join('reader1')))
+    cp.ack_range(1, 1, 2)
+    cp.ack_range(1, 3, 3)
+    cp.ack_sub(1, 4, 1, 2)
+    cp.ack_block(1, 4)
+    cp.ack_sub(1, 6, 1, 2)
+    cp.ack_range(2, 1, 1)
+    assert cp.pending == [(1, 1, 4), (1, 6, 1, 2), (2, 1, 1)]
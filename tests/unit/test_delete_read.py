@@ -52,3 +52,63 @@ def test_reader_starts_with_the_lowest_database_available_instantiate_before_del
         raise
     finally:
         shutil.rmtree(tmpdir)
+
+
+def test_reader_resumes_from_the_first_unacknowledged_log():
+    """
+    A reader loaded from a checkpoint starts directly at the first log
+    with unacknowledged records, jumping over the deleted logs.
+    """
+    from binlog.reader import TDSReader
+    from binlog.writer import TDSWriter
+
+    try:
+        tmpdir = mktemp()
+
+        writer = TDSWriter(tmpdir, max_log_events=10)
+        for x in range(100):
+            writer.append(str(x).encode("ascii"))
+
+        reader = TDSReader(tmpdir, checkpoint='test')
+        for x in range(55):
+            reader.ack(reader.next_record())
+        reader.save()
+        del reader
+
+        for idx in range(1, 6):
+            writer.delete(idx)
+
+        reader = TDSReader(tmpdir, checkpoint='test')
+        assert reader.register.liidx == 6
+
+        for x in range(55, 100):
+            rec = reader.next_record()
+            assert int(rec.value) == x
+        assert reader.next_record() is None
+    except:
+        raise
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def test_reader_jumps_over_deleted_logs_in_the_middle():
+    from binlog.reader import TDSReader
+    from binlog.writer import TDSWriter
+
+    try:
+        tmpdir = mktemp()
+
+        writer = TDSWriter(tmpdir, max_log_events=10)
+        for x in range(100):
+            writer.append(str(x).encode("ascii"))
+
+        for idx in range(2, 9):
+            writer.delete(idx)
+
+        reader = TDSReader(tmpdir)
+        values = [int(rec.value) for rec in iter(reader.next_record, None)]
+        assert values == list(range(10)) + list(range(80, 100))
+    except:
+        raise
+    finally:
+        shutil.rmtree(tmpdir)
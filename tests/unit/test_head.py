@@ -0,0 +1,43 @@
+from binlog import head
+
+
+def test_Head_open_missing(tmpdir):
+    """Head.open returns None when no writer published anything."""
+    assert head.Head.open(str(tmpdir)) is None
+
+
+def test_Head_publish_and_read(tmpdir):
+    """The readers see the positions published by the writer."""
+    w = head.Head(str(tmpdir), create=True)
+    r = head.Head.open(str(tmpdir))
+
+    assert r.read() == (0, 0, 0)
+
+    w.publish(1, 1)
+    seq1, liidx, clidx = r.read()
+    assert (liidx, clidx) == (1, 1)
+
+    w.publish(1, 2)
+    seq2, liidx, clidx = r.read()
+    assert (liidx, clidx) == (1, 2)
+    assert seq2 > seq1
+    assert seq1 % 2 == seq2 % 2 == 0
+
+    w.close()
+    r.close()
+
+
+def test_Head_read_update_in_progress(tmpdir):
+    """An odd sequence (update in progress) is never returned."""
+    w = head.Head(str(tmpdir), create=True)
+    head.SEQUENCE.pack_into(w.map, 0, 3)
+
+    r = head.Head.open(str(tmpdir))
+    assert r.read(retries=3) is None
+
+    # A new writer recovers from the interrupted update.
+    w.publish(2, 5)
+    assert r.read() == (6, 2, 5)
+
+    w.close()
+    r.close()
@@ -0,0 +1,137 @@
+from tempfile import mktemp
+import asyncio
+import shutil
+
+import pytest
+
+from binlog import aio
+from binlog.hub import Hub, Subscription
+from binlog.writer import TDSWriter, CDSWriter
+
+from conftest import run
+
+HUB_IMPL = [
+    (aio.TDSAsyncReader, TDSWriter),
+    (aio.CDSAsyncReader, CDSWriter)]
+
+
+def test_Subscription_invalid_name(tmpdir):
+    for name in ('', '../reader', '.hidden'):
+        with pytest.raises(ValueError):
+            Subscription(str(tmpdir), name, None)
+
+
+@pytest.mark.parametrize("rcls,wcls", HUB_IMPL)
+def test_Hub_fan_out(rcls, wcls):
+    try:
+        tmpdir = mktemp()
+        w = wcls(tmpdir, max_log_events=2)
+        w.append_many([b'1', b'2', b'3'])
+
+        async def subscribe():
+            hub = Hub(tmpdir, reader_class=rcls)
+            first, second = [], []
+            await hub.subscribe('first', first.append)
+            await hub.subscribe('second', second.append)
+
+            w.append(b'4')
+            for _ in range(50):
+                if len(first) == len(second) == 4:
+                    break
+                await asyncio.sleep(0.1)
+
+            await hub.close()
+            return first, second
+
+        first, second = run(subscribe())
+        assert [r.value for r in first] == [b'1', b'2', b'3', b'4']
+        assert [r.value for r in second] == [b'1', b'2', b'3', b'4']
+    except:
+        raise
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+@pytest.mark.parametrize("rcls,wcls", HUB_IMPL)
+def test_Hub_resumes_from_checkpoint(rcls, wcls):
+    try:
+        tmpdir = mktemp()
+        w = wcls(tmpdir)
+        w.append_many([b'1', b'2', b'3'])
+
+        async def subscribe(ack):
+            hub = Hub(tmpdir, reader_class=rcls)
+            records = []
+            subscription = await hub.subscribe('reader', records.append)
+            for _ in range(50):
+                if len(records) == ack:
+                    break
+                await asyncio.sleep(0.1)
+
+            subscription.ack_range(1, 1, ack)
+            await hub.save(subscription)
+            await hub.close()
+            return [r.value for r in records]
+
+        assert run(subscribe(2)) == [b'1', b'2', b'3']
+        assert run(subscribe(1)) == [b'3']
+    except:
+        raise
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+@pytest.mark.parametrize("rcls,wcls", HUB_IMPL)
+def test_Hub_subscribe_twice(rcls, wcls):
+    try:
+        tmpdir = mktemp()
+        w = wcls(tmpdir)
+        w.append(b'1')
+
+        async def subscribe():
+            hub = Hub(tmpdir, reader_class=rcls)
+            await hub.subscribe('reader', lambda record: None)
+            try:
+                with pytest.raises(ValueError):
+                    await hub.subscribe('reader', lambda record: None)
+            finally:
+                await hub.close()
+
+        run(subscribe())
+    except:
+        raise
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+@pytest.mark.parametrize("rcls,wcls", HUB_IMPL)
+def test_Hub_packed_messages(rcls, wcls):
+    try:
+        tmpdir = mktemp()
+        w = wcls(tmpdir, packed=True)
+        w.append_many([b'1', b'2', b'3'])
+
+        async def subscribe(acks):
+            hub = Hub(tmpdir, reader_class=rcls)
+            records = []
+            subscription = await hub.subscribe('reader', records.append)
+            for _ in range(50):
+                if records:
+                    break
+                await asyncio.sleep(0.1)
+            await asyncio.sleep(0.2)
+
+            for record in records:
+                if record.value in acks:
+                    subscription.ack_sub(record.liidx, record.clidx,
+                                         record.subidx, record.subcount)
+            await hub.save(subscription)
+            await hub.close()
+            return [r.value for r in records]
+
+        assert run(subscribe([b'1', b'3'])) == [b'1', b'2', b'3']
+        assert run(subscribe([])) == [b'2']
+    except:
+        raise
+    finally:
+        shutil.rmtree(tmpdir)
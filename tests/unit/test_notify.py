@@ -0,0 +1,89 @@
+from unittest.mock import patch
+import itertools
+import os
+import time
+
+from binlog import notify
+from binlog.constants import NOTIFY_DIR
+
+
+def test_Notifier_without_listeners(tmpdir):
+    """Notify is a no-op when nobody is listening."""
+    n = notify.Notifier(str(tmpdir))
+    assert n.targets() == []
+    n.notify()
+    n.close()
+
+
+def test_Listener_wait_timeout(tmpdir):
+    """wait returns False when nothing was notified."""
+    l = notify.Listener(str(tmpdir))
+    try:
+        start = time.monotonic()
+        assert not l.wait(0.1)
+        assert time.monotonic() - start >= 0.1
+    finally:
+        l.close()
+
+
+def test_Notifier_wakes_up_listeners(tmpdir):
+    """All the listeners receive the notification."""
+    listeners = [notify.Listener(str(tmpdir)) for _ in range(3)]
+    n = notify.Notifier(str(tmpdir))
+    try:
+        n.notify()
+        for l in listeners:
+            assert l.wait(1)
+            assert not l.wait(0)
+    finally:
+        n.close()
+        for l in listeners:
+            l.close()
+
+
+def test_Notifier_removes_stale_sockets(tmpdir):
+    """The sockets of the dead readers are removed."""
+    l = notify.Listener(str(tmpdir))
+    l.sock.close()  # Closed but not unlinked.
+
+    n = notify.Notifier(str(tmpdir))
+    n.notify()
+    n.close()
+
+    assert os.listdir(str(tmpdir.join(NOTIFY_DIR))) == []
+
+
+def test_Listener_replaces_stale_sockets(tmpdir):
+    """A socket left by a dead reader with the same pid is reused."""
+    with patch.object(notify.Listener, '_ids', itertools.count()):
+        stale = notify.Listener(str(tmpdir))
+    stale.sock.close()  # Closed but not unlinked.
+
+    with patch.object(notify.Listener, '_ids', itertools.count()):
+        l = notify.Listener(str(tmpdir))
+    n = notify.Notifier(str(tmpdir))
+    try:
+        assert l.name == stale.name
+        n.notify()
+        assert l.wait(1)
+    finally:
+        n.close()
+        l.close()
+
+
+def test_Listener_skips_sockets_in_use(tmpdir):
+    """A name bound by a live reader is not taken over."""
+    with patch.object(notify.Listener, '_ids', itertools.count()):
+        first = notify.Listener(str(tmpdir))
+    with patch.object(notify.Listener, '_ids', itertools.count()):
+        second = notify.Listener(str(tmpdir))
+    n = notify.Notifier(str(tmpdir))
+    try:
+        assert first.name != second.name
+        n.notify()
+        assert first.wait(1)
+        assert second.wait(1)
+    finally:
+        n.close()
+        first.close()
+        second.close()
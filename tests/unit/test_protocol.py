@@ -0,0 +1,98 @@
+from binlog import protocol
+
+
+def test_pack():
+    assert protocol.pack(protocol.APPEND, b'TEST') == \
+        b'\x00\x00\x00\x04\x01TEST'
+
+
+def test_FrameReader_feed():
+    frames = [(protocol.APPEND, b'1'),
+              (protocol.APPEND, b''),
+              (protocol.APPEND, b'x' * 1000)]
+    stream = b''.join(protocol.pack(*frame) for frame in frames)
+
+    reader = protocol.FrameReader()
+    assert reader.feed(stream) == frames
+    assert len(reader) == 0
+
+
+def test_FrameReader_feed_partial_frames():
+    frames = [(protocol.APPEND, b'first'), (protocol.APPEND, b'second')]
+    stream = b''.join(protocol.pack(*frame) for frame in frames)
+
+    reader = protocol.FrameReader()
+    received = []
+    for i in range(len(stream)):
+        received.extend(reader.feed(stream[i:i + 1]))
+    assert received == frames
+    assert len(reader) == 0
+
+    assert reader.feed(stream[:3]) == []
+    assert len(reader) == 3
+
+
+def test_result_and_error_frames():
+    reader = protocol.FrameReader()
+    stream = protocol.result(3, (2, 10)) + protocol.error(1, 'Oops')
+    (rkind, rpayload), (ekind, epayload) = reader.feed(stream)
+
+    assert rkind == protocol.RESULT
+    assert protocol.parse_result(rpayload) == (3, (2, 10))
+    assert ekind == protocol.ERROR
+    assert protocol.parse_error(epayload) == (1, 'Oops')
+
+
+def test_result_frame_of_packed_messages():
+    frame = protocol.result(3, (2, 10, 7))
+    _, payload = protocol.FrameReader().feed(frame)[0]
+    assert protocol.parse_result(payload) == (3, (2, 10, 7))
+
+
+def test_subscription_frames():
+    reader = protocol.FrameReader()
+    stream = (protocol.subscribe('reader') +
+              protocol.record(1, 2, b'TEST') +
+              protocol.ack(1, 1, 2))
+    (skind, spayload), (rkind, rpayload), (akind, apayload) = \
+        reader.feed(stream)
+
+    assert skind == protocol.SUBSCRIBE
+    assert spayload.decode('utf-8') == 'reader'
+    assert rkind == protocol.RECORD
+    assert protocol.parse_record(rpayload) == (1, 2, b'TEST')
+    assert akind == protocol.ACK
+    assert protocol.parse_ack(apayload) == (1, 1, 2)
+
+
+def test_packed_subscription_frames():
+    reader = protocol.FrameReader()
+    stream = (protocol.subrecord(1, 2, 3, 4, b'TEST') +
+              protocol.suback(1, 2, 3, 4))
+    (rkind, rpayload), (akind, apayload) = reader.feed(stream)
+
+    assert rkind == protocol.SUBRECORD
+    assert protocol.parse_subrecord(rpayload) == (1, 2, 3, 4, b'TEST')
+    assert akind == protocol.SUBACK
+    assert protocol.parse_suback(apayload) == (1, 2, 3, 4)
+
+
+def test_FrameReader_max_size():
+    frames = [(protocol.APPEND, b'small'),
+              (protocol.APPEND, b'x' * 100),
+              (protocol.APPEND, b'last')]
+    stream = b''.join(protocol.pack(*frame) for frame in frames)
+    expected = [(protocol.APPEND, b'small'),
+                (protocol.APPEND, None),
+                (protocol.APPEND, b'last')]
+
+    reader = protocol.FrameReader(max_size=10)
+    assert reader.feed(stream) == expected
+
+    reader = protocol.FrameReader(max_size=10)
+    received = []
+    for i in range(0, len(stream), 7):
+        received.extend(reader.feed(stream[i:i + 7]))
+        assert len(reader) <= protocol.HEADER.size + 10
+    assert received == expected
+    assert len(reader) == 0
@@ -1,4 +1,5 @@
 from tempfile import mktemp
+from unittest.mock import patch
 import shutil
 
 from hypothesis import given
@@ -196,6 +197,42 @@ def test_Reader_new_Reader_starts_over(rcls, wcls):
         shutil.rmtree(tmpdir)
 
 
+#
+# Reader(persistent=True)
+#
+@pytest.mark.parametrize("rcls,wcls", RW_IMPL)
+@pytest.mark.parametrize("max_log_events", [1, 3, 100])
+def test_Reader_persistent_cursors(rcls, wcls, max_log_events):
+    """
+    A reader with persistent cursors returns the same entries as the
+    default one, including the ones written after reaching the end.
+    """
+    try:
+        tmpdir = mktemp()
+
+        w = wcls(tmpdir, max_log_events=max_log_events)
+        for i in range(10):
+            w.append(str(i).encode("ascii"))
+
+        r = rcls(tmpdir, persistent=True)
+        for i in range(10):
+            rec = r.next_record()
+            assert i == int(rec.value)
+            r.ack(rec)
+        assert r.next_record() is None
+
+        for i in range(10, 20):
+            w.append(str(i).encode("ascii"))
+
+        for i in range(10, 20):
+            assert i == int(r.next())
+        assert r.next() is None
+    except:
+        raise
+    finally:
+        shutil.rmtree(tmpdir)
+
+
 #
 # Reader().save
 #
@@ -337,6 +374,132 @@ def test_Reader_can_save_and_restore_its_process_non_lineal(rcls, wcls, max_log_
     finally:
         shutil.rmtree(tmpdir)
 
+#
+# Reader().next_records
+#
+def test_Reader_next_records():
+    """The Reader has the next_records method."""
+    assert hasattr(reader.Reader, 'next_records')
+
+
+@pytest.mark.parametrize("rcls,wcls", RW_IMPL)
+@pytest.mark.parametrize("persistent", [True, False])
+def test_Reader_next_records_one_log_per_batch(rcls, wcls, persistent):
+    """next_records returns contiguous runs from one log at a time."""
+    try:
+        tmpdir = mktemp()
+
+        w = wcls(tmpdir, max_log_events=10)
+        for i in range(25):
+            w.append(str(i).encode("ascii"))
+
+        r = rcls(tmpdir, persistent=persistent)
+
+        batch = r.next_records(100)
+        assert [int(rec.value) for rec in batch] == list(range(10))
+        assert [(rec.liidx, rec.clidx) for rec in batch] == [
+            (1, i) for i in range(1, 11)]
+
+        batch = r.next_records(4)
+        assert [int(rec.value) for rec in batch] == list(range(10, 14))
+
+        batch = r.next_records(100)
+        assert [int(rec.value) for rec in batch] == list(range(14, 20))
+
+        batch = r.next_records(100)
+        assert [int(rec.value) for rec in batch] == list(range(20, 25))
+
+        assert r.next_records(100) == []
+
+        w.append(b"25")
+        assert [rec.value for rec in r.next_records(100)] == [b"25"]
+    except:
+        raise
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+@pytest.mark.parametrize("rcls,wcls", RW_IMPL)
+def test_Reader_next_records_max_bytes(rcls, wcls):
+    """next_records stops when the values reach `max_bytes`."""
+    try:
+        tmpdir = mktemp()
+
+        w = wcls(tmpdir)
+        for i in range(10):
+            w.append(b"0123456789")
+
+        r = rcls(tmpdir)
+        assert len(r.next_records(100, max_bytes=1)) == 1
+        assert len(r.next_records(100, max_bytes=25)) == 3
+        assert len(r.next_records(100, max_bytes=1000)) == 6
+    except:
+        raise
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+@pytest.mark.parametrize("rcls,wcls", RW_IMPL)
+def test_Reader_next_records_skips_acknowledged(rcls, wcls):
+    """next_records does not return records already in the register."""
+    try:
+        tmpdir = mktemp()
+
+        w = wcls(tmpdir)
+        for i in range(20):
+            w.append(str(i).encode("ascii"))
+
+        r = rcls(tmpdir, checkpoint='reader1')
+        for rec in iter(r.next_record, None):
+            if int(rec.value) % 2 == 0:
+                r.ack(rec)
+        r.save()
+
+        r = rcls(tmpdir, checkpoint='reader1')
+        batch = r.next_records(100)
+        assert [int(rec.value) for rec in batch] == list(range(1, 20, 2))
+    except:
+        raise
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+@pytest.mark.parametrize("rcls,wcls", RW_IMPL)
+@pytest.mark.parametrize("journal_limit", [0, 3, 1000])
+def test_Reader_save_uses_journal(rcls, wcls, journal_limit):
+    """
+    save() journals the acknowledgements and load() replays the journal
+    over the last snapshot.
+    """
+    import os
+
+    try:
+        tmpdir = mktemp()
+
+        w = wcls(tmpdir, max_log_events=4)
+        for i in range(20):
+            w.append(str(i).encode("ascii"))
+
+        r = rcls(tmpdir, checkpoint='reader1', journal_limit=journal_limit)
+        for i in range(12):
+            rec = r.next_record()
+            if i != 5:
+                r.ack(rec)
+            r.save()
+
+        if journal_limit > 12:
+            assert os.path.getsize(r.journal.path) > 0
+
+        r = rcls(tmpdir, checkpoint='reader1', journal_limit=journal_limit)
+        for i in [5] + list(range(12, 20)):
+            assert int(r.next_record().value) == i
+        assert r.next_record() is None
+    except:
+        raise
+    finally:
+        shutil.rmtree(tmpdir)
+
+
 #
 # Reader().load
 #
@@ -365,6 +528,38 @@ def test_Reader_load_raises_if_no_checkpoint(rcls, wcls):
         shutil.rmtree(tmpdir)
 
 
+@pytest.mark.parametrize("rcls,wcls", RW_IMPL)
+def test_Reader_load_pickled_checkpoint(rcls, wcls):
+    """The checkpoints written by older versions are still loaded."""
+    import os
+    import pickle
+
+    from acidfile import ACIDFile
+    from binlog.constants import CHECKPOINT_DIR
+    from binlog.register import Register
+
+    try:
+        tmpdir = mktemp()
+
+        w = wcls(tmpdir)
+        for i in range(10):
+            w.append(str(i).encode("ascii"))
+
+        path = os.path.join(tmpdir, CHECKPOINT_DIR, 'reader1')
+        os.makedirs(path)
+        with ACIDFile(path, mode='wb') as cp:
+            pickle.dump(Register({1: [(1, 5)]}), cp)
+
+        r = rcls(tmpdir, checkpoint='reader1')
+        for i in range(5, 10):
+            assert int(r.next_record().value) == i
+        assert r.next_record() is None
+    except:
+        raise
+    finally:
+        shutil.rmtree(tmpdir)
+
+
 #
 # Reader().next_record
 #
@@ -402,6 +597,59 @@ def test_Reader_next_record(rcls, wcls, max_log_events):
         shutil.rmtree(tmpdir)
 
 
+#
+# Reader().next_record(timeout=...)
+#
+@pytest.mark.parametrize("rcls,wcls", RW_IMPL)
+def test_Reader_next_record_timeout_without_data(rcls, wcls):
+    """next_record returns None when the timeout expires."""
+    import time
+
+    try:
+        tmpdir = mktemp()
+
+        w = wcls(tmpdir)
+        r = rcls(tmpdir)
+
+        start = time.monotonic()
+        assert r.next_record(timeout=0.2) is None
+        assert time.monotonic() - start >= 0.2
+    except:
+        raise
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+@pytest.mark.parametrize("rcls,wcls", RW_IMPL)
+def test_Reader_next_record_timeout_woken_up_by_writer(rcls, wcls):
+    """next_record returns as soon as the writer appends new data."""
+    import threading
+    import time
+
+    try:
+        tmpdir = mktemp()
+
+        w = wcls(tmpdir)
+        w.append(b"0")
+
+        r = rcls(tmpdir)
+        assert r.next_record(timeout=1).value == b"0"
+
+        timer = threading.Timer(0.2, w.append, args=(b"1", ))
+        timer.start()
+
+        start = time.monotonic()
+        assert r.next_record(timeout=10).value == b"1"
+        assert time.monotonic() - start < 5
+        timer.join()
+
+        r.close()
+    except:
+        raise
+    finally:
+        shutil.rmtree(tmpdir)
+
+
 #
 # Reader().ack
 #
@@ -474,6 +722,166 @@ def test_Reader_ack_adds_to_register(rcls, wcls, max_log_events):
         shutil.rmtree(tmpdir)
 
 
+#
+# Reader().ack_many & Reader().ack_range
+#
+@pytest.mark.parametrize("rcls,wcls", RW_IMPL)
+def test_Reader_ack_many(rcls, wcls):
+    """ack_many acknowledges all the records of a batch."""
+    try:
+        tmpdir = mktemp()
+
+        w = wcls(tmpdir, max_log_events=10)
+        for i in range(25):
+            w.append(str(i).encode("ascii"))
+
+        r = rcls(tmpdir)
+        records = []
+        for rec in iter(r.next_record, None):
+            if int(rec.value) % 3:
+                records.append(rec)
+        r.ack_many(reversed(records))
+
+        for rec in records:
+            assert rec in r.register
+        assert r.register.reg[1] == [(2, 3), (5, 6), (8, 9)]
+    except:
+        raise
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+@pytest.mark.parametrize("rcls,wcls", RW_IMPL)
+def test_Reader_ack_range(rcls, wcls):
+    """ack_range acknowledges a range of records of one log."""
+    try:
+        tmpdir = mktemp()
+
+        w = wcls(tmpdir)
+        for i in range(10):
+            w.append(str(i).encode("ascii"))
+
+        r = rcls(tmpdir, checkpoint='reader1')
+        r.ack_range(1, 1, 5)
+        r.save()
+
+        r = rcls(tmpdir, checkpoint='reader1')
+        for i in range(5, 10):
+            assert int(r.next_record().value) == i
+        assert r.next_record() is None
+    except:
+        raise
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+#
+# Reader().compact
+#
+@pytest.mark.parametrize("rcls,wcls", RW_IMPL)
+def test_Reader_save_compacts_the_register(rcls, wcls):
+    """
+    The checkpoint only keeps the logs which are not fully acknowledged.
+    """
+    try:
+        tmpdir = mktemp()
+
+        w = wcls(tmpdir, max_log_events=10)
+        for i in range(35):
+            w.append(str(i).encode("ascii"))
+
+        r = rcls(tmpdir, checkpoint='reader1')
+        for i in range(25):
+            rec = r.next_record()
+            if i != 22:
+                r.ack(rec)
+        r.save()
+
+        assert r.register.low == 3
+        assert r.register.reg == {3: [(1, 2), (4, 5)]}
+
+        r = rcls(tmpdir, checkpoint='reader1')
+        for i in [22] + list(range(25, 35)):
+            assert int(r.next_record().value) == i
+        assert r.next_record() is None
+    except:
+        raise
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def test_TDSReader_compact_drops_deleted_logs():
+    """The deleted logs are dropped from the register."""
+    try:
+        tmpdir = mktemp()
+
+        w = writer.TDSWriter(tmpdir, max_log_events=10)
+        for i in range(35):
+            w.append(str(i).encode("ascii"))
+
+        r = reader.TDSReader(tmpdir)
+        r.ack_range(2, 5, 6)
+        w.delete(2)
+        r.compact()
+
+        assert r.register.reg == {}
+        assert r.register.low == 1
+    except:
+        raise
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def test_TDSReader_first_available_skips_deleted_logs():
+    """The logs deleted in the middle of the (RECNO) logindex."""
+    try:
+        tmpdir = mktemp()
+
+        w = writer.TDSWriter(tmpdir, max_log_events=10)
+        for i in range(45):
+            w.append(str(i).encode("ascii"))
+        w.delete(2)
+        w.delete(3)
+
+        r = reader.TDSReader(tmpdir)
+        assert r.first_available(1) == 1
+        assert r.first_available(2) == 4
+        assert r.first_available(3) == 4
+        assert r.first_available(5) == 5
+        assert r.first_available(6) is None
+    except:
+        raise
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def test_TDSReader_goes_on_after_deleted_logs_in_the_middle():
+    """A reader jumps over a gap of the (RECNO) logindex."""
+    try:
+        tmpdir = mktemp()
+
+        w = writer.TDSWriter(tmpdir, max_log_events=10)
+        for i in range(45):
+            w.append(str(i).encode("ascii"))
+
+        r = reader.TDSReader(tmpdir, checkpoint='test')
+        for i in range(5):
+            r.ack(r.next_record())
+        r.save()
+        r.close()
+
+        w.delete(2)
+        w.delete(3)
+
+        r = reader.TDSReader(tmpdir, checkpoint='test')
+        values = [int(r.next_record().value) for _ in range(10)]
+        assert values == [5, 6, 7, 8, 9, 30, 31, 32, 33, 34]
+    except:
+        raise
+    finally:
+        shutil.rmtree(tmpdir)
+
+
 #
 # Reader().has_next_log
 #
@@ -674,3 +1082,124 @@ def test_environment_but_no_databases_and_after_read_is_fine_multiple_retry(rcls
         raise
     finally:
         shutil.rmtree(tmpdir)
+
+
+@pytest.mark.parametrize("rcls,wcls", RW_IMPL)
+def test_idle_reader_sees_new_appends(rcls, wcls):
+    try:
+        tmpdir = mktemp()
+        w = wcls(tmpdir)
+        w.append(b'1')
+
+        r = rcls(tmpdir)
+        assert r.next_record().value == b'1'
+        assert r.next_record() is None
+        assert r._idle is not None
+
+        # Nothing was published, the reader stays idle.
+        assert r.next_record() is None
+
+        w.append(b'2')
+        assert r.next_record().value == b'2'
+        assert r._idle is None
+    except:
+        raise
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+#
+# Packed logs
+#
+@pytest.mark.parametrize("rcls,wcls", RW_IMPL)
+def test_Reader_packed_records(rcls, wcls):
+    """The messages of the blocks are returned one by one."""
+    try:
+        tmpdir = mktemp()
+        w = wcls(tmpdir, packed=True, block_size=3)
+        w.append_many([b'1', b'2', b'3', b'4'])
+        w.append(b'5')
+
+        r = rcls(tmpdir)
+        records = list(iter(r.next_record, None))
+        assert [r.value for r in records] == [b'1', b'2', b'3', b'4', b'5']
+        assert [(r.liidx, r.clidx, r.subidx, r.subcount)
+                for r in records] == [(1, 1, 1, 3), (1, 1, 2, 3),
+                                      (1, 1, 3, 3), (1, 2, 1, 1),
+                                      (1, 3, 1, 1)]
+    except:
+        raise
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+@pytest.mark.parametrize("rcls,wcls", RW_IMPL)
+def test_Reader_packed_partial_acks(rcls, wcls):
+    """The acknowledged messages of a block are not read again."""
+    try:
+        tmpdir = mktemp()
+        w = wcls(tmpdir, packed=True)
+        w.append_many([b'1', b'2', b'3'])
+        w.append_many([b'4', b'5'])
+
+        r = rcls(tmpdir, checkpoint='reader1')
+        records = r.next_records(10)
+        assert [r.value for r in records] == [b'1', b'2', b'3', b'4', b'5']
+        r.ack_many(records[0:3:2] + records[3:4])
+        assert r.register.reg == {}
+        assert r.save()
+        r.close()
+
+        r = rcls(tmpdir, checkpoint='reader1')
+        records = list(iter(r.next_record, None))
+        assert [r.value for r in records] == [b'2', b'5']
+        r.ack_many(records)
+        assert r.register.reg == {1: [(1, 2)]}
+        assert r.register.partial == {}
+    except:
+        raise
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+@pytest.mark.parametrize("rcls,wcls", RW_IMPL)
+@pytest.mark.parametrize("packed", [False, True])
+@pytest.mark.parametrize("compression", ["zlib", "lzma"])
+def test_Reader_compressed_records(rcls, wcls, packed, compression):
+    """The compressed rows are decompressed transparently."""
+    try:
+        tmpdir = mktemp()
+        w = wcls(tmpdir, packed=packed, compression=compression)
+        values = [('{"event": %d}' % i).encode('ascii') for i in range(5)]
+        w.append_many(values[:3])
+        for value in values[3:]:
+            w.append(value)
+
+        r = rcls(tmpdir)
+        assert [r.value for r in r.next_records(2)] == values[:2]
+        assert [r.value for r in iter(r.next_record, None)] == values[2:]
+    except:
+        raise
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+@pytest.mark.parametrize("rcls,wcls", RW_IMPL)
+def test_Reader_block_cache(rcls, wcls):
+    """The rows read again are not decoded twice."""
+    try:
+        tmpdir = mktemp()
+        w = wcls(tmpdir, packed=True, compression='zlib', block_size=2)
+        w.append_many([b'1', b'2', b'3', b'4'])
+
+        r = rcls(tmpdir, block_cache=1)
+        assert r.next_record().value == b'1'
+        with patch.object(r._codec, 'decompress') as decompress:
+            r.seek(1)
+            assert r.next_record().value == b'1'
+            assert not decompress.called
+    except:
+        raise
+    finally:
+        shutil.rmtree(tmpdir)
+
@@ -5,7 +5,7 @@ from hypothesis import strategies as st
 import pytest
 
 from binlog import register
-from binlog.binlog import Record
+from binlog.binlog import Record, SubRecord
 
 
 #
@@ -218,6 +218,119 @@ def test_Register_reg_is_always_sorted(clidx):
         assert sorted(r.reg[1]) == r.reg[1]
 
 
+#
+# Register().add_range
+#
+def test_Register_add_range():
+    """The Register has the add_range method."""
+    assert hasattr(register.Register, 'add_range')
+
+
+def test_Register_add_range_first_greater_than_last():
+    """The range must not be empty."""
+    r = register.Register()
+    with pytest.raises(ValueError):
+        r.add_range(1, 10, 9)
+
+
+def test_Register_add_range_merges_neighbors():
+    """
+    The added range is merged with the overlapping and adjacent
+    intervals. Ex::
+
+    Register.reg[1] = [(1, 3), (5, 5), (8, 9), (20, 30)]
+
+    Register.add_range(1, 4, 7)
+    Register.reg[1] = [(1, 9), (20, 30)]
+
+    """
+    r = register.Register({1: [(1, 3), (5, 5), (8, 9), (20, 30)]})
+    r.add_range(1, 4, 7)
+
+    assert r.reg[1] == [(1, 9), (20, 30)]
+
+    r.add_range(1, 12, 15)
+    assert r.reg[1] == [(1, 9), (12, 15), (20, 30)]
+
+    r.add_range(1, 25, 40)
+    assert r.reg[1] == [(1, 9), (12, 15), (20, 40)]
+
+    r.add_range(2, 1, 1)
+    assert r.reg[2] == [(1, 1)]
+
+
+@given(ranges=st.lists(st.tuples(st.integers(min_value=-100,
+                                             max_value=100),
+                                 st.integers(min_value=0, max_value=10))))
+def test_Register_add_range_same_as_add(ranges):
+    """add_range is equivalent to add every record of the range."""
+    r1 = register.Register()
+    r2 = register.Register()
+    for first, length in ranges:
+        r1.add_range(1, first, first + length)
+        for clidx in range(first, first + length + 1):
+            r2.add(Record(liidx=1, clidx=clidx, value=None))
+
+    assert r1.reg == r2.reg
+
+
+#
+# Register().compact
+#
+def test_Register_compact():
+    """The Register has the compact method."""
+    assert hasattr(register.Register, 'compact')
+
+
+def test_Register_compact_collapses_finished_logs():
+    """
+    The fully acknowledged logs are removed from `reg` and collapsed
+    into `low`. The log being written (the last one) is never collapsed.
+    """
+    lasts = {1: 10, 2: 10, 3: 10}
+    r = register.Register({1: [(1, 10)],
+                           2: [(1, 10)],
+                           3: [(1, 5), (7, 10)],
+                           4: [(1, 3)]})
+    r.compact([1, 2, 3, 4], lasts.get)
+
+    assert r.low == 3
+    assert r.reg == {3: [(1, 5), (7, 10)], 4: [(1, 3)]}
+
+    r.add(Record(liidx=3, clidx=6, value=None))
+    r.add_range(4, 4, 10)
+    r.compact([1, 2, 3, 4], lasts.get)
+
+    assert r.low == 4
+    assert r.reg == {4: [(1, 10)]}
+
+
+def test_Register_compact_drops_deleted_logs():
+    """The logs not available anymore are dropped."""
+    lasts = {4: 10, 5: 0, 6: 10}
+    r = register.Register({1: [(1, 3)],
+                           2: [(5, 10)],
+                           4: [(1, 10)],
+                           6: [(2, 10)]})
+    r.compact([4, 5, 6, 7], lasts.get)
+
+    assert r.low == 6
+    assert r.reg == {6: [(2, 10)]}
+
+
+def test_Register_compact_keeps_semantics():
+    """The collapsed logs are still reported as acknowledged."""
+    r = register.Register({1: [(1, 10)], 2: [(1, 10)]})
+    r.compact([1, 2, 3], {1: 10, 2: 10}.get)
+
+    assert r.reg == {}
+    assert Record(liidx=1, clidx=5, value=None) in r
+    assert Record(liidx=3, clidx=1, value=None) not in r
+
+    rec = r.next()
+    assert (rec.liidx, rec.clidx) == (3, 1)
+
+
 #
 # Register().next_li
 #
@@ -277,6 +390,113 @@ def test_Register_reset_do_reset():
     assert r.clidx == 0
 
 
+#
+# Register().seek
+#
+def test_Register_seek():
+    """seek moves the register to the beginning of a log."""
+    r = register.Register({5: [(1, 3)]})
+    r.next()
+    r.seek(5)
+
+    rec = r.next()
+    assert (rec.liidx, rec.clidx) == (5, 4)
+
+
+def test_Register_seek_not_below_low():
+    """seek never moves below the low-watermark."""
+    r = register.Register()
+    r.low = 3
+    r.seek(1)
+
+    rec = r.next()
+    assert (rec.liidx, rec.clidx) == (3, 1)
+
+
+def test_Register_seek_record():
+    """seek can move before any record of a log."""
+    r = register.Register({2: [(5, 6)]})
+    r.seek(2, 4)
+    assert (r.next().liidx, r.current.clidx) == (2, 4)
+    assert r.next().clidx == 7
+
+    r.low = 3
+    r.seek(2, 4)
+    assert (r.next().liidx, r.current.clidx) == (3, 1)
+
+
+#
+# Register().add_sub
+#
+@given(order=st.permutations(list(range(1, 11))))
+def test_Register_add_sub(order):
+    """A block is acknowledged once all its messages are."""
+    r = register.Register()
+    for subidx in order[:-1]:
+        r.add(SubRecord(liidx=1, clidx=3, value=None, subidx=subidx,
+                        subcount=10))
+        assert SubRecord(1, 3, None, subidx, 10) in r
+    assert SubRecord(1, 3, None, order[-1], 10) not in r
+    assert Record(1, 3, None) not in r
+    assert r.reg == {}
+
+    r.add(SubRecord(liidx=1, clidx=3, value=None, subidx=order[-1],
+                    subcount=10))
+    assert r.reg == {1: [(3, 3)]}
+    assert r.partial == {}
+    assert Record(1, 3, None) in r
+
+
+def test_Register_add_sub_invalid():
+    r = register.Register()
+    with pytest.raises(ValueError):
+        r.add_sub(1, 1, 0, 5)
+    with pytest.raises(ValueError):
+        r.add_sub(1, 1, 6, 5)
+
+
+def test_Register_add_range_drops_partial_blocks():
+    """Acknowledging a whole block forgets its messages."""
+    r = register.Register()
+    r.add_sub(1, 2, 1, 3)
+    r.add_sub(1, 5, 1, 3)
+    r.add_range(1, 1, 4)
+    assert r.partial == {(1, 5): (3, 1)}
+
+    r.add_sub(1, 3, 2, 3)
+    assert r.partial == {(1, 5): (3, 1)}
+
+
+def test_Register_add_range_drops_only_the_covered_blocks():
+    r = register.Register()
+    for clidx in range(1, 1001):
+        r.add_sub(1, clidx, 1, 2)
+        r.add_sub(2, clidx, 1, 2)
+    r.add_range(1, 100, 899)
+    assert sorted(r.partial) == ([(1, c) for c in range(1, 100)] +
+                                 [(1, c) for c in range(900, 1001)] +
+                                 [(2, c) for c in range(1, 1001)])
+
+
+def test_Register_compact_drops_partial_blocks():
+    r = register.Register()
+    r.add_sub(1, 2, 1, 3)
+    r.add_sub(3, 2, 1, 3)
+    r.add_sub(4, 2, 1, 3)
+    r.compact([2, 4, 5], lambda liidx: 10)
+    assert r.partial == {(4, 2): (3, 1)}
+
+
+def test_Register_next_returns_partial_blocks():
+    """The blocks with messages not acknowledged are read again."""
+    r = register.Register()
+    r.add_sub(1, 1, 1, 2)
+    r.add_sub(1, 2, 1, 2)
+    r.add_sub(1, 2, 2, 2)
+    assert r.next().clidx == 1
+    assert r.next().clidx == 3
+
+
 #
 # Register().next
 #
@@ -0,0 +1,254 @@
+from tempfile import mktemp
+from unittest.mock import patch
+import os
+import shutil
+import time
+
+from binlog import retention
+from binlog.reader import TDSReader
+from binlog.writer import TDSWriter
+
+MAX_LOG_EVENTS = 10
+
+
+def write(path, count, **kwargs):
+    w = TDSWriter(path, max_log_events=MAX_LOG_EVENTS, **kwargs)
+    for x in range(count):
+        w.append(str(x).encode('ascii'))
+    return w
+
+
+def consume(path, checkpoint, count):
+    r = TDSReader(path, checkpoint=checkpoint)
+    for _ in range(count):
+        r.ack(r.next_record())
+    r.save()
+    r.close()
+
+
+def indexes(path):
+    r = retention.Retention(path)
+    try:
+        return [idx for idx, _ in r.logs()]
+    finally:
+        r.close()
+
+
+def test_Retention_exists():
+    assert hasattr(retention, 'Retention')
+
+
+def test_Retention_without_checkpoints():
+    """Nothing is consumed if there are no checkpoints."""
+    try:
+        tmpdir = mktemp()
+        write(tmpdir, 35).close()
+
+        r = retention.Retention(tmpdir)
+        assert r.run() == []
+        r.close()
+        assert indexes(tmpdir) == [1, 2, 3, 4]
+    except:
+        raise
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def test_Retention_deletes_the_logs_consumed_by_all_checkpoints():
+    try:
+        tmpdir = mktemp()
+        write(tmpdir, 35).close()
+        consume(tmpdir, 'fast', 30)
+        consume(tmpdir, 'slow', 15)
+
+        r = retention.Retention(tmpdir)
+        assert r.checkpoints() == ['fast', 'slow']
+        assert r.run() == [1]
+        assert r.run() == []
+        r.close()
+
+        assert indexes(tmpdir) == [2, 3, 4]
+        assert not os.path.exists(os.path.join(tmpdir, 'events.1'))
+
+        # The slow reader goes on where it was.
+        reader = TDSReader(tmpdir, checkpoint='slow')
+        assert reader.next_record().value == b'15'
+        reader.close()
+    except:
+        raise
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def test_Retention_never_deletes_the_current_log():
+    try:
+        tmpdir = mktemp()
+        write(tmpdir, 25).close()
+        consume(tmpdir, 'test', 25)
+
+        r = retention.Retention(tmpdir)
+        assert r.run() == [1, 2]
+        r.close()
+        assert indexes(tmpdir) == [3]
+    except:
+        raise
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def test_Retention_with_an_unreadable_checkpoint():
+    """A checkpoint which cannot be read holds all the logs."""
+    try:
+        tmpdir = mktemp()
+        write(tmpdir, 25).close()
+        consume(tmpdir, 'good', 25)
+        for suffix in retention.ACIDFILE_SUFFIXES:
+            with open(os.path.join(tmpdir, 'checkpoints',
+                                   'bad' + suffix), 'wb') as f:
+                f.write(b'garbage')
+
+        r = retention.Retention(tmpdir)
+        assert r.run() == []
+        r.close()
+    except:
+        raise
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def test_Retention_does_not_write_the_checkpoints():
+    try:
+        tmpdir = mktemp()
+        write(tmpdir, 25).close()
+        consume(tmpdir, 'test', 15)
+
+        checkpoints = os.path.join(tmpdir, 'checkpoints')
+        before = {}
+        for name in os.listdir(checkpoints):
+            path = os.path.join(checkpoints, name)
+            if os.path.isfile(path):
+                with open(path, 'rb') as f:
+                    before[name] = f.read()
+
+        r = retention.Retention(tmpdir)
+        assert r.run() == [1]
+        r.close()
+
+        for name, data in before.items():
+            with open(os.path.join(checkpoints, name), 'rb') as f:
+                assert f.read() == data
+    except:
+        raise
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def test_Retention_max_bytes():
+    """The oldest logs are deleted, consumed or not, above `max_bytes`."""
+    try:
+        tmpdir = mktemp()
+        write(tmpdir, 35).close()
+
+        r = retention.Retention(tmpdir)
+        sizes = [r._size(name) for _, name in r.logs()]
+        r.max_bytes = sum(sizes[2:])
+        assert r.run() == [1, 2]
+
+        r.max_bytes = 0
+        assert r.run() == [3]
+        r.close()
+        assert indexes(tmpdir) == [4]
+    except:
+        raise
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def test_Retention_max_age():
+    """The logs finished more than `max_age` seconds ago are deleted."""
+    try:
+        tmpdir = mktemp()
+        now = time.time()
+        with patch('time.time', return_value=now - 100):
+            w = write(tmpdir, 15)
+        with patch('time.time', return_value=now):
+            for x in range(15):
+                w.append(b'x')
+        w.close()
+
+        r = retention.Retention(tmpdir, max_age=50)
+        assert r.run() == [1]
+        r.close()
+        assert indexes(tmpdir) == [2, 3]
+    except:
+        raise
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def test_Retention_gives_up_a_locked_batch():
+    """A batch with a log in use is not deleted and stops the run."""
+    try:
+        tmpdir = mktemp()
+        write(tmpdir, 45).close()
+        consume(tmpdir, 'test', 45)
+
+        locked = {3}
+
+        class Retention(retention.Retention):
+            def _delete(self, logs):
+                if locked.intersection(idx for idx, _ in logs):
+                    return False
+                return super()._delete(logs)
+
+        r = Retention(tmpdir, batch=2)
+        assert r.run() == [1, 2]
+        assert [idx for idx, _ in r.logs()] == [3, 4, 5]
+        assert os.path.exists(os.path.join(tmpdir, 'events.3'))
+
+        locked.clear()
+        assert r.run() == [3, 4]
+        r.close()
+    except:
+        raise
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def test_Retention_removes_the_entries_of_the_missing_files():
+    """The entries left by an interrupted deletion are removed."""
+    try:
+        tmpdir = mktemp()
+        write(tmpdir, 25).close()
+        consume(tmpdir, 'test', 25)
+        os.unlink(os.path.join(tmpdir, 'events.1'))
+
+        r = retention.Retention(tmpdir)
+        assert r.run() == [1, 2]
+        r.close()
+        assert indexes(tmpdir) == [3]
+    except:
+        raise
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def test_Retention_with_a_writer_on_the_environment():
+    """The writer goes on (and rotates) after the retention."""
+    try:
+        tmpdir = mktemp()
+        w = write(tmpdir, 25)
+        consume(tmpdir, 'test', 25)
+
+        r = retention.Retention(tmpdir)
+        assert r.run() == [1, 2]
+        r.close()
+
+        for x in range(10):
+            w.append(b'x')
+        w.close()
+        assert indexes(tmpdir) == [3, 4]
+    except:
+        raise
+    finally:
+        shutil.rmtree(tmpdir)
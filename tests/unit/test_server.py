@@ -1,4 +1,6 @@
 from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import Mock
+import asyncio
 import collections
 import os
 import pytest
@@ -10,6 +12,8 @@ from hypothesis import given
 
 from binlog.reader import TDSReader
 
+from conftest import run
+
 
 def test_Server():
     try:
@@ -49,10 +53,14 @@ def test_Server_protocol_store_in_binlog():
     with tempfile.TemporaryDirectory() as base:
         s = Server(base, "/tmp/server.sock")
 
-        p = s.get_protocol()()
-        p.connection_made(None)
-        p.data_received(b"TEST")
-        p.connection_lost(None)
+        async def connection():
+            p = s.get_protocol()()
+            p.connection_made(Mock())
+            p.data_received(b"TEST")
+            p.connection_lost(None)
+            await s.close()
+
+        run(connection())
 
         r = TDSReader(base)
         assert r.next_record().value == b"TEST"
@@ -66,9 +74,13 @@ def test_Server_protocol_not_store_in_binlog_when_no_data():
     with tempfile.TemporaryDirectory() as base:
         s = Server(base, "/tmp/server.sock")
 
-        p = s.get_protocol()()
-        p.connection_made(None)
-        p.connection_lost(None)
+        async def connection():
+            p = s.get_protocol()()
+            p.connection_made(Mock())
+            p.connection_lost(None)
+            await s.close()
+
+        run(connection())
 
         r = TDSReader(base)
         assert r.next_record() is None
@@ -82,15 +94,410 @@ def test_Server_protocol_not_store_in_binlog_when_data_is_empty():
     with tempfile.TemporaryDirectory() as base:
         s = Server(base, "/tmp/server.sock")
 
-        p = s.get_protocol()()
-        p.connection_made(None)
-        p.data_received(b"")
-        p.connection_lost(None)
+        async def connection():
+            p = s.get_protocol()()
+            p.connection_made(Mock())
+            p.data_received(b"")
+            p.connection_lost(None)
+            await s.close()
+
+        run(connection())
 
         r = TDSReader(base)
         assert r.next_record() is None
 
 
+def test_Server_pauses_reading_when_queue_is_full():
+    from binlog.server import Server
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as base:
+        s = Server(base, "/tmp/server.sock", max_queue=2)
+
+        async def connections():
+            transports = [Mock() for _ in range(4)]
+            protocols = [s.get_protocol()() for _ in transports]
+            for p, t in zip(protocols, transports):
+                p.connection_made(t)
+
+            for p in protocols[:2]:
+                p.data_received(b"TEST")
+                p.connection_lost(None)
+
+            assert s.paused
+            for t in transports[2:]:
+                t.pause_reading.assert_called_once_with()
+
+            # The writer thread drains the queue.
+            await asyncio.wait_for(s.close(), 5)
+            await asyncio.sleep(0)
+            assert not s.paused
+            for t in transports[2:]:
+                t.resume_reading.assert_called_once_with()
+
+        run(connections())
+
+        r = TDSReader(base)
+        assert [rec.value for rec in iter(r.next_record, None)] == \
+            [b"TEST", b"TEST"]
+
+
+def test_Server_framed_protocol_stores_every_frame():
+    from binlog.server import Server
+    from binlog.protocol import pack, APPEND
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as base:
+        s = Server(base, "/tmp/server.sock", framed=True)
+
+        async def connection():
+            p = s.get_protocol()()
+            p.connection_made(Mock())
+            stream = b"".join(pack(APPEND, d) for d in (b"1", b"2", b"3"))
+            p.data_received(stream[:4])
+            p.data_received(stream[4:])
+            p.connection_lost(None)
+            await s.close()
+
+        run(connection())
+
+        r = TDSReader(base)
+        assert [rec.value for rec in iter(r.next_record, None)] == \
+            [b"1", b"2", b"3"]
+
+
+def test_Server_framed_protocol_unknown_frame_closes():
+    from binlog.server import Server
+    from binlog.protocol import pack
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as base:
+        s = Server(base, "/tmp/server.sock", framed=True)
+
+        async def connection():
+            transport = Mock()
+            p = s.get_protocol()()
+            p.connection_made(transport)
+            p.data_received(pack(255, b"TEST"))
+            transport.close.assert_called_once_with()
+            p.connection_lost(None)
+            await s.close()
+
+        run(connection())
+
+
+def frames_written(transport):
+    from binlog.protocol import FrameReader
+
+    reader = FrameReader()
+    frames = []
+    for call in transport.write.call_args_list:
+        frames.extend(reader.feed(call[0][0]))
+    return frames
+
+
+def test_Server_ack_requires_framed():
+    from binlog.server import Server
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as base:
+        with pytest.raises(ValueError):
+            Server(base, "/tmp/server.sock", ack="message")
+        with pytest.raises(ValueError):
+            Server(base, "/tmp/server.sock", framed=True, ack="bogus")
+
+
+@pytest.mark.parametrize("durability", ["sync", "group"])
+def test_Server_ack_message(durability):
+    from binlog.server import Server
+    from binlog.protocol import pack, parse_result, APPEND, RESULT
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as base:
+        s = Server(base, "/tmp/server.sock", framed=True, ack="message",
+                   durability=durability)
+
+        async def connection():
+            transport = Mock()
+            transport.is_closing.return_value = False
+            p = s.get_protocol()()
+            p.connection_made(transport)
+            p.data_received(b"".join(pack(APPEND, d) for d in (b"1", b"2")))
+            p.data_received(pack(APPEND, b"3"))
+            await asyncio.sleep(0.5)
+            p.connection_lost(None)
+            await s.close()
+            return frames_written(transport)
+
+        frames = run(connection())
+        assert [kind for kind, _ in frames] == [RESULT] * 3
+        assert [parse_result(payload) for _, payload in frames] == \
+            [(1, (1, 1)), (1, (1, 2)), (1, (1, 3))]
+
+        assert s.binlog.durable == (1, 3)
+
+
+def test_Server_ack_batch():
+    from binlog.server import Server
+    from binlog.protocol import pack, parse_result, APPEND, RESULT
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as base:
+        s = Server(base, "/tmp/server.sock", framed=True, ack="batch")
+
+        async def connection():
+            transport = Mock()
+            transport.is_closing.return_value = False
+            p = s.get_protocol()()
+            p.connection_made(transport)
+            p.data_received(b"".join(pack(APPEND, d) for d in (b"1", b"2")))
+            p.data_received(pack(APPEND, b"3"))
+            p.connection_lost(None)
+            await s.close()
+            await asyncio.sleep(0.1)
+            return frames_written(transport)
+
+        frames = run(connection())
+        assert [kind for kind, _ in frames] == [RESULT] * 2
+        assert [parse_result(payload) for _, payload in frames] == \
+            [(2, (1, 2)), (1, (1, 3))]
+
+
+def test_Server_subscribe_and_ack():
+    from binlog.server import Server
+    from binlog.protocol import subscribe, ack, parse_record, RECORD
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as base:
+        s = Server(base, "/tmp/server.sock", framed=True)
+        s.binlog.append(b"1")
+        s.binlog.append(b"2")
+
+        async def connection(expected, acks):
+            transport = Mock()
+            transport.is_closing.return_value = False
+            p = s.get_protocol()()
+            p.connection_made(transport)
+            p.data_received(subscribe("reader"))
+            for _ in range(50):
+                if len(frames_written(transport)) == expected:
+                    break
+                await asyncio.sleep(0.1)
+            if acks:
+                p.data_received(ack(1, 1, acks))
+            p.connection_lost(None)
+            await asyncio.sleep(0.1)
+            return [parse_record(payload)
+                    for kind, payload in frames_written(transport)
+                    if kind == RECORD]
+
+        async def connections():
+            first = await connection(2, 1)
+            second = await connection(1, 0)
+            await s.close()
+            return first, second
+
+        first, second = run(connections())
+        assert first == [(1, 1, b"1"), (1, 2, b"2")]
+        assert second == [(1, 2, b"2")]
+
+
+def test_Server_packed_subscribe_and_suback():
+    from binlog.server import Server
+    from binlog.protocol import pack, subscribe, suback, parse_result
+    from binlog.protocol import parse_subrecord, APPEND, RESULT, SUBRECORD
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as base:
+        s = Server(base, "/tmp/server.sock", framed=True, ack="batch",
+                   packed=True)
+
+        async def connection(expected, acks):
+            transport = Mock()
+            transport.is_closing.return_value = False
+            p = s.get_protocol()()
+            p.connection_made(transport)
+            if acks is None:
+                p.data_received(b"".join(pack(APPEND, d)
+                                         for d in (b"1", b"2")))
+            p.data_received(subscribe("reader"))
+            for _ in range(50):
+                if len(frames_written(transport)) == expected:
+                    break
+                await asyncio.sleep(0.1)
+            for position in acks or []:
+                p.data_received(suback(*position))
+            p.connection_lost(None)
+            await asyncio.sleep(0.1)
+            return frames_written(transport)
+
+        async def connections():
+            first = await connection(3, None)
+            second = await connection(2, [(1, 1, 2, 2)])
+            third = await connection(1, [])
+            await s.close()
+            return first, second, third
+
+        first, second, third = run(connections())
+        assert first[0][0] == RESULT
+        assert parse_result(first[0][1]) == (2, (1, 1, 2))
+        assert [parse_subrecord(payload) for kind, payload in first
+                if kind == SUBRECORD] == [(1, 1, 1, 2, b"1"),
+                                          (1, 1, 2, 2, b"2")]
+        assert [parse_subrecord(payload) for _, payload in third] == \
+            [(1, 1, 1, 2, b"1")]
+
+
+def test_Server_rejects_large_messages():
+    from binlog.server import Server
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as base:
+        s = Server(base, "/tmp/server.sock", max_message_size=4)
+
+        async def connections():
+            small, large = Mock(), Mock()
+            p = s.get_protocol()()
+            p.connection_made(small)
+            p.data_received(b"TEST")
+            assert s.stats()['receiving'] == 4
+            p.connection_lost(None)
+
+            p = s.get_protocol()()
+            p.connection_made(large)
+            p.data_received(b"TES")
+            p.data_received(b"TS")
+            large.close.assert_called_once_with()
+            p.connection_lost(None)
+
+            await s.close()
+
+        run(connections())
+        stats = s.stats()
+        assert stats['rejected'] == 1
+        assert stats['buffered'] == 0
+        # b"TEST" (queued) and b"TES" (received).
+        assert stats['peak_buffered'] == 7
+
+        r = TDSReader(base)
+        assert [rec.value for rec in iter(r.next_record, None)] == [b"TEST"]
+
+
+def test_Server_framed_rejects_large_messages_in_order():
+    from binlog.server import Server
+    from binlog.protocol import pack, parse_result, parse_error
+    from binlog.protocol import APPEND, RESULT, ERROR
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as base:
+        s = Server(base, "/tmp/server.sock", framed=True, ack="message",
+                   max_message_size=4)
+
+        async def connection():
+            transport = Mock()
+            transport.is_closing.return_value = False
+            p = s.get_protocol()()
+            p.connection_made(transport)
+            p.data_received(b"".join(pack(APPEND, d)
+                                     for d in (b"1", b"TOO LARGE", b"2")))
+            await asyncio.sleep(0.5)
+            p.connection_lost(None)
+            await s.close()
+            return frames_written(transport)
+
+        frames = run(connection())
+        assert [kind for kind, _ in frames] == [RESULT, ERROR, RESULT]
+        assert parse_result(frames[0][1]) == (1, (1, 1))
+        assert parse_error(frames[1][1]) == (1, "Message too large")
+        assert parse_result(frames[2][1]) == (1, (1, 2))
+        assert s.stats()['rejected'] == 1
+
+
+def test_Server_pauses_reading_when_buffer_is_full():
+    from binlog.server import Server
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as base:
+        s = Server(base, "/tmp/server.sock", max_buffered=10)
+
+        async def connections():
+            transports = [Mock() for _ in range(3)]
+            protocols = [s.get_protocol()() for _ in transports]
+            for p, t in zip(protocols, transports):
+                p.connection_made(t)
+
+            protocols[0].data_received(b"x" * 6)
+            protocols[1].data_received(b"x" * 5)
+            assert s.paused
+            assert s.stats()['buffered'] == 11
+
+            # Nothing can be written until a message is complete, so
+            # the biggest one keeps reading.
+            transports[0].resume_reading.assert_called_once_with()
+            transports[1].resume_reading.assert_not_called()
+
+            protocols[0].connection_lost(None)
+            protocols[1].connection_lost(None)
+            await asyncio.wait_for(s.close(), 5)
+            await asyncio.sleep(0)
+            assert not s.paused
+            assert transports[2].resume_reading.called
+
+        run(connections())
+
+
+def test_Server_datagram_protocol():
+    from binlog.server import Server
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as base:
+        s = Server(base, None, max_message_size=4, max_queue=2)
+
+        async def datagrams():
+            p = s.get_datagram_protocol()()
+            for data in (b"1", b"TOO LARGE", b"2", b"3"):
+                p.datagram_received(data, None)
+            await s.close()
+
+        run(datagrams())
+        stats = s.stats()
+        assert stats['oversize_datagrams'] == 1
+        assert stats['dropped_datagrams'] == 1
+
+        r = TDSReader(base)
+        assert [rec.value for rec in iter(r.next_record, None)] == \
+            [b"1", b"2"]
+
+
+def test_Server_datagram_socket():
+    from binlog.server import Server
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as base:
+        path = os.path.join(base, "binlog.dgram")
+        s = Server(base, None, datagram_path=path)
+
+        async def datagrams():
+            loop = asyncio.get_event_loop()
+            transport, _ = await loop.create_datagram_endpoint(
+                s.get_datagram_protocol(), sock=s._datagram_socket())
+
+            client = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            for data in (b"1", b"2", b"3"):
+                client.sendto(data, path)
+            client.close()
+
+            await asyncio.sleep(0.5)
+            transport.close()
+            await s.close()
+
+        run(datagrams())
+
+        r = TDSReader(base)
+        assert [rec.value for rec in iter(r.next_record, None)] == \
+            [b"1", b"2", b"3"]
+
+
 @given(data=st.lists(st.binary(), min_size=1))
 def test_Server_concurrent_writes(server_factory, data):
 
@@ -256,6 +256,459 @@ def test_Writer_multiple_appends_creates_multiple_log(rcls, wcls):
     finally:
         shutil.rmtree(tmpdir)
 
+@pytest.mark.parametrize("rcls,wcls", RW_IMPL)
+def test_Writer_append_returns_position(rcls, wcls):
+    """append() returns the (liidx, clidx) assigned to the data."""
+    try:
+        tmpdir = mktemp()
+
+        w = wcls(tmpdir, max_log_events=2)
+        positions = [w.append(b"TEST DATA") for _ in range(5)]
+
+        assert positions == [(1, 1), (1, 2), (2, 1), (2, 2), (3, 1)]
+    except:
+        raise
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+#
+# Writer().append_many
+#
+def test_Writer_append_many():
+    """The Writer has the append_many method."""
+    assert hasattr(writer.Writer, 'append_many')
+
+
+@pytest.mark.parametrize("rcls,wcls", RW_IMPL)
+def test_Writer_append_many_empty(rcls, wcls):
+    """append_many() with an empty iterable returns None."""
+    try:
+        tmpdir = mktemp()
+
+        w = wcls(tmpdir)
+        assert w.append_many([]) is None
+    except:
+        raise
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+@pytest.mark.parametrize("rcls,wcls", RW_IMPL)
+@pytest.mark.parametrize("max_log_events", [3, 10, 100])
+def test_Writer_append_many_rotates_logs(rcls, wcls, max_log_events):
+    """
+    append_many() writes all the data in order, rotating the logs when
+    `max_log_events` is reached, and returns the assigned range.
+    """
+    try:
+        tmpdir = mktemp()
+
+        w = wcls(tmpdir, max_log_events=max_log_events)
+        w.append(b"0")
+        first, last = w.append_many(str(i).encode("ascii")
+                                    for i in range(1, 25))
+
+        assert first == (1, 2)
+        assert last == (24 // max_log_events + 1, 24 % max_log_events + 1)
+
+        r = rcls(tmpdir)
+        for i in range(25):
+            assert int(r.next()) == i
+        assert r.next() is None
+    except:
+        raise
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def test_TDSWriter_append_many_error_after_a_rotation():
+    """
+    On error the rows of the log DB being written are rolled back, and
+    the ones committed before the rotation are kept and published.
+    """
+    try:
+        tmpdir = mktemp()
+
+        def items():
+            yield from (b"1", b"2", b"3", b"4")
+            raise ValueError("Boom")
+
+        w = writer.TDSWriter(tmpdir, max_log_events=3)
+        positions = []
+        with pytest.raises(ValueError):
+            w._append_many(items(), positions)
+
+        assert positions == [(1, 1), (1, 2), (1, 3)]
+        assert w.written == (1, 3)
+        assert w._log_bytes == 0 and w._log_last == 0
+        assert w.append(b"5") == (2, 1)
+    except:
+        raise
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+@pytest.mark.parametrize("rcls,wcls", RW_IMPL)
+def test_Writer_max_log_bytes(rcls, wcls):
+    """The logs are rotated once `max_log_bytes` bytes were written."""
+    try:
+        tmpdir = mktemp()
+
+        w = wcls(tmpdir, max_log_bytes=10)
+        positions = [w.append(data)
+                     for data in (b"12345", b"1234", b"1", b"1234567890")]
+        positions.extend(w._append_many([b"123456", b"1234", b"12"]))
+        assert positions == [(1, 1), (1, 2), (1, 3), (2, 1),
+                             (3, 1), (3, 2), (4, 1)]
+    except:
+        raise
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+@pytest.mark.parametrize("rcls,wcls", RW_IMPL)
+def test_Writer_max_log_bytes_on_restart(rcls, wcls):
+    """A restarted writer counts the bytes of the rows already written."""
+    try:
+        tmpdir = mktemp()
+
+        w = wcls(tmpdir, max_log_bytes=10)
+        assert [w.append(b"12345"), w.append(b"1234")] == [(1, 1), (1, 2)]
+        w.close()
+
+        w = wcls(tmpdir, max_log_bytes=10)
+        assert [w.append(b"1"), w.append(b"1")] == [(1, 3), (2, 1)]
+        w.close()
+    except:
+        raise
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+@pytest.mark.parametrize("rcls,wcls", RW_IMPL)
+def test_Writer_max_log_bytes_stored(rcls, wcls):
+    """The size of the rows is kept in the log metadata and read back."""
+    from binlog.block import bytes_key, dump_bytes, load_bytes
+    try:
+        tmpdir = mktemp()
+
+        w = wcls(tmpdir, max_log_bytes=10)
+        w.append(b"12345")
+        w.append_many([b"12", b"12"])
+        assert load_bytes(w.logmeta.get(bytes_key(b'events.1'))) == 9
+        w.logmeta.put(bytes_key(b'events.1'), dump_bytes(10))
+        w.close()
+
+        w = wcls(tmpdir, max_log_bytes=10)
+        assert w.append(b"1") == (2, 1)
+        w.close()
+    except:
+        raise
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+@pytest.mark.parametrize("rcls,wcls", RW_IMPL)
+def test_Writer_max_log_age(rcls, wcls):
+    """The logs older than `max_log_age` are rotated, even on restart."""
+    try:
+        tmpdir = mktemp()
+
+        with patch('time.time', return_value=1000):
+            w = wcls(tmpdir, max_log_age=60)
+            assert w.append(b"1") == (1, 1)
+        with patch('time.time', return_value=1059):
+            assert w.append(b"2") == (1, 2)
+        w.close()
+
+        with patch('time.time', return_value=1060):
+            w = wcls(tmpdir, max_log_age=60)
+            assert w.append(b"3") == (2, 1)
+        w.close()
+
+        with patch('time.time', return_value=1200):
+            w = wcls(tmpdir, max_log_age=60)
+            w.set_current_log()
+            assert w._current_idx == 3
+            w.close()
+
+        with patch('time.time', return_value=1300):
+            # Nothing was written to the last log, it is not rotated.
+            w = wcls(tmpdir, max_log_age=60)
+            w.set_current_log()
+            assert w._current_idx == 3
+    except:
+        raise
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+#
+# Writer().prepare_next_log
+#
+@pytest.mark.parametrize("rcls,wcls", RW_IMPL)
+def test_Writer_prepare_next_log(rcls, wcls):
+    """The rotation uses the log created ahead of time."""
+    try:
+        tmpdir = mktemp()
+
+        w = wcls(tmpdir, max_log_events=2)
+        assert not w.prepare_next_log()
+        w.append(b"1")
+        assert w.prepare_next_log()
+        assert w.next_log_ready
+        assert os.path.isfile(os.path.join(tmpdir, writer.LOG_PREFIX + '.2'))
+
+        r = rcls(tmpdir)
+        assert r.last_available() == 1
+
+        assert [w.append(b"2"), w.append(b"3")] == [(1, 2), (2, 1)]
+        assert w.metrics['rotations'] == w.metrics['rotations_ahead'] == 1
+        assert w.metrics['rotation_last'] is not None
+        assert not w.next_log_ready
+
+        w.prepare_next_log()
+        assert [w.append(b"4"), w.append(b"5")] == [(2, 2), (3, 1)]
+        w.append(b"6")
+        assert w.metrics['rotations_ahead'] == 2
+
+        # Without a prepared log the rotation is done as usual.
+        assert w.append(b"7") == (4, 1)
+        assert w.metrics['rotations'] == 3
+
+        assert [int(r.next()) for _ in range(7)] == list(range(1, 8))
+    except:
+        raise
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+@pytest.mark.parametrize("rcls,wcls", RW_IMPL)
+def test_Writer_prepared_log_creation_time(rcls, wcls):
+    """
+    The prepared log gets a creation time when it is prepared, replaced
+    by the time of the rotation out of it.
+
+    """
+    from binlog.block import created_key, load_created
+    try:
+        tmpdir = mktemp()
+
+        w = wcls(tmpdir, max_log_events=1)
+        w.append(b"1")
+        with patch('time.time', return_value=100.0):
+            w.prepare_next_log()
+        key = created_key(b'events.2')
+        assert load_created(w.logmeta.get(key)) == 100.0
+
+        with patch('time.time', return_value=200.0):
+            assert w.append(b"2") == (2, 1)
+        assert w.metrics['rotations_ahead'] == 1
+        assert not w.next_log_ready
+        assert load_created(w.logmeta.get(key)) == 100.0
+
+        w.prepare_next_log()
+        assert load_created(w.logmeta.get(key)) == 200.0
+        w.close()
+    except:
+        raise
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def test_CDSWriter_prepared_log_rotated_by_other_writer():
+    """The prepared log is dropped if another writer rotated."""
+    try:
+        tmpdir = mktemp()
+
+        w1 = writer.CDSWriter(tmpdir, max_log_events=1)
+        w2 = writer.CDSWriter(tmpdir, max_log_events=1)
+        w1.append(b"1")
+        w1.prepare_next_log()
+        assert w2.append(b"2") == (2, 1)
+        assert w1.append(b"3") == (3, 1)
+        assert w1.metrics['rotations_ahead'] == 0
+    except:
+        raise
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+#
+# Writer(packed=True)
+#
+@pytest.mark.parametrize("rcls,wcls", RW_IMPL)
+def test_Writer_packed_append_many(rcls, wcls):
+    """The messages written together share rows of `block_size` bytes."""
+    try:
+        tmpdir = mktemp()
+
+        w = wcls(tmpdir, packed=True, block_size=4, max_log_events=2)
+        positions = w._append_many([b"ab", b"cd", b"ef", b"g", b"hijkl"])
+        assert positions == [(1, 1, 1), (1, 1, 2), (1, 2, 1), (1, 2, 2),
+                             (2, 1, 1)]
+        assert w.append(b"m") == (2, 2, 1)
+    except:
+        raise
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+@pytest.mark.parametrize("rcls,wcls", RW_IMPL)
+def test_Writer_packed_append_is_not_buffered(rcls, wcls):
+    """Every append() writes its message alone, in a block of one."""
+    try:
+        tmpdir = mktemp()
+
+        w = wcls(tmpdir, packed=True)
+        assert [w.append(b"a"), w.append(b"b")] == [(1, 1, 1), (1, 2, 1)]
+
+        r = rcls(tmpdir)
+        records = [r.next_record(), r.next_record()]
+        assert [(rec.value, rec.subcount) for rec in records] == [
+            (b"a", 1), (b"b", 1)]
+    except:
+        raise
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+@pytest.mark.parametrize("rcls,wcls", RW_IMPL)
+def test_Writer_packed_starts_a_new_log(rcls, wcls):
+    """A log is never written in two formats."""
+    try:
+        tmpdir = mktemp()
+
+        w = wcls(tmpdir)
+        assert w.append(b"raw") == (1, 1)
+        w.close()
+
+        w = wcls(tmpdir, packed=True)
+        assert w.append(b"packed") == (2, 1, 1)
+        w.close()
+
+        w = wcls(tmpdir, packed=True)
+        assert w.append(b"packed") == (2, 2, 1)
+        w.close()
+
+        w = wcls(tmpdir)
+        assert w.append(b"raw") == (3, 1)
+    except:
+        raise
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+@pytest.mark.parametrize("rcls,wcls", RW_IMPL)
+def test_Writer_compression(rcls, wcls):
+    """The codec is part of the format of a log."""
+    try:
+        tmpdir = mktemp()
+
+        with pytest.raises(ValueError):
+            wcls(tmpdir, compression='bogus')
+
+        w = wcls(tmpdir, compression='zlib')
+        assert w.append(b"x" * 1000) == (1, 1)
+        assert len(w.set_current_log().get(1)) < 100
+        w.close()
+
+        w = wcls(tmpdir, compression='zlib', zdict=b"xxxx")
+        assert w.append(b"x") == (2, 1)
+    except:
+        raise
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+#
+# Writer durability
+#
+@pytest.mark.parametrize("rcls,wcls", RW_IMPL)
+def test_Writer_unsupported_durability(rcls, wcls):
+    """Unknown durability modes are rejected."""
+    tmpdir = mktemp()
+    with pytest.raises(ValueError):
+        wcls(tmpdir, durability='sometimes')
+
+
+def test_TDSWriter_sync_durability():
+    """In `sync` mode every committed append is durable."""
+    try:
+        tmpdir = mktemp()
+
+        w = writer.TDSWriter(tmpdir, durability=writer.DURABILITY_SYNC)
+        pos = w.append(b"TEST DATA")
+        assert w.written == w.durable == pos
+    except:
+        raise
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+@pytest.mark.parametrize("durability", [writer.DURABILITY_NOSYNC,
+                                        writer.DURABILITY_WRITE_NOSYNC])
+def test_TDSWriter_nosync_durability(durability):
+    """In `nosync` modes appends are durable only after a flush."""
+    try:
+        tmpdir = mktemp()
+
+        w = writer.TDSWriter(tmpdir, durability=durability)
+        w.append(b"TEST DATA")
+        pos = w.append(b"TEST DATA")
+
+        assert w.written == pos
+        assert w.durable is None
+        assert w.flush() == pos
+        assert w.durable == pos
+    except:
+        raise
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+@pytest.mark.parametrize("rcls,wcls", RW_IMPL)
+def test_Writer_group_durability_flushes_every_n_records(rcls, wcls):
+    """In `group` mode the data is flushed every `group_size` records."""
+    try:
+        tmpdir = mktemp()
+
+        w = wcls(tmpdir, durability=writer.DURABILITY_GROUP,
+                 group_interval=3600, group_size=10)
+
+        for i in range(9):
+            w.append(b"TEST DATA")
+        assert w.durable is None
+
+        pos = w.append(b"TEST DATA")
+        assert w.durable == pos
+
+        first, last = w.append_many([b"TEST DATA"] * 25)
+        assert w.durable == last
+    except:
+        raise
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def test_GroupCommit_due_by_size_and_interval():
+    now = [0]
+    g = writer.GroupCommit(interval=1, size=3, clock=lambda: now[0])
+
+    assert not g.due()
+    g.add(2)
+    assert not g.due()
+    g.add(1)
+    assert g.due()
+
+    g.reset()
+    g.add(1)
+    assert not g.due()
+    now[0] = 1
+    assert g.due()
+
+
 #
 # Writer.delete
 #